@@ -0,0 +1,107 @@
+"""
+Moves old requests out of the live tables.
+
+Requests that went live or were discarded long ago are only looked at when
+someone digs through history, but they make up most of push_requests and
+slow down every scan of it. archive_requests moves them, along with their
+rows in push_pushcontents, push_checklist and push_removals, into the
+archive tables of db.ARCHIVES, a batch per transaction. APIs read archived
+rows when asked to with archive=1 (see db.with_archive).
+"""
+import logging
+import time
+
+import sqlalchemy as SA
+
+from pushmanager.core import db
+
+
+def _archivable_requests(before):
+    return SA.and_(
+        db.push_requests.c.state.in_(db.ARCHIVED_STATES),
+        # State changes leave modified alone, rows written before changed
+        # was added have none
+        SA.func.coalesce(db.push_requests.c.changed, db.push_requests.c.modified) < before,
+        # Ids of deleted rows can be handed out again (by SQLite, and by
+        # InnoDB after a restart), so the latest request always stays
+        db.push_requests.c.id < SA.select([SA.func.max(db.push_requests.c.id)]).as_scalar(),
+    )
+
+
+def archive_batch(before, batch_size):
+    """Archives up to batch_size requests last changed before the given
+    time, in one transaction.
+
+    :return: Number of requests archived
+    """
+    request_ids = []
+
+    def on_select(success, db_results):
+        if not success:
+            raise db.DatabaseError()
+        request_ids.extend(row['id'] for row in db_results)
+
+    db.execute_cb(
+        SA.select(
+            [db.push_requests.c.id],
+            _archivable_requests(before),
+            order_by=db.push_requests.c.id,
+            limit=batch_size,
+        ),
+        on_select
+    )
+    if not request_ids:
+        return 0
+
+    # Requests are checked again, in case they changed since the select
+    archived_ids = SA.select(
+        [db.push_requests_archive.c.id],
+        db.push_requests_archive.c.id.in_(request_ids)
+    )
+    queries = [
+        db.push_requests_archive.insert().from_select(
+            [column.name for column in db.push_requests.c],
+            db.push_requests.select(SA.and_(
+                db.push_requests.c.id.in_(request_ids),
+                _archivable_requests(before),
+            ))
+        ),
+    ]
+    for table, archive in db.ARCHIVES:
+        if table is db.push_requests:
+            continue
+        queries.append(archive.insert().from_select(
+            [column.name for column in table.c],
+            table.select(table.c.request.in_(archived_ids))
+        ))
+        queries.append(table.delete().where(table.c.request.in_(archived_ids)))
+    queries.append(db.push_requests.delete().where(db.push_requests.c.id.in_(archived_ids)))
+    # Requests that are not archived after all stay searchable
+    queries += db.search_index_delete_queries(archived_ids)
+
+    def on_archive(success, db_results):
+        if not success:
+            raise db.DatabaseError()
+
+    db.execute_transaction_cb(queries, on_archive)
+    return len(request_ids)
+
+
+def archive_requests(max_age, batch_size, now=None):
+    """Archives the requests that went live or were discarded more than
+    max_age days ago, batch_size requests per transaction.
+
+    :return: Number of requests archived
+    """
+    if now is None:
+        now = time.time()
+    before = int(now - max_age * 86400)
+
+    total = 0
+    while True:
+        archived = archive_batch(before, batch_size)
+        total += archived
+        if archived:
+            logging.info("Archived %d requests (%d so far)", archived, total)
+        if archived < batch_size:
+            return total
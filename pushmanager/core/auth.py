@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
+import functools
+import hashlib
+import hmac
 import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from Queue import Empty
+from Queue import LifoQueue
+from Queue import Queue
 
 import ldap
+import tornado.ioloop
 
+from pushmanager.core import metrics
 from pushmanager.core.settings import Settings
+from pushmanager.core.util import LRUCache
 
 
 os.environ['LDAPTLS_REQCERT'] = 'demand'
@@ -12,33 +24,178 @@ os.environ['LDAPTLS_CACERT'] = Settings['auth_ldap']['cert_file']
 
 LDAP_URL = Settings['auth_ldap']['url']
 
+# Number of credentials remembered by the cache of successful logins
+MAX_CACHED_CREDENTIALS = 1000
 
-def authenticate_ldap(username, password):
-    """Attempts to bind a given username/password pair in LDAP and returns whether or not it succeeded."""
-    try:
-        dn = "%s@%s" % (username, Settings['auth_ldap']['domain'])
-        basedn = Settings['auth_ldap']['basedn']
 
-        con = ldap.initialize(LDAP_URL)
+class LDAPConnectionPool(object):
+    """Keeps up to size idle StartTLS'd connections. Every authentication
+    binds again, so connections can be shared between users."""
+
+    def __init__(self, url, size):
+        self.url = url
+        self.size = size
+        self.idle = LifoQueue()
+
+    def _connect(self):
+        con = ldap.initialize(self.url)
 
         con.set_option(ldap.OPT_NETWORK_TIMEOUT, 3)
         con.set_option(ldap.OPT_REFERRALS, 0)
         con.set_option(ldap.OPT_PROTOCOL_VERSION, ldap.VERSION3)
 
         con.start_tls_s()
+        return con
+
+    def _discard(self, con):
+        try:
+            con.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    @contextmanager
+    def connection(self, fresh=False):
+        """Lends an idle connection, or a new one if there is none (or
+        fresh is set). Connections are only put back when they were used
+        without raising."""
+        con = None
+        if not fresh:
+            try:
+                con = self.idle.get_nowait()
+            except Empty:
+                pass
+        if con is None:
+            con = self._connect()
+
         try:
-            con.simple_bind_s(dn, password)
+            yield con
+        except:
+            self._discard(con)
+            raise
+
+        if self.idle.qsize() < self.size:
+            self.idle.put(con)
+        else:
+            self._discard(con)
+
+
+class LDAPAuthenticator(object):
+    """Authenticates against LDAP from a pool of worker threads, keeping the
+    IOLoop free. Successful logins are remembered for auth_ldap.cache_ttl
+    seconds, keyed by a salted hash of the credentials."""
+
+    def __init__(self, url, pool_size, cache_ttl):
+        self.pool = LDAPConnectionPool(url, pool_size)
+        self.threads = pool_size
+        self.cache_ttl = cache_ttl
+        self.cache = LRUCache(MAX_CACHED_CREDENTIALS)
+        self.cache_lock = threading.Lock()
+        # Never leaves this process, so cached hashes are useless elsewhere
+        self.salt = os.urandom(16)
+        self.work_queue = None
+        self.pid = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            LDAP_URL,
+            Settings['auth_ldap']['pool_size'],
+            Settings['auth_ldap']['cache_ttl'],
+        )
+
+    def _credentials_key(self, username, password):
+        return hmac.new(self.salt, '%s\0%s' % (username, password), hashlib.sha256).digest()
+
+    def _is_cached(self, key):
+        with self.cache_lock:
+            expires = self.cache.get(key)
+        return expires is not None and expires > time.time()
+
+    def _cache(self, key):
+        if self.cache_ttl > 0:
+            with self.cache_lock:
+                self.cache[key] = time.time() + self.cache_ttl
+
+    def _bind_and_search(self, username, password, fresh=False):
+        dn = "%s@%s" % (username, Settings['auth_ldap']['domain'])
+        basedn = Settings['auth_ldap']['basedn']
+
+        with self.pool.connection(fresh) as con:
+            try:
+                con.simple_bind_s(dn, password)
+            except ldap.INVALID_CREDENTIALS:
+                return False
             con.search_s(basedn, ldap.SCOPE_ONELEVEL)
+            return True
+
+    def authenticate(self, username, password):
+        """Attempts to bind a given username/password pair in LDAP and returns whether or not it succeeded."""
+        key = self._credentials_key(username, password)
+        cached = self._is_cached(key)
+        metrics.cache_lookup('ldap', cached)
+        if cached:
+            return True
+
+        start = time.time()
+        result = 'error'
+        try:
+            try:
+                success = self._bind_and_search(username, password)
+            except ldap.SERVER_DOWN:
+                # The server may have dropped an idle connection
+                success = self._bind_and_search(username, password, fresh=True)
+            result = 'success' if success else 'failure'
         except:
+            # Tornado will log POST data in case of an uncaught
+            # exception. In this case POST data will have username &
+            # password and we do not want it.
+            logging.exception("Authentication error")
             return False
-        con.unbind_s()
-        return True
-    except:
-        # Tornado will log POST data in case of an uncaught
-        # exception. In this case POST data will have username &
-        # password and we do not want it.
-        logging.exception("Authentication error")
-        return False
+        finally:
+            metrics.observe('pushmanager_ldap_duration_seconds', time.time() - start, {'result': result})
+
+        if success:
+            self._cache(key)
+        return success
+
+    def _start_workers(self):
+        if self.pid == os.getpid():
+            return
+        # Neither threads nor connections survive a fork, every tornado
+        # worker needs its own
+        self.pid = os.getpid()
+        self.pool.idle = LifoQueue()
+        self.work_queue = Queue()
+        for _ in range(self.threads):
+            worker = threading.Thread(target=self._work, name='ldap-auth')
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+        while True:
+            username, password, callback, io_loop = self.work_queue.get()
+            success = self.authenticate(username, password)
+            io_loop.add_callback(functools.partial(callback, success))
+
+    def authenticate_async(self, username, password, callback, io_loop=None):
+        """Like authenticate, but calls callback with the result on io_loop
+        (the global IOLoop by default) instead of blocking it."""
+        self._start_workers()
+        self.work_queue.put((username, password, callback, io_loop or tornado.ioloop.IOLoop.instance()))
+
+
+authenticator = LDAPAuthenticator.from_settings()
+
+
+def authenticate_ldap(username, password):
+    """Attempts to bind a given username/password pair in LDAP and returns whether or not it succeeded."""
+    return authenticator.authenticate(username, password)
+
+
+def authenticate_ldap_async(username, password, callback, io_loop=None):
+    """Authenticates from a worker thread, then calls callback with whether
+    or not it succeeded on io_loop."""
+    authenticator.authenticate_async(username, password, callback, io_loop)
 
 
-__all__ = ['authenticate_ldap']
+__all__ = ['authenticate_ldap', 'authenticate_ldap_async']
@@ -1,21 +1,37 @@
 import logging
+import os
+import time
 
 import sqlalchemy as SA
 from sqlalchemy import Column
 from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import SmallInteger
 from sqlalchemy import String
+from sqlalchemy import Text
 from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import visitors
 from sqlalchemy.sql.expression import Insert
+from sqlalchemy.sql.util import ClauseAdapter
 
+from pushmanager.core import metrics
 from pushmanager.core.settings import Settings
 
 
 engine = None
 Base = declarative_base()
 
+# Every process gets an engine of its own: one forked after init_db creates
+# a new engine the first time it runs a query, with the pool configured for
+# its role in Settings['db_pools'] (see set_pool_role).
+pool_role = None
+_engine_pid = None
+# Engine inherited from the parent process. Its connections are the
+# parent's, so it is kept referenced rather than closed.
+_parent_engine = None
+
 
 def UnsignedInteger():
     if Settings["db_uri"].startswith("mysql"):
@@ -28,6 +44,19 @@ class DatabaseError(Exception):
     pass
 
 
+def _change_time():
+    return int(time.time())
+
+
+class PushChangedPaths(Base):
+    __tablename__ = "push_changedpaths"
+
+    request = Column(Integer, primary_key=True, autoincrement=False)
+    revision = Column(String(40), primary_key=True)
+    # JSON list of the paths changed since the merge-base with master
+    paths = Column(Text)
+
+
 class PushCheckList(Base):
     __tablename__ = "push_checklist"
 
@@ -38,6 +67,46 @@ class PushCheckList(Base):
     target = Column(String(50), nullable=True)
 
 
+class PushConflictPairs(Base):
+    """Pickmes of a push that failed to merge on top of each other, with
+    request < other. Pairs are refreshed whenever request or other is
+    checked for conflicts."""
+    __tablename__ = "push_conflictpairs"
+
+    push = Column(Integer, primary_key=True, autoincrement=False)
+    request = Column(Integer, primary_key=True, autoincrement=False)
+    other = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class PushConflictDetails(Base):
+    """Output of the merges that failed when request (at revision) was
+    checked for conflicts, zlib compressed and truncated (size is the length
+    of the full output). other is the pickme the merge conflicted with, 0
+    for master. push_requests.conflicts only keeps a summary of them."""
+    __tablename__ = "push_conflictdetails"
+
+    request = Column(Integer, primary_key=True, autoincrement=False)
+    revision = Column(String(40), primary_key=True)
+    other = Column(Integer, primary_key=True, autoincrement=False)
+    output = Column(LargeBinary(length=2 ** 24 - 1), nullable=False)
+    size = Column(Integer, nullable=False)
+
+
+class PushDeploySteps(Base):
+    """Merges making up the deploy branch candidate of a push: step N merges
+    request onto base (origin/master for the first step, the sha of step
+    N-1 otherwise). A step whose merge failed has no sha and ends the
+    candidate."""
+    __tablename__ = "push_deploysteps"
+
+    push = Column(Integer, primary_key=True, autoincrement=False)
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    request = Column(Integer, nullable=False)
+    revision = Column(String(40), nullable=False)
+    base = Column(String(40), nullable=False)
+    sha = Column(String(40), nullable=True)
+
+
 class PushPlans(Base):
     __tablename__ = "push_plans"
 
@@ -99,44 +168,482 @@ class PushRequests(Base):
     reviewid = Column(Integer, nullable=True)
     description = Column(String)
     watchers = Column(String, nullable=True)
+    # Time of the last write to the row, set on every insert and update made
+    # through SQLAlchemy. Unlike modified, it also changes with the state,
+    # tags or revision of the request.
+    changed = Column(Integer, nullable=True, index=True, default=_change_time, onupdate=_change_time)
+
+
+class PushRequestComments(Base):
+    """Comments on a request, appended by CommentRequestServlet. The
+    comments column of push_requests only keeps those of its author."""
+    __tablename__ = "push_requestcomments"
+    __table_args__ = (SA.Index('ix_push_requestcomments_request', 'request', 'id'),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    request = Column(Integer, nullable=False)
+    user = Column(String(255), nullable=False)
+    comment = Column(Text, nullable=False)
+    created = Column(Integer, nullable=False)
+
+
+class PushUserDashboard(Base):
+    """Number of open requests of a user in each state, and the oldest
+    accepting push one of them is in. Users without open requests have no
+    row. Rows are refreshed by the queries of dashboard_queries."""
+    __tablename__ = "push_userdashboard"
+
+    user = Column(String(255), primary_key=True)
+    requested = Column(Integer, nullable=False, default=0)
+    pickme = Column(Integer, nullable=False, default=0)
+    added = Column(Integer, nullable=False, default=0)
+    # Deployed to stage, waiting to be verified by the user
+    staged = Column(Integer, nullable=False, default=0)
+    verified = Column(Integer, nullable=False, default=0)
+    blessed = Column(Integer, nullable=False, default=0)
+    delayed = Column(Integer, nullable=False, default=0)
+    accepting_push = Column(Integer, nullable=True)
+    modified = Column(Integer, nullable=True)
 
 
+push_changedpaths = PushChangedPaths.__table__
 push_checklist = PushCheckList.__table__
+push_conflictdetails = PushConflictDetails.__table__
+push_conflictpairs = PushConflictPairs.__table__
+push_deploysteps = PushDeploySteps.__table__
+push_requestcomments = PushRequestComments.__table__
 push_requests = PushRequests.__table__
 push_plans = PushPlans.__table__
 push_pushes = PushPushes.__table__
 push_pushcontents = PushPushContents.__table__
 push_removals = PushRemovals.__table__
+push_userdashboard = PushUserDashboard.__table__
+
+# States of requests counted in push_userdashboard
+OPEN_REQUEST_STATES = ('requested', 'pickme', 'added', 'staged', 'verified', 'blessed', 'delayed')
+
+
+def _archive_table(table, primary_key=(), index=None):
+    """Copy of table for archived rows. Row ids of push_checklist and
+    push_removals may be reused once archived, so they aren't unique in
+    their archive."""
+    columns = [
+        Column(column.name, column.type, primary_key=column.name in primary_key, autoincrement=False)
+        for column in table.columns
+    ]
+    if index is not None:
+        columns.append(SA.Index('ix_%s_archive_%s' % (table.name, index), index))
+    return SA.Table('%s_archive' % table.name, Base.metadata, *columns)
+
+
+# Requests in ARCHIVED_STATES, and the rows referring to them, are moved out
+# of the live tables into these by archive.archive_requests. Queries only
+# read them through with_archive.
+ARCHIVED_STATES = ('live', 'discarded')
+push_requests_archive = _archive_table(push_requests, primary_key=('id',))
+push_pushcontents_archive = _archive_table(push_pushcontents, primary_key=('request', 'push'))
+push_checklist_archive = _archive_table(push_checklist, index='request')
+push_removals_archive = _archive_table(push_removals, index='request')
+ARCHIVES = (
+    (push_requests, push_requests_archive),
+    (push_pushcontents, push_pushcontents_archive),
+    (push_checklist, push_checklist_archive),
+    (push_removals, push_removals_archive),
+)
+
+
+def _archive_adapter():
+    """Adapts queries of the archived tables to read their archives."""
+    adapter = None
+    for table, archive in ARCHIVES:
+        equivalents = dict((column, set([archive.c[column.name]])) for column in table.c)
+        table_adapter = ClauseAdapter(archive, equivalents=equivalents)
+        adapter = table_adapter if adapter is None else adapter.chain(table_adapter)
+    return adapter
+
+
+def with_archive(query):
+    """Returns query reading the rows of the archived tables it refers to
+    from both the live tables and their archives.
+
+    Requests are archived along with their rows in the other tables, so
+    this is the union of query and of query run against the archives, each
+    side with the filters (and indexes) of query. Ordering, limit and
+    offset apply to the union; with a limit, each side only returns as
+    many rows as the union may need. Grouped queries are combined with
+    UNION, which is only right for queries selecting the grouped columns.
+    Use count_with_archive to count rows.
+    """
+    order_by = list(query._order_by_clause)
+    limit, offset = query._limit, query._offset
+    selected = len(query.c)
+
+    # Whole tables (as in table.select()) are selected column by column,
+    # for the adapter to replace. Columns ordered by are selected too, so
+    # that the union can be ordered.
+    query = query.with_only_columns(list(query.inner_columns)).order_by(None).limit(None).offset(None)
+    order_columns = []
+    for clause in order_by:
+        for column in visitors.iterate(clause, {}):
+            if isinstance(column, SA.Column) and column not in order_columns:
+                order_columns.append(column)
+    for i, column in enumerate(order_columns):
+        query = query.column(column.label('order_%d' % i))
+
+    adapter = _archive_adapter()
+    sides = [(query, order_by), (adapter.traverse(query), [adapter.traverse(clause) for clause in order_by])]
+    if limit is not None:
+        sides = [
+            (side.order_by(*side_order_by).limit(limit + (offset or 0)).alias().select(), side_order_by)
+            for side, side_order_by in sides
+        ]
+    union = SA.union if list(query._group_by_clause) else SA.union_all
+    rows = union(*[side for side, _ in sides]).alias('with_archive')
+
+    rows_adapter = ClauseAdapter(rows)
+    return SA.select(
+        list(rows.c)[:selected],
+        order_by=[rows_adapter.traverse(clause) for clause in order_by],
+        limit=limit,
+        offset=offset,
+    )
+
+
+def count_with_archive(query):
+    """Returns a query counting the rows of with_archive(query)."""
+    return SA.select([SA.func.count()]).select_from(with_archive(query).alias('counted'))
+
+
+# Full-text index of the title, description and comments of requests. On
+# SQLite this is an FTS5 table keyed by rowid (FTS4 where SQLite predates
+# FTS5), on MySQL a table with a FULLTEXT index keyed by id (see UPDATING).
+# Either way its rows are refreshed from push_requests and
+# push_requestcomments by the queries of search_index_queries.
+SEARCH_INDEX = "push_requestsearch"
+SEARCH_COLUMNS = "title, description, comments"
+# SQLite modules the search index can be created with, in order of preference
+SEARCH_MODULES = ("fts5", "fts4")
+# Module of the SQLite search index, None where SQLite has none of
+# SEARCH_MODULES and requests are searched with LIKE (see create_search_index)
+search_module = None
+
+
+def _search_indexed():
+    return engine.name != "sqlite" or search_module is not None
+
+
+def _search_index_key():
+    return "rowid" if engine.name == "sqlite" else "id"
+
+
+def _search_index_rows():
+    """Selects the search index rows of requests, their comments being
+    those of the author followed by the ones in push_requestcomments."""
+    if engine.name == "sqlite":
+        comments = (
+            "COALESCE(comments, '') || ' ' || COALESCE((SELECT group_concat(comment, ' ') "
+            "FROM push_requestcomments WHERE request = push_requests.id), '')"
+        )
+    else:
+        comments = (
+            "CONCAT_WS(' ', comments, (SELECT GROUP_CONCAT(comment SEPARATOR ' ') "
+            "FROM push_requestcomments WHERE request = push_requests.id))"
+        )
+    return "SELECT id, title, description, %s FROM push_requests" % comments
+
+
+def _create_search_index_table(conn):
+    """Returns the module of the SQLite search index, creating it with the
+    first of SEARCH_MODULES SQLite supports if it does not exist yet."""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", SEARCH_INDEX).scalar()
+    if sql is not None:
+        return "fts5" if "fts5" in sql.lower() else "fts4"
+
+    for module in SEARCH_MODULES:
+        try:
+            conn.execute("CREATE VIRTUAL TABLE %s USING %s(%s)" % (SEARCH_INDEX, module, SEARCH_COLUMNS))
+            return module
+        except SA.exc.OperationalError:
+            logging.info("SQLite has no %s module.", module)
+    return None
+
+
+def create_search_index(conn):
+    """Creates the SQLite search index, and indexes requests missing from it.
+
+    Without any of SEARCH_MODULES, there is no index and requests are
+    searched with LIKE instead.
+    """
+    global search_module
+    search_module = _create_search_index_table(conn)
+    if search_module is None:
+        logging.warning("SQLite supports none of %s, requests will be searched without an index.",
+                        ", ".join(SEARCH_MODULES))
+        return
+
+    conn.execute(
+        "INSERT INTO %(index)s (rowid, %(columns)s) %(rows)s "
+        "WHERE id NOT IN (SELECT rowid FROM %(index)s)" % {
+            'index': SEARCH_INDEX,
+            'columns': SEARCH_COLUMNS,
+            'rows': _search_index_rows(),
+        }
+    )
+
+
+def search_index_queries(request_id=None, inserted=False):
+    """Queries refreshing the search index entry of a request (of all
+    requests if request_id is None), to be run in the transaction updating
+    it, after the update. With inserted, indexes the request inserted by the
+    previous query of the transaction instead."""
+    if not _search_indexed():
+        return []
+    params = {
+        'index': SEARCH_INDEX,
+        'key': _search_index_key(),
+        'columns': SEARCH_COLUMNS,
+        'rows': _search_index_rows(),
+    }
+    delete = "DELETE FROM %(index)s" % params
+    insert = "INSERT INTO %(index)s (%(key)s, %(columns)s) %(rows)s" % params
+    if inserted:
+        last_insert_id = "last_insert_rowid()" if engine.name == "sqlite" else "LAST_INSERT_ID()"
+        return [SA.text(insert + " WHERE id = %s" % last_insert_id)]
+    if request_id is None:
+        return [SA.text(delete), SA.text(insert)]
+    return [
+        SA.text(delete + " WHERE %(key)s = :id" % params).bindparams(id=request_id),
+        SA.text(insert + " WHERE id = :id").bindparams(id=request_id),
+    ]
+
+
+def search_index_delete_queries(request_ids):
+    """Queries removing requests from the search index, request_ids being a
+    list of ids or a query selecting them."""
+    if not _search_indexed():
+        return []
+    key = SA.sql.column(_search_index_key())
+    index = SA.sql.table(SEARCH_INDEX, key)
+    return [index.delete().where(key.in_(request_ids))]
+
+
+def search_requests_query(terms, limit):
+    """Returns a query for the requests matching terms, best matches first.
+
+    FTS4 does not rank matches, nor does LIKE; they are returned latest
+    first instead.
+    """
+    if not _search_indexed():
+        # Every term in the title, description or comments of the request
+        return SA.select(
+            [push_requests],
+            SA.and_(*[
+                SA.or_(
+                    push_requests.c.title.like('%' + term + '%'),
+                    push_requests.c.description.like('%' + term + '%'),
+                    push_requests.c.comments.like('%' + term + '%'),
+                    SA.exists().where(SA.and_(
+                        push_requestcomments.c.request == push_requests.c.id,
+                        push_requestcomments.c.comment.like('%' + term + '%'),
+                    )),
+                )
+                for term in terms.split()
+            ]),
+            order_by=push_requests.c.id.desc(),
+            limit=limit,
+        )
+    if engine.name == "sqlite":
+        # Quoted, so that user input is never parsed as FTS query syntax
+        terms = " ".join('"%s"' % term.replace('"', '""') for term in terms.split())
+        order_by = "%s.rank" % SEARCH_INDEX if search_module == "fts5" else "push_requests.id DESC"
+        return SA.text(
+            "SELECT push_requests.* FROM %(index)s "
+            "JOIN push_requests ON push_requests.id = %(index)s.rowid "
+            "WHERE %(index)s MATCH :terms ORDER BY %(order_by)s LIMIT :limit" % {
+                'index': SEARCH_INDEX,
+                'order_by': order_by,
+            }
+        ).bindparams(terms=terms, limit=limit)
+    match = "MATCH (%s) AGAINST (:terms IN NATURAL LANGUAGE MODE)" % ", ".join(
+        "%s.%s" % (SEARCH_INDEX, column.strip()) for column in SEARCH_COLUMNS.split(",")
+    )
+    return SA.text(
+        "SELECT push_requests.* FROM %(index)s "
+        "JOIN push_requests ON push_requests.id = %(index)s.id "
+        "WHERE %(match)s ORDER BY %(match)s DESC LIMIT :limit" % {'index': SEARCH_INDEX, 'match': match}
+    ).bindparams(terms=terms, limit=limit)
+
+
+def users_of_requests(request_ids):
+    """Selects the owners of requests, for dashboard_queries."""
+    # Aliased, so that it is not correlated with the requests of the dashboard
+    requests = push_requests.alias()
+    return SA.select([requests.c.user]).where(requests.c.id.in_(request_ids))
+
+
+def users_of_push(push_id):
+    """Selects the owners of requests in a push, for dashboard_queries."""
+    requests = push_requests.alias()
+    return SA.select([requests.c.user]).where(SA.and_(
+        push_pushcontents.c.push == push_id,
+        push_pushcontents.c.request == requests.c.id,
+    ))
+
+
+def dashboard_queries(users=None):
+    """Queries recomputing the dashboards of users (of everyone if users
+    is None). State changes use refresh_dashboards to run them once the
+    change committed.
+
+    :param users: List of user names, or a select of them
+    """
+    delete_query = push_userdashboard.delete()
+    requests_filter = push_requests.c.state.in_(OPEN_REQUEST_STATES)
+    if users is not None:
+        delete_query = delete_query.where(push_userdashboard.c.user.in_(users))
+        requests_filter = SA.and_(requests_filter, push_requests.c.user.in_(users))
+
+    pushes_requests = push_requests.alias()
+    accepting_push = SA.select([push_pushes.c.id]).where(SA.and_(
+        push_pushes.c.state == 'accepting',
+        push_pushcontents.c.push == push_pushes.c.id,
+        push_pushcontents.c.request == pushes_requests.c.id,
+        pushes_requests.c.user == push_requests.c.user,
+    )).order_by(push_pushes.c.created.asc()).limit(1).as_scalar()
+
+    columns = [push_requests.c.user]
+    for state in OPEN_REQUEST_STATES:
+        columns.append(SA.func.sum(SA.case([(push_requests.c.state == state, 1)], else_=0)))
+    columns.extend([accepting_push, SA.literal(int(time.time()))])
+
+    insert_query = push_userdashboard.insert().from_select(
+        ['user'] + list(OPEN_REQUEST_STATES) + ['accepting_push', 'modified'],
+        SA.select(columns).where(requests_filter).group_by(push_requests.c.user),
+    )
+    return [delete_query, insert_query]
+
+
+def select_users(users_query):
+    """Runs a users_of_* select, for owners that are about to leave it."""
+    users = []
+
+    def on_db_return(success, db_results):
+        if success:
+            users.extend(row[0] for row in db_results)
+    execute_cb(users_query, on_db_return)
+    return users
+
+
+def refresh_dashboards(users=None, attempts=2):
+    """Recomputes the dashboards of users in a transaction of their own, to
+    be called after the transaction changing the state of their requests
+    committed. Concurrent refreshes of a dashboard may deadlock on InnoDB;
+    those are retried, and a failed refresh never rolls back the change.
+
+    :param users: As in dashboard_queries
+    """
+    for _ in range(attempts):
+        results = []
+        execute_transaction_cb(dashboard_queries(users), lambda success, _: results.append(success))
+        if results == [True]:
+            return True
+    logging.error("Could not refresh dashboards of %s" % (users if isinstance(users, list) else 'users'))
+    return False
+
+
+def set_pool_role(role):
+    """Sets the role (a key of Settings['db_pools']) whose pool settings
+    processes forked from now on use."""
+    global pool_role
+    pool_role = role
+
+
+def _create_engine():
+    global engine, _engine_pid
+    options = {'pool_recycle': 3600}
+    if pool_role is not None:
+        options.update(Settings['db_pools'][pool_role])
+    if Settings["db_uri"].startswith("sqlite"):
+        # SQLite databases are not pooled
+        options = {'pool_recycle': options['pool_recycle']}
+    engine = SA.create_engine(Settings['db_uri'], **options)
+    _engine_pid = os.getpid()
+
+
+def _check_pid():
+    global _parent_engine
+    if engine is not None and _engine_pid != os.getpid():
+        _parent_engine = engine
+        _create_engine()
+
+
+def _connect():
+    """Checks out a connection of this process' pool, recording how long it
+    took to get one."""
+    _check_pid()
+    labels = {'role': pool_role or 'default'}
+    start = time.time()
+    try:
+        return engine.connect()
+    except SA.exc.TimeoutError:
+        metrics.inc('pushmanager_db_pool_timeouts_total', labels)
+        raise
+    finally:
+        metrics.observe('pushmanager_db_pool_wait_seconds', time.time() - start, labels)
 
 
 def init_db():
-    global engine
     if engine is None:
-        engine = SA.create_engine(Settings['db_uri'], pool_recycle=3600)
+        _create_engine()
 
         if Settings["db_uri"].startswith("sqlite"):
             # Prepare tables when using sqlite database
             logging.info("Creating sqlite database.")
             Base.metadata.create_all(engine)
+            conn = engine.connect()
+            with conn.begin():
+                create_search_index(conn)
+                for query in dashboard_queries():
+                    conn.execute(query)
+            conn.close()
+
+        # Processes forked from here on must not share connections
+        engine.dispose()
 
 
 def finalize_db():
-    global engine
+    global engine, _engine_pid, _parent_engine, search_module
     engine = None
+    _engine_pid = None
+    _parent_engine = None
+    search_module = None
+
+
+def _observe_query(call_site, start):
+    metrics.observe(
+        'pushmanager_db_query_duration_seconds',
+        time.time() - start,
+        {'call_site': call_site},
+    )
 
 
 def execute_cb(query, callback_fn):
     success = True
+    call_site = metrics.caller_name()
+    start = time.time()
+    conn = None
     try:
-        conn = engine.connect()
+        conn = _connect()
         results = conn.execute(query)
     except Exception:
         results = None
         success = False
         logging.error("Error executing query: %s" % str(query.compile()))
     finally:
+        _observe_query(call_site, start)
         callback_fn(success, results)
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 
 def execute_transaction_cb(queries, callback_fn, condition=None):
@@ -155,10 +662,13 @@ def execute_transaction_cb(queries, callback_fn, condition=None):
     result. Only if check function returns true we'll move on with
     executing the querires list.
     """
+    call_site = metrics.caller_name()
+    start = time.time()
+    conn = None
     try:
         success = True
         results = []
-        conn = engine.connect()
+        conn = _connect()
         transaction = conn.begin()
         try:
             if condition:
@@ -180,8 +690,10 @@ def execute_transaction_cb(queries, callback_fn, condition=None):
             "Error executing transaction: %s" % "\n".join([str(q.compile()) for q in queries])
         )
     finally:
+        _observe_query(call_site, start)
         callback_fn(success, results)
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 
 class InsertIgnore(Insert):
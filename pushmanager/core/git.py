@@ -13,18 +13,32 @@ can be enqueued:
 Notifications for verify failures and pickme conflicts are sent to the XMPP and
 Mail queues.
 """
+import fcntl
 import functools
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
+import signal
 import subprocess
+import threading
 import time
 import urllib2
+import urlparse
+import zlib
+from multiprocessing import BoundedSemaphore
 from multiprocessing import JoinableQueue
 from multiprocessing import Process
+from multiprocessing import Semaphore
+from Queue import Empty
 from urllib import urlencode
 
 from . import db
+from . import metrics
 from .mail import MailQueue
+from .ratelimit import AdaptiveThrottle
 from contextlib import contextmanager
 from pushmanager.core.settings import Settings
 from pushmanager.core.util import add_to_tags_str
@@ -32,7 +46,9 @@ from pushmanager.core.util import del_from_tags_str
 from pushmanager.core.util import EscapedDict
 from pushmanager.core.util import tags_contain
 from pushmanager.core.xmppclient import XMPPQueue
+from sqlalchemy import and_
 from sqlalchemy import or_
+from sqlalchemy import select
 from tornado.escape import xhtml_escape
 
 
@@ -88,6 +104,9 @@ def git_reset_to_ref(starting_ref, git_directory):
     Resets a git repo to the specified ref.
     Called as a cleanup fn by git_merge_context_manager.
 
+    Submodule checkouts are only synced when the commits that were rolled
+    back moved a gitlink.
+
     :param starting_ref: Git hash of the commit to roll back to
     """
 
@@ -98,6 +117,10 @@ def git_reset_to_ref(starting_ref, git_directory):
         cwd=git_directory
     ).run()
 
+    # reset leaves the commit we were on in ORIG_HEAD
+    if not _get_changed_gitlinks(git_directory, 'ORIG_HEAD', 'HEAD'):
+        return
+
     GitCommand(
         'submodule',
         '--quiet',
@@ -113,139 +136,317 @@ def git_reset_to_ref(starting_ref, git_directory):
     ).run()
 
 
-def _stale_submodule_check(cwd):
-    """
-    Checks that no submodules in the git repository path specified by cwd are
-    out of date or too new.
+GITLINK_MODE = '160000'
 
-    If any out of date submodules are found, update them.
 
-    Once all submodules are up to date, calls _check_submodule on each
-    changed submodule.
+def _get_changed_gitlinks(cwd, old_ref, new_ref):
+    """
+    Finds the submodules whose gitlink differs between two commits, without
+    looking at (or updating) any submodule checkout.
+
     :param cwd: On-disk path of the git repo to work with
+    :return: Dict of submodule path -> (old SHA, new SHA). The old or new SHA
+        is None for submodules that were added or removed.
     """
+    diff_tree = GitCommand('diff-tree', '-r', '--no-abbrev', old_ref, new_ref, cwd=cwd)
+    diff_out = diff_tree.run()[1]
 
-    stale_submodules = GitCommand('submodule', 'status', cwd=cwd)
-    _, submodule_out, _ = stale_submodules.run()
-    submodule_out = submodule_out.strip()
+    gitlinks = {}
+    for line in diff_out.splitlines():
+        # :<old mode> <new mode> <old sha> <new sha> <status>\t<path>
+        try:
+            info, path = line.split('\t', 1)
+            old_mode, new_mode, old_sha, new_sha, _ = info.lstrip(':').split()
+        except ValueError:
+            continue
+        if GITLINK_MODE not in (old_mode, new_mode):
+            continue
+        gitlinks[path] = (
+            old_sha if old_mode == GITLINK_MODE else None,
+            new_sha if new_mode == GITLINK_MODE else None,
+        )
+    return gitlinks
 
-    # If nothing was returned, there are no submodules to check
-    if len(submodule_out) == 0:
-        return
 
-    submodule_lines = submodule_out.split('\n')
-    stale_submodules = []
-    for submodule_line in submodule_lines:
+def _with_parent_directories(paths):
+    directories = set()
+    for path in paths:
+        while '/' in path:
+            path = path.rsplit('/', 1)[0]
+            directories.add(path)
+    return directories | set(paths)
+
+
+def changed_paths_overlap(paths, other_paths):
+    """
+    Whether merging two branches that change the given paths can conflict:
+    they change a common path (gitlinks and .gitmodules included), or one
+    of them changes a path the other needs as a directory.
+    """
+    paths = set(paths)
+    other_paths = set(other_paths)
+    return bool(
+        paths & _with_parent_directories(other_paths) or
+        other_paths & _with_parent_directories(paths)
+    )
+
+
+CONFLICT_LINE_RE = re.compile(r'^CONFLICT \([^)]*\): (?:Merge conflict in |Rename )?(\S+)', re.M)
+
+
+def conflicting_paths(output):
+    """Paths git reported as conflicting in the output of a failed merge,
+    in order and without duplicates."""
+    paths = []
+    for path in CONFLICT_LINE_RE.findall(output or ''):
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def compress_conflict_output(output, limit):
+    """Compresses the first limit bytes of the output of a failed merge.
+
+    :return: Tuple of the compressed output and the length of the full output
+    """
+    if isinstance(output, unicode):
+        output = output.encode('utf-8')
+    return zlib.compress(output[:limit]), len(output)
+
+
+def decompress_conflict_output(compressed):
+    return zlib.decompress(compressed).decode('utf-8', 'replace')
+
+
+def _get_stale_submodules(cwd):
+    """
+    Finds submodules whose checkout differs from the gitlink recorded in HEAD.
+
+    :param cwd: On-disk path of the git repo to work with
+    :return: Dict of submodule path -> (checked out SHA, recorded SHA)
+    """
+    _, submodule_out, _ = GitCommand('submodule', 'status', cwd=cwd).run()
+
+    stale_submodules = {}
+    for submodule_line in submodule_out.splitlines():
+        if not submodule_line or submodule_line[0] not in ('-', '+'):
+            continue
         try:
-            _, path, _ = submodule_line.strip().split(' ')
-            if submodule_line[0] == '-' or submodule_line[0] == '+':
-                stale_submodules.append(path)
+            checked_out_sha, path = submodule_line[1:].split()[:2]
         except ValueError:
             logging.error("Failed to unpack line %s", submodule_line)
+            continue
+
+        _, tree_out, _ = GitCommand('ls-tree', 'HEAD', '--', path, cwd=cwd).run()
+        recorded_sha = tree_out.split()[2] if tree_out.strip() else None
+        if submodule_line[0] == '-':
+            # Not initialized, nothing is checked out
+            checked_out_sha = None
+        stale_submodules[path] = (checked_out_sha, recorded_sha)
+    return stale_submodules
+
+
+def _stale_submodule_check(cwd, changed_gitlinks=None):
+    """
+    Checks that no submodules in the git repository path specified by cwd are
+    out of date or too new.
+
+    Only submodules whose gitlink changed are looked at, and their history is
+    read from a submodule cache shared by all workers (see
+    _update_submodule_cache) instead of fetching into every checkout.
+
+    :param cwd: On-disk path of the git repo to work with
+    :param changed_gitlinks: Dict of submodule path -> (old SHA, new SHA), as
+        returned by _get_changed_gitlinks. If not given, submodules whose
+        checkout differs from HEAD are checked.
+    """
+
+    if changed_gitlinks is None:
+        changed_gitlinks = _get_stale_submodules(cwd)
+
+    # Removed submodules have nothing left to check
+    changed_gitlinks = dict(
+        (path, shas) for path, shas in changed_gitlinks.iteritems()
+        if shas[1] is not None
+    )
 
     # If there are no stale submodules, nothing to do
-    if len(stale_submodules) == 0:
+    if not changed_gitlinks:
         return
 
     logging.info("Submodules touched in this branch: %s",
-                 ' '.join(stale_submodules))
-    old_shas = GitCommand(
-        'submodule', 'foreach', '--quiet',
-        'echo "$path\t$(git rev-parse HEAD | cut -c-7)"',
-        cwd=cwd
-    )
-    _, old_shas_out, _ = old_shas.run()
-    old_shas_out = old_shas_out.strip()
-    old_sha_list = old_shas_out.split('\n')
+                 ' '.join(sorted(changed_gitlinks)))
 
-    GitCommand('submodule', '--quiet', 'sync', cwd=cwd).run()
+    submodule_urls = _get_submodule_urls(cwd)
+    for path, (old_sha, new_sha) in sorted(changed_gitlinks.iteritems()):
+        if path not in submodule_urls:
+            exn_text = "Submodule error: %s is not listed in .gitmodules" % path
+            raise GitException(
+                exn_text,
+                gitret=-1,
+                gitout=exn_text,
+                giterr=exn_text
+            )
+        cache_path = _update_submodule_cache(submodule_urls[path], old_sha, new_sha)
+        _check_submodule(cache_path, path, old_sha, new_sha)
 
-    # Only fetch changed submodules
-    for submodule in stale_submodules:
-        GitCommand('submodule', 'update', '--init', submodule, cwd=cwd).run()
-        GitCommand('--git-dir=%s/.git' % submodule, 'fetch', cwd=cwd).run()
 
-    _check_submodule(cwd, stale_submodules, old_sha_list)
+def _get_submodule_urls(cwd):
+    """
+    Reads .gitmodules of the working tree at cwd.
+
+    :return: Dict of submodule path -> absolute submodule URL
+    """
+    _, config_out, _ = GitCommand('config', '-f', '.gitmodules', '--list', cwd=cwd).run()
+
+    names_to_paths = {}
+    names_to_urls = {}
+    for line in config_out.splitlines():
+        key, _, value = line.partition('=')
+        if not key.startswith('submodule.'):
+            continue
+        name, _, attribute = key[len('submodule.'):].rpartition('.')
+        if attribute == 'path':
+            names_to_paths[name] = value
+        elif attribute == 'url':
+            names_to_urls[name] = value
+
+    submodule_urls = {}
+    for name, path in names_to_paths.iteritems():
+        url = names_to_urls.get(name)
+        if not url:
+            continue
+        if url.startswith('./') or url.startswith('../'):
+            # Relative URLs are relative to the superproject's origin
+            _, origin_url, _ = GitCommand('config', 'remote.origin.url', cwd=cwd).run()
+            url = urlparse.urljoin(origin_url.strip().rstrip('/') + '/', url)
+        submodule_urls[path] = url
+    return submodule_urls
+
+
+def _get_submodule_cache_path(url):
+    name = os.path.basename(url.rstrip('/'))
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    return os.path.join(
+        Settings['git']['local_repo_path'],
+        'submodule-cache',
+        '%s.%s.git' % (name, hashlib.sha1(url).hexdigest()[:12])
+    )
 
 
-def _check_submodule(cwd, submodule_names, old_shas):
+def _update_submodule_cache(url, old_sha, new_sha):
     """
-    Checks that submodules
-        - Have a master branch
-        - Have been pushed to their master
-        - if the local and remote version differ, ensure that they can be
-          fast-forwarded.
+    Makes sure the shared mirror of the submodule at url can answer questions
+    about old_sha and new_sha, and returns its on-disk path.
 
-    If any of these fail, raise a GitException with some details.
+    The mirror is only fetched when it doesn't know about new_sha being in
+    one of its branches yet, or is missing old_sha. Mirrors are shared between conflict
+    workers, updates are serialized with a lock file.
+    """
+    cache_path = _get_submodule_cache_path(url)
 
-    :param cwd: On-disk path of the git repo to work with
-    :param submodule_names: List of names (relative paths) of submodules to check
-    :param old_shas: List of SHAs of the current versions of the submodules
+    def up_to_date():
+        if not os.path.isdir(cache_path):
+            return False
+        query = GitQueryService.for_repo(cache_path)
+        if old_sha and not query.object_exists(old_sha):
+            return False
+        return _check_submodule_head_is_in_master(cache_path, new_sha)
+
+    cached = up_to_date()
+    metrics.cache_lookup('git-submodule', cached)
+    if cached:
+        return cache_path
+
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Created by another worker in the meantime
+            pass
+
+    with open('%s.lock' % cache_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another worker may have updated the mirror while we waited
+            if not up_to_date():
+                if os.path.isdir(cache_path):
+                    GitCommand('fetch', '--prune', 'origin', cwd=cache_path).run()
+                else:
+                    try:
+                        GitCommand('clone', '--mirror', url, cache_path).run()
+                    except GitException:
+                        shutil.rmtree(cache_path, ignore_errors=True)
+                        raise
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    return cache_path
+
+
+def _check_submodule(cache_path, name, old_sha, new_sha):
     """
+    Checks that a submodule
+        - Has a master branch
+        - Has been pushed to its master
+        - if the old and new version differ, can be fast-forwarded.
 
-    for name in submodule_names:
-        if _check_submodule_has_a_master(cwd, name):
-            if not _check_submodule_head_is_in_master(cwd, name):
-                exn_text = (
-                    "Submodule error: %s has not been pushed to 'master'"
-                    % name
-                )
-                raise GitException(
-                    exn_text,
-                    gitret=-1,
-                    gitout=exn_text,
-                    giterr=exn_text
-                    )
+    If any of these fail, raise a GitException with some details.
 
-        # Find the sha that corresponds to the outdated submodule
-        old_sha = None
-        for sha in old_shas:
-            if sha.startswith(name):
-                old_sha = sha.split('\t')[1]
+    :param cache_path: On-disk path of the submodule cache to work with
+    :param name: Name (relative path) of the submodule to check
+    :param old_sha: SHA of the submodule before the change, None if the
+        submodule is new
+    :param new_sha: SHA of the submodule after the change
+    """
 
-        if not _check_submodule_is_fast_forward(cwd, name, old_sha):
+    if _check_submodule_has_a_master(cache_path):
+        if not _check_submodule_head_is_in_master(cache_path, new_sha):
             exn_text = (
-                "Submodule Error: %s is not a fast forward of %s"
-                % (name, old_sha)
+                "Submodule error: %s has not been pushed to 'master'"
+                % name
             )
             raise GitException(
                 exn_text,
                 gitret=-1,
                 gitout=exn_text,
                 giterr=exn_text
-            )
+                )
 
+    if old_sha and not _check_submodule_is_fast_forward(cache_path, old_sha, new_sha):
+        exn_text = (
+            "Submodule Error: %s is not a fast forward of %s"
+            % (name, old_sha)
+        )
+        raise GitException(
+            exn_text,
+            gitret=-1,
+            gitout=exn_text,
+            giterr=exn_text
+        )
 
-def _check_submodule_is_fast_forward(cwd, submodule_name, old_sha):
-    submodule_path = os.path.join(cwd, submodule_name)
-    _, new_sha, _ = GitCommand('rev-parse', 'HEAD', cwd=submodule_path).run()
-    _, submodule_out, _ = GitCommand(
-        'rev-list', '-n1', '%s..%s'
-        % (new_sha.strip(), old_sha), cwd=submodule_path
-    ).run()
-    if len(submodule_out.strip()) > 0:
-        return False
-    return True
 
-
-def _check_submodule_has_a_master(cwd, submodule_name):
-    submodule_path = os.path.join(cwd, submodule_name)
-    _, branch_output, _ = GitCommand('branch', '-r', cwd=submodule_path).run()
-    if "origin/master" in branch_output:
-        return True
-    else:
-        return False
+def _check_submodule_is_fast_forward(cache_path, old_sha, new_sha):
+    return GitQueryService.for_repo(cache_path).is_ancestor(old_sha, new_sha)
 
 
-def _check_submodule_head_is_in_master(cwd, submodule_name):
-    submodule_path = os.path.join(cwd, submodule_name)
+def _check_submodule_has_a_master(cache_path):
+    query = GitQueryService.for_repo(cache_path)
+    return query.rev_parse('refs/heads/master') is not None
 
-    _, head_sha, _ = GitCommand('rev-parse', 'HEAD', cwd=submodule_path).run()
-    _, branch_output, _ = GitCommand(
-        'branch', '-r', '--contains', head_sha.strip(),
-        cwd=submodule_path
-    ).run()
 
+def _check_submodule_head_is_in_master(cache_path, sha):
+    """Whether sha has been pushed to the submodule's origin, i.e. is
+    contained in any of its branches. Master is asked first, it answers
+    for nearly every submodule bump without forking a process."""
+    query = GitQueryService.for_repo(cache_path)
+    if query.is_ancestor(sha, 'refs/heads/master'):
+        return True
+    if not query.object_exists(sha):
+        return False
+    _, branch_output, _ = GitCommand('branch', '--contains', sha, cwd=cache_path).run()
     return len(branch_output.strip()) > 0
 
 
@@ -258,14 +459,14 @@ def git_merge_context_manager(test_branch, master_repo_path):
     """
 
     # Store the starting ref so that we can hard reset if need be
-    get_starting_ref = GitCommand(
-        'rev-parse',
-        test_branch,
-        cwd=master_repo_path
-    )
-    _, stdout, _ = get_starting_ref.run()
-
-    starting_ref = stdout.strip()
+    starting_ref = GitQueryService.for_repo(master_repo_path).rev_parse(test_branch)
+    if starting_ref is None:
+        raise GitException(
+            "GitException: unable to resolve %s" % test_branch,
+            gitret=-1,
+            gitout='',
+            giterr="Unknown revision %s" % test_branch
+        )
 
     try:
         yield
@@ -283,6 +484,21 @@ class GitTaskAction(object):
     TEST_PICKME_CONFLICT = 2
     TEST_ALL_PICKMES = 3
     TEST_CONFLICTING_PICKMES = 4
+    BUILD_DEPLOY_BRANCH = 5
+
+
+# Task names used as metric labels
+GIT_TASK_NAMES = dict(
+    (value, name.lower()) for name, value in vars(GitTaskAction).items() if name.isupper()
+)
+
+
+class GitQueuePriority(object):
+    """Lanes of the SHA queue. Workers always drain INTERACTIVE tasks
+    (submitted on behalf of a user) before BACKGROUND ones (submitted by
+    the branch poller)."""
+    INTERACTIVE = 0
+    BACKGROUND = 1
 
 
 class GitQueueTask(object):
@@ -295,6 +511,8 @@ class GitQueueTask(object):
     - TEST_ALL_PICKMES: Takes a push id, and queues every pushme with a conflict-pickme tag
     - TEST_CONFLICTING_PICKMES. Used when an item is de-pickmed to ensure that
         anything it might have conlficted with is unmarked
+    - BUILD_DEPLOY_BRANCH: Takes a push id, and brings the push's deploy branch
+        candidate up to date
     """
 
     def __init__(self, task_type, request_id, **kwargs):
@@ -303,6 +521,43 @@ class GitQueueTask(object):
         self.kwargs = kwargs
 
 
+class PushSnapshot(object):
+    """
+    A push and the requests in it, loaded once (see
+    GitQueue._get_push_snapshot) and used for the rest of a queue task.
+
+    Request updates are applied to the snapshot right away, and written back
+    together with any queued queries by GitQueue._write_snapshot.
+
+    :param push: Dictionary representing the push
+    :param requests: Dictionaries representing the requests in the push
+    :param changed_paths: Dict of (request id, revision) -> changed paths
+    """
+
+    def __init__(self, push, requests, changed_paths=None):
+        self.push = push
+        self.requests = dict((request['id'], request) for request in requests)
+        self.changed_paths = changed_paths or {}
+        self.updates = {}
+        self.queries = []
+
+    @property
+    def push_id(self):
+        return self.push['id']
+
+    def request_ids(self):
+        return sorted(self.requests)
+
+    def get_request(self, request_id):
+        return self.requests.get(int(request_id))
+
+    def update_request(self, req, updated_values):
+        request = self.requests[int(req['id'])]
+        request.update(updated_values)
+        self.updates.setdefault(request['id'], {}).update(updated_values)
+        return dict(request)
+
+
 class GitException(Exception):
     """
     Exception class to be thrown in Git contexts
@@ -323,23 +578,104 @@ class GitException(Exception):
         self.gitkwargs = gitkwargs
 
 
+class GitTimeoutException(GitException):
+    """
+    Raised when a git process is killed for running past its command
+    timeout or the deadline of the task it belongs to.
+    """
+    pass
+
+
+@contextmanager
+def git_task_deadline(seconds):
+    """Context manager that bounds the total time all GitCommands started
+    inside it may take. Commands started after the deadline has passed fail
+    immediately with a GitTimeoutException.
+
+    :param seconds: Length of the deadline, None or 0 to disable it
+    """
+    previous_deadline = GitCommand.deadline
+    if seconds:
+        GitCommand.deadline = time.time() + seconds
+    else:
+        GitCommand.deadline = None
+    try:
+        yield
+    finally:
+        GitCommand.deadline = previous_deadline
+
+
 class GitCommand(subprocess.Popen):
 
+    # Absolute time (as returned by time.time) after which no git process
+    # may keep running. Set by git_task_deadline.
+    deadline = None
+
     def __init__(self, *args, **kwargs):
         self.args = args
+        self.timeout = kwargs.pop('timeout', Settings['git']['command_timeout'])
         self.kwargs = kwargs
+        self.timed_out = False
+        if self.deadline is not None and self.deadline <= time.time():
+            raise GitTimeoutException(
+                "GitException: task deadline passed before git %s " % ' '.join(args),
+                gitret=-signal.SIGKILL,
+                gitout='',
+                giterr='Task deadline exceeded',
+                gitkwargs=kwargs
+            )
         _args = ['git'] + list(args)
         _kwargs = {
             'stdout': subprocess.PIPE,
             'stderr': subprocess.PIPE,
+            # Run git in its own process group so that a timeout also takes
+            # down the ssh / remote helper processes it spawned.
+            'preexec_fn': os.setsid,
         }
         _kwargs.update(kwargs)
         subprocess.Popen.__init__(self, _args, **_kwargs)
 
+    def _get_timeout(self):
+        """Seconds this command may still run for, or None if unbounded."""
+        timeouts = []
+        if self.timeout:
+            timeouts.append(self.timeout)
+        if self.deadline is not None:
+            timeouts.append(max(self.deadline - time.time(), 0))
+        if not timeouts:
+            return None
+        return min(timeouts)
+
+    def _kill_process_group(self):
+        self.timed_out = True
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except OSError:
+            # Process group is already gone
+            pass
+
     def run(self):
-        stdout, stderr = self.communicate()
+        timer = None
+        timeout = self._get_timeout()
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._kill_process_group)
+            timer.daemon = True
+            timer.start()
+        try:
+            stdout, stderr = self.communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
         if Settings['main_app']['debug']:
             logging.error("%r, %r, %r", self.args, stdout, stderr)
+        if self.timed_out:
+            raise GitTimeoutException(
+                "GitException: timed out after %ss: git %s " % (timeout, ' '.join(self.args)),
+                gitret=self.returncode,
+                giterr=stderr,
+                gitout=stdout,
+                gitkwargs=self.kwargs
+            )
         if self.returncode:
             raise GitException(
                 "GitException: git %s " % ' '.join(self.args),
@@ -351,17 +687,216 @@ class GitCommand(subprocess.Popen):
         return self.returncode, stdout, stderr
 
 
+class GitQueryService(object):
+    """
+    Answers rev-parse, object existence and ancestry questions about a single
+    repository without forking a git process per question.
+
+    Names are resolved over the pipe of a long running
+    `git cat-file --batch-check` process; several names can be resolved in
+    one round trip. Ancestry between two resolved SHAs never changes, so
+    answers are memoized and only unseen pairs cost a `git merge-base`.
+
+    Use GitQueryService.for_repo to get the (per process) instance for a
+    repository.
+    """
+
+    # Names written to the pipe before reading answers back. Keeps the
+    # answers for one batch well below the size of the pipe buffer.
+    MAX_BATCH = 500
+    MAX_CACHED_ANCESTRY = 10000
+    OBJECT_TYPES = ('commit', 'tree', 'blob', 'tag')
+
+    _services = {}
+    _services_pid = None
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.process = None
+        self.lock = threading.Lock()
+        self.ancestry = {}
+
+    @classmethod
+    def for_repo(cls, repo_path):
+        if cls._services_pid != os.getpid():
+            # Pipes inherited from a parent process must never be shared
+            cls._services = {}
+            cls._services_pid = os.getpid()
+        service = cls._services.get(repo_path)
+        if service is None:
+            service = cls._services[repo_path] = cls(repo_path)
+        return service
+
+    def _start(self):
+        with open(os.devnull, 'w') as devnull:
+            self.process = GitCommand(
+                'cat-file', '--batch-check',
+                cwd=self.repo_path,
+                stdin=subprocess.PIPE,
+                stderr=devnull
+            )
+
+    def close(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+            process.wait()
+        except (IOError, OSError):
+            process._kill_process_group()
+
+    def _query(self, names):
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        process = self.process
+
+        timer = None
+        # Each round trip is held to the same limits as a git command
+        timeout = process._get_timeout()
+        if timeout is not None:
+            timer = threading.Timer(timeout, process._kill_process_group)
+            timer.daemon = True
+            timer.start()
+        try:
+            try:
+                process.stdin.write(''.join('%s\n' % name for name in names))
+                process.stdin.flush()
+                answers = [process.stdout.readline() for _ in names]
+            except IOError:
+                answers = []
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if len(answers) != len(names) or not all(answer.endswith('\n') for answer in answers):
+            self.close()
+            exception_class = GitTimeoutException if process.timed_out else GitException
+            raise exception_class(
+                "GitException: git cat-file --batch-check stopped answering",
+                gitret=process.returncode,
+                gitout='',
+                giterr='',
+                gitkwargs={'cwd': self.repo_path}
+            )
+
+        results = []
+        for answer in answers:
+            fields = answer.split()
+            if len(fields) == 3 and fields[1] in self.OBJECT_TYPES:
+                results.append(fields[0])
+            else:
+                # "<name> missing" or "<name> ambiguous"
+                results.append(None)
+        return results
+
+    def resolve(self, *names):
+        """Resolve several names to SHAs in as few round trips as possible.
+
+        :return: List of SHAs, with None for names that don't resolve
+        """
+        results = [None] * len(names)
+        # Names with whitespace would desynchronize the pipe
+        queries = [
+            (i, name) for i, name in enumerate(names)
+            if name and name == name.strip() and len(name.split()) == 1
+        ]
+        with self.lock:
+            for start in range(0, len(queries), self.MAX_BATCH):
+                batch = queries[start:start + self.MAX_BATCH]
+                answers = self._query([name for _, name in batch])
+                for (i, _), sha in zip(batch, answers):
+                    results[i] = sha
+        return results
+
+    def rev_parse(self, name):
+        """Returns the commit SHA name points at, or None."""
+        return self.resolve('%s^{commit}' % name)[0]
+
+    def object_exists(self, name):
+        return self.resolve(name)[0] is not None
+
+    def is_ancestor(self, ancestor, descendant):
+        """Whether ancestor is reachable from descendant. Unknown names are
+        never ancestors."""
+        ancestor_sha, descendant_sha = self.resolve(
+            '%s^{commit}' % ancestor,
+            '%s^{commit}' % descendant
+        )
+        if ancestor_sha is None or descendant_sha is None:
+            return False
+        if ancestor_sha == descendant_sha:
+            return True
+
+        key = (ancestor_sha, descendant_sha)
+        metrics.cache_lookup('git-ancestry', key in self.ancestry)
+        if key in self.ancestry:
+            return self.ancestry[key]
+
+        try:
+            GitCommand(
+                'merge-base', '--is-ancestor', ancestor_sha, descendant_sha,
+                cwd=self.repo_path
+            ).run()
+            result = True
+        except GitTimeoutException:
+            raise
+        except GitException, e:
+            # Exit status 1 means "not an ancestor", anything else is an error
+            if e.gitret != 1:
+                raise
+            result = False
+
+        # Dirty cache expiry mechanism, same as GitQueue.shas_in_master
+        if len(self.ancestry) > self.MAX_CACHED_ANCESTRY:
+            self.ancestry = {}
+        self.ancestry[key] = result
+        return result
+
+
 class GitQueue(object):
 
     conflict_queue = None
     sha_queue = None
-    conflict_worker_process = None
-    sha_worker_process = None
+    sha_background_queue = None
+    # Counts tasks put into either lane of the SHA queue
+    sha_tasks = None
+    conflict_workers = None
+    sha_workers = None
+
+    # Semaphores limiting concurrent queries to a remote, and throttles
+    # limiting their rate. Remotes are hashed onto a fixed number of slots
+    # since both have to exist before the workers are forked.
+    remote_slots = None
+    remote_throttles = None
+    REMOTE_SLOT_STRIPES = 16
 
     shas_in_master = {}
 
     EXCLUDE_FROM_GIT_VERIFICATION = Settings['git']['exclude_from_verification']
 
+    # States of the requests merged into the deploy branch candidate of a push
+    DEPLOY_STATES = ('added', 'staged', 'verified')
+
+    # Bytes of the output of a failed merge kept in push_conflictdetails,
+    # and conflicting paths listed in the summary on the request
+    CONFLICT_OUTPUT_LIMIT = 256 * 1024
+    CONFLICT_SUMMARY_PATHS = 10
+
+    # Working set of the SHA daemon: the columns it needs of the requests in
+    # ACTIVE_STATES, by request id. See _get_active_requests.
+    ACTIVE_STATES = ('requested', 'pickme', 'added')
+    ACTIVE_COLUMNS = ('id', 'user', 'title', 'repo', 'branch', 'revision', 'state', 'tags')
+    # Rows changed up to this many seconds before the watermark are read
+    # again, in case they were committed late or by a host with a skewed clock
+    ACTIVE_SCAN_LOOKBACK = 10
+    # Seconds between full scans, which also pick up rows written without
+    # setting push_requests.changed
+    ACTIVE_FULL_SCAN_INTERVAL = 3600
+    active_requests = None
+    active_watermark = None
+    active_full_scan = None
+
     @classmethod
     def request_is_excluded_from_git_verification(cls, request):
         """Some tags modify the workflow and are excluded from repository
@@ -372,11 +907,25 @@ class GitQueue(object):
     @classmethod
     def start_worker(cls):
         worker_pids = []
-        if cls.conflict_worker_process is not None and cls.sha_worker_process is not None:
+        if cls.conflict_workers is not None and cls.sha_workers is not None:
             return worker_pids
 
         cls.conflict_queue = JoinableQueue()
         cls.sha_queue = JoinableQueue()
+        cls.sha_background_queue = JoinableQueue()
+        cls.sha_tasks = Semaphore(0)
+        metrics.register_queue('git-conflict', cls.conflict_queue)
+        metrics.register_queue('git-sha', cls.sha_queue)
+        metrics.register_queue('git-sha-background', cls.sha_background_queue)
+        if Settings['git']['remote-concurrency']:
+            cls.remote_slots = [
+                BoundedSemaphore(Settings['git']['remote-concurrency'])
+                for _ in range(cls.REMOTE_SLOT_STRIPES)
+            ]
+        cls.remote_throttles = [
+            AdaptiveThrottle.from_settings('git remotes (slot %d)' % i, Settings['git']['throttle'])
+            for i in range(cls.REMOTE_SLOT_STRIPES)
+        ]
 
         cls.conflict_workers = []
         for worker_id in range(Settings['git']['conflict-threads']):
@@ -390,10 +939,13 @@ class GitQueue(object):
             cls.conflict_workers.append(worker_thread)
             worker_pids.append(worker_thread.pid)
 
-        cls.sha_worker_process = Process(target=cls.process_sha_queue, name='git-sha-queue')
-        cls.sha_worker_process.daemon = True
-        cls.sha_worker_process.start()
-        worker_pids.append(cls.sha_worker_process.pid)
+        cls.sha_workers = []
+        for worker_id in range(Settings['git']['sha-threads']):
+            worker_thread = Process(target=cls.process_sha_queue, name='git-sha-queue')
+            worker_thread.daemon = True
+            worker_thread.start()
+            cls.sha_workers.append(worker_thread)
+            worker_pids.append(worker_thread.pid)
 
         cls.check_sha_worker_proc = Process(target=cls.check_active_request_shas, name='git-branch-sha-updater-daemon')
         cls.check_sha_worker_proc.daemon = True
@@ -441,8 +993,10 @@ class GitQueue(object):
         )
         commit_command.run()
 
-        # Verify that submodules are OK
-        _stale_submodule_check(master_repo_path)
+        # Verify that the submodules this merge moved are OK
+        changed_gitlinks = _get_changed_gitlinks(master_repo_path, 'HEAD^1', 'HEAD')
+        if changed_gitlinks:
+            _stale_submodule_check(master_repo_path, changed_gitlinks)
 
     @classmethod
     def create_or_update_local_repo(cls, worker_id, repo_name, branch, checkout=True, fetch=False):
@@ -479,9 +1033,17 @@ class GitQueue(object):
                     ])
 
             clone_args.append(repo_path)
-            # Clone the main repo into repo_path. Will take time!
+            # Clone the main repo into repo_path. Will take time, so only the
+            # task deadline applies and not the per-command timeout.
             clone_repo = GitCommand(*clone_args)
-            clone_repo.run()
+            clone_repo.timeout = None
+            try:
+                clone_repo.run()
+            except GitException:
+                # Don't leave a half-cloned repository behind, the next task
+                # would otherwise mistake it for a usable one.
+                shutil.rmtree(repo_path, ignore_errors=True)
+                raise
 
         if fetch:
             # If we are dealing with a dev repo, make sure it is added as a remote
@@ -494,7 +1056,8 @@ class GitQueue(object):
                 add_remote.run()
             except GitException, e:
                 # If the remote already exists, git will return err 128
-                if e.gitret == 128:
+                # (or 3 since git 2.30)
+                if e.gitret in (3, 128):
                     pass
                 else:
                     raise e
@@ -512,7 +1075,8 @@ class GitQueue(object):
                 remote_path,
                 cwd=repo_path
             )
-            fetch_updates.run()
+            with cls._remote_slot(dev_repo_uri):
+                fetch_updates.run()
 
         if checkout:
             # Reset hard head, to ensure that we are able to checkout
@@ -566,6 +1130,26 @@ class GitQueue(object):
             )
         return repository
 
+    @classmethod
+    @contextmanager
+    def _remote_slot(cls, remote):
+        """Waits until fewer than git.remote-concurrency queries are running
+        against remote (across all workers) and the remote's throttle allows
+        another one, then holds a slot meanwhile."""
+        stripe = zlib.crc32(remote)
+        slot = cls.remote_slots[stripe % len(cls.remote_slots)] if cls.remote_slots else None
+        if slot:
+            slot.acquire()
+        try:
+            if cls.remote_throttles:
+                with cls.remote_throttles[stripe % len(cls.remote_throttles)].throttled():
+                    yield
+            else:
+                yield
+        finally:
+            if slot:
+                slot.release()
+
     @classmethod
     def _get_branch_sha_from_repo(cls, req, alert=True):
         user_to_notify = req['user']
@@ -577,12 +1161,13 @@ class GitQueue(object):
         }
         stdout = ""
         try:
-            ls_remote = GitCommand(
-                'ls-remote', '-h',
-                cls._get_repository_uri(req['repo']), req['branch']
-            )
-            _, stdout, _ = ls_remote.run()
+            remote = cls._get_repository_uri(req['repo'])
+            ls_remote = GitCommand('ls-remote', '-h', remote, req['branch'])
+            with cls._remote_slot(remote):
+                _, stdout, _ = ls_remote.run()
             stdout = stdout.strip()
+        except GitTimeoutException:
+            raise
         except GitException, e:
             msg = """
                 <p>
@@ -718,7 +1303,88 @@ class GitQueue(object):
         return req
 
     @classmethod
-    def _update_request(cls, req, updated_values):
+    def _get_push_snapshot(cls, push_id=None, request_id=None):
+        """Loads the push given by push_id, or else the push request_id was
+        pickme'd for, along with all of its requests in one query.
+
+        :return: PushSnapshot, or None if there is no such push
+        """
+        if push_id is None:
+            push_id = select(
+                [db.push_pushcontents.c.push],
+                db.push_pushcontents.c.request == int(request_id)
+            ).limit(1).as_scalar()
+        result = [None]
+
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+            rows, changed_paths = db_results
+            push = None
+            requests = []
+            for row in rows:
+                if push is None:
+                    push = dict(
+                        (column.name, row['push_%s' % column.name])
+                        for column in db.push_pushes.c
+                    )
+                if row[db.push_requests.c.id] is not None:
+                    requests.append(dict(
+                        (column.name, row[column]) for column in db.push_requests.c
+                    ))
+            if push is not None:
+                result[0] = PushSnapshot(push, requests, dict(
+                    ((path_row['request'], path_row['revision']), json.loads(path_row['paths']))
+                    for path_row in changed_paths
+                ))
+
+        members = select(
+            [db.push_pushcontents.c.request],
+            db.push_pushcontents.c.push == push_id
+        )
+        snapshot_query = select(
+            [column.label('push_%s' % column.name) for column in db.push_pushes.c] +
+            list(db.push_requests.c),
+            from_obj=db.push_pushes.outerjoin(
+                db.push_pushcontents,
+                db.push_pushcontents.c.push == db.push_pushes.c.id
+            ).outerjoin(
+                db.push_requests,
+                db.push_requests.c.id == db.push_pushcontents.c.request
+            )
+        ).where(db.push_pushes.c.id == push_id)
+        changed_paths_query = db.push_changedpaths.select().where(
+            db.push_changedpaths.c.request.in_(members)
+        )
+        db.execute_transaction_cb([snapshot_query, changed_paths_query], on_db_return)
+        return result[0]
+
+    @classmethod
+    def _write_snapshot(cls, snapshot):
+        """Writes the request updates and queries collected in a snapshot in
+        a single transaction."""
+        if not snapshot.updates and not snapshot.queries:
+            return
+
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+
+        update_queries = [
+            db.push_requests.update().where(
+                db.push_requests.c.id == request_id
+            ).values(updated_values)
+            for request_id, updated_values in sorted(snapshot.updates.items())
+        ]
+        db.execute_transaction_cb(update_queries + snapshot.queries, on_db_return)
+        snapshot.updates = {}
+        snapshot.queries = []
+
+    @classmethod
+    def _update_request(cls, req, updated_values, snapshot=None):
+        """Updates a request and returns the updated request. With a
+        snapshot, the update is only written by _write_snapshot."""
+        if snapshot is not None:
+            return snapshot.update_request(req, updated_values)
+
         result = [None]
 
         def on_db_return(success, db_results):
@@ -760,6 +1426,7 @@ class GitQueue(object):
         if len(cls.shas_in_master) > 1000:
             cls.shas_in_master = {}
 
+        metrics.cache_lookup('git-shas-in-master', sha in cls.shas_in_master)
         if sha in cls.shas_in_master:
             return True
 
@@ -768,53 +1435,123 @@ class GitQueue(object):
             worker_id
         )
 
-        try:
-            _, merge_base, _ = GitCommand('merge-base', 'origin/master', sha, cwd=repo_path).run()
-        except GitException:
-            # If the hash is entirely unknown, Git will throw an error
-            # fatal: Not a valid commit name <sha>.
-            return False
-
-        merge_base = merge_base.strip()
-
-        if sha == merge_base:
+        # Entirely unknown hashes are reported as not being in master
+        query = GitQueryService.for_repo(repo_path)
+        if query.is_ancestor(sha, 'refs/remotes/origin/master'):
             cls.shas_in_master[sha] = True
             return True
         else:
             return False
 
+    @classmethod
+    def _get_changed_paths(cls, repo_path, request_id, sha, snapshot=None):
+        """Returns the paths changed by the given SHA of a request since its
+        merge-base with master, or None if they can't be told. They are
+        computed once per request and SHA, and stored in push_changedpaths
+        (along with the snapshot's updates if one is given).
+        """
+        result = [None]
+
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+            row = db_results.first()
+            if row:
+                result[0] = json.loads(row['paths'])
+
+        if snapshot is not None:
+            # Snapshots come with the paths of all requests in the push
+            result[0] = snapshot.changed_paths.get((int(request_id), sha))
+        else:
+            select_query = db.push_changedpaths.select().where(and_(
+                db.push_changedpaths.c.request == request_id,
+                db.push_changedpaths.c.revision == sha,
+            ))
+            db.execute_cb(select_query, on_db_return)
+        metrics.cache_lookup('git-changed-paths', result[0] is not None)
+        if result[0] is not None:
+            return result[0]
+
+        try:
+            _, stdout, _ = GitCommand(
+                'diff', '--name-only', '--no-renames', '--ignore-submodules=none', '-z',
+                'refs/remotes/origin/master...%s' % sha,
+                cwd=repo_path
+            ).run()
+        except GitTimeoutException:
+            raise
+        except GitException, e:
+            logging.warning("Couldn't list the paths changed by %s: %s", sha, e.giterr)
+            return None
+        paths = sorted(set(path for path in stdout.split('\0') if path))
+
+        def on_db_insert(success, db_results):
+            assert success, "Database error."
+
+        # Paths of earlier SHAs of the request are of no use anymore
+        delete_query = db.push_changedpaths.delete().where(and_(
+            db.push_changedpaths.c.request == request_id,
+            db.push_changedpaths.c.revision != sha,
+        ))
+        insert_query = db.InsertIgnore(db.push_changedpaths, {
+            'request': request_id,
+            'revision': sha,
+            'paths': json.dumps(paths),
+        })
+        if snapshot is not None:
+            snapshot.changed_paths[(int(request_id), sha)] = paths
+            snapshot.queries.extend([delete_query, insert_query])
+        else:
+            db.execute_transaction_cb([delete_query, insert_query], on_db_insert)
+        return paths
+
     @classmethod
     def _test_pickme_conflict_pickme(cls, worker_id, req, target_branch,
-                                     repo_path, pushmanager_url, requeue):
+                                     repo_path, pushmanager_url, requeue, req_sha=None,
+                                     snapshot=None):
         """Test for any pickmes that are broken by pickme'd request req
 
         Precondition: We should already be on a test branch, and the pickme to
         be tested against should already be successfully merged.
 
+        Pickmes that change none of the paths changed by req (see
+        changed_paths_overlap) can't conflict with it and aren't merged.
+
         :param req: Details for pickme to test against
         :param target_branch: Name of branch onto which to attempt merge
         :param repo_path: On-disk path to local repository
         :param requeue: Boolean whether or not to requeue pickmes that are conflicted with
+        :param req_sha: SHA of req that was merged, if known
+        :param snapshot: PushSnapshot of the push of req. Without one, a
+            snapshot is loaded and written back before returning.
         """
 
-        push = cls._get_push_for_request(req['id'])
-        if push is None:
+        owns_snapshot = snapshot is None
+        if owns_snapshot:
+            snapshot = cls._get_push_snapshot(request_id=req['id'])
+        if snapshot is None:
             logging.warn(
                 "Couldn't test pickme %d - couldn't find corresponding push",
                 req['id']
             )
             return False, None
 
-        pickme_ids = cls._get_request_ids_in_push(push['push'])
-
-        pickme_ids = [p for p in pickme_ids if int(p) != int(req['id'])]
+        pickme_ids = [p for p in snapshot.request_ids() if int(p) != int(req['id'])]
 
         conflict_pickmes = []
+        # Every pickme that was pruned or merged, and those that failed to
+        # merge, for push_conflictpairs
+        checked_ids = []
+        conflicting_ids = []
+
+        changed_paths = None
+        if req_sha is not None:
+            changed_paths = cls._get_changed_paths(repo_path, req['id'], req_sha, snapshot)
+        pruned = merged = 0
 
         # For each pickme, check if merging it on top throws an exception.
         # If it does, keep track of the pickme in conflict_pickmes
         for pickme in pickme_ids:
-            pickme_details = cls._get_request(pickme)
+            pickme_details = snapshot.get_request(pickme)
             if not pickme_details:
                 logging.error(
                     "Tried to test for conflicts against invalid request id %s",
@@ -825,6 +1562,28 @@ class GitQueue(object):
             if 'state' not in pickme_details or pickme_details['state'] not in ('pickme', 'added'):
                 continue
 
+            # If the pickme has no '*conflict*' tags, it has not been checked and
+            # it may conflict with master, which here would cause a pickme
+            # conflict. Skip it, as it should be queued to be checked, and will
+            # get tested against us later.
+            if "conflict" not in pickme_details['tags']:
+                continue
+
+            # Don't bother trying to compare against pickmes that
+            # break master, as they will conflict by default
+            if "conflict-master" in pickme_details['tags']:
+                continue
+
+            # Pickmes whose paths are known for their stored revision are
+            # pruned without fetching them or asking the remote for their SHA
+            if changed_paths is not None:
+                pickme_paths = snapshot.changed_paths.get((int(pickme), pickme_details.get('revision')))
+                if pickme_paths is not None and not changed_paths_overlap(changed_paths, pickme_paths):
+                    pruned += 1
+                    checked_ids.append(int(pickme))
+                    metrics.inc('pushmanager_conflict_checks_total', {'result': 'pruned'})
+                    continue
+
             # Ensure we have a copy of the pickme we are comparing against
             cls.create_or_update_local_repo(
                 worker_id,
@@ -840,23 +1599,25 @@ class GitQueue(object):
             if sha is None or cls._sha_exists_in_master(worker_id, sha):
                 continue
 
-            # If the pickme has no '*conflict*' tags, it has not been checked and
-            # it may conflict with master, which here would cause a pickme
-            # conflict. Skip it, as it should be queued to be checked, and will
-            # get tested against us later.
-            if "conflict" not in pickme_details['tags']:
-                continue
-
-            # Don't bother trying to compare against pickmes that
-            # break master, as they will conflict by default
-            if "conflict-master" in pickme_details['tags']:
-                continue
+            if changed_paths is not None:
+                pickme_paths = cls._get_changed_paths(repo_path, pickme_details['id'], sha, snapshot)
+                if pickme_paths is not None and not changed_paths_overlap(changed_paths, pickme_paths):
+                    pruned += 1
+                    checked_ids.append(int(pickme))
+                    metrics.inc('pushmanager_conflict_checks_total', {'result': 'pruned'})
+                    continue
+            merged += 1
+            checked_ids.append(int(pickme))
+            metrics.inc('pushmanager_conflict_checks_total', {'result': 'merged'})
 
             try:
                 with git_merge_context_manager(target_branch,
                                                repo_path):
                     cls.git_merge_pickme(worker_id, pickme_details, repo_path)
+            except GitTimeoutException:
+                raise
             except GitException, e:
+                conflicting_ids.append(int(pickme))
                 if req['state'] == 'added' and pickme_details['state'] == 'pickme':
                     pass
                 else:
@@ -873,44 +1634,166 @@ class GitQueue(object):
                         requeue=False
                     )
 
+        if pruned + merged:
+            logging.info(
+                "Pickme %s: %d of %d pickmes pruned by changed paths",
+                req['id'], pruned, pruned + merged
+            )
+
+        cls._store_conflict_pairs(snapshot.push_id, req['id'], checked_ids, conflicting_ids, snapshot)
+
         # If there were no conflicts, don't update the request
         if not conflict_pickmes:
+            if owns_snapshot:
+                cls._write_snapshot(snapshot)
             return False, None
 
         updated_tags = add_to_tags_str(req['tags'], 'conflict-pickme')
         updated_tags = del_from_tags_str(updated_tags, 'no-conflicts')
         formatted_conflicts = ""
         for broken_pickme, git_out, git_err in conflict_pickmes:
-            pickme_details = cls._get_request(broken_pickme)
-            formatted_pickme_err = (
-                """<strong>Conflict with <a href=\"/request?id={pickme_id}\">
-                {pickme_name}</a>: </strong><br/>{pickme_out}<br/>{pickme_err}
-                <br/><br/>"""
-            ).format(
-                pickme_id=broken_pickme,
-                pickme_err=xhtml_escape(git_err),
-                pickme_out=xhtml_escape(git_out),
-                pickme_name=xhtml_escape(pickme_details['title'])
+            pickme_details = snapshot.get_request(broken_pickme)
+            formatted_conflicts += cls._format_conflict_summary(
+                req['id'],
+                broken_pickme,
+                """<a href="/request?id={pickme_id}">{pickme_name}</a>""".format(
+                    pickme_id=broken_pickme,
+                    pickme_name=xhtml_escape(pickme_details['title'])
+                ),
+                git_out,
+                git_err
             )
-            formatted_conflicts += formatted_pickme_err
+        cls._store_conflict_details(
+            req['id'],
+            req_sha or req.get('revision'),
+            conflict_pickmes,
+            snapshot
+        )
 
         updated_values = {
             'tags': updated_tags,
             'conflicts': formatted_conflicts
         }
 
-        updated_request = cls._update_request(req, updated_values)
+        updated_request = cls._update_request(req, updated_values, snapshot=snapshot)
         if not updated_request:
             raise Exception("Failed to update pickme details")
+        if owns_snapshot:
+            cls._write_snapshot(snapshot)
+        return True, updated_request
+
+    @classmethod
+    def _store_conflict_pairs(cls, push_id, request_id, checked_ids, conflicting_ids, snapshot=None):
+        """Replaces the conflict pairs of a pickme with the pickmes it was
+        just checked against. Pairs with pickmes that were skipped are kept.
+        With a snapshot, they are only written by _write_snapshot.
+
+        :param checked_ids: IDs of the pickmes that were pruned or merged
+            on top of the pickme
+        :param conflicting_ids: IDs of the pickmes that failed to merge on
+            top of the pickme
+        """
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+
+        request_id = int(request_id)
+        checked_ids = [int(other) for other in checked_ids]
+        delete_queries = []
+        if checked_ids:
+            delete_queries.append(db.push_conflictpairs.delete().where(and_(
+                db.push_conflictpairs.c.push == push_id,
+                or_(
+                    and_(
+                        db.push_conflictpairs.c.request == request_id,
+                        db.push_conflictpairs.c.other.in_(checked_ids),
+                    ),
+                    and_(
+                        db.push_conflictpairs.c.other == request_id,
+                        db.push_conflictpairs.c.request.in_(checked_ids),
+                    ),
+                )
+            )))
+        insert_queries = [
+            db.InsertIgnore(db.push_conflictpairs, {
+                'push': push_id,
+                'request': min(request_id, other),
+                'other': max(request_id, other),
+            })
+            for other in conflicting_ids
+        ]
+        if snapshot is not None:
+            snapshot.queries.extend(delete_queries + insert_queries)
+            return
+        db.execute_transaction_cb(delete_queries + insert_queries, on_db_return)
+
+    @classmethod
+    def _format_conflict_summary(cls, request_id, other_id, other_html, git_out, git_err):
+        """Summarizes a failed merge for push_requests.conflicts: the
+        conflicting paths (or the last line of output, if git reported none)
+        and a link to the full output in push_conflictdetails.
+
+        :param other_id: ID of the pickme the merge failed against, 0 for master
+        :param other_html: HTML naming what the merge failed against
+        """
+        paths = conflicting_paths(git_out) + conflicting_paths(git_err)
+        if paths:
+            summary = ', '.join(paths[:cls.CONFLICT_SUMMARY_PATHS])
+            if len(paths) > cls.CONFLICT_SUMMARY_PATHS:
+                summary += ' and %d more' % (len(paths) - cls.CONFLICT_SUMMARY_PATHS)
         else:
-            return True, updated_request
+            lines = [line for line in ((git_out or '') + '\n' + (git_err or '')).splitlines() if line.strip()]
+            summary = lines[-1][:200] if lines else ''
+        return (
+            """<strong>Conflict with {other}:</strong> {summary} """
+            """(<a class="conflict-output" href="/api/conflictdetails?id={request_id}&amp;other={other_id}">"""
+            """full output</a>)<br/>"""
+        ).format(
+            other=other_html,
+            summary=xhtml_escape(summary),
+            request_id=request_id,
+            other_id=other_id,
+        )
 
     @classmethod
-    def _clear_pickme_conflict_details(cls, req):
+    def _store_conflict_details(cls, request_id, revision, conflicts, snapshot=None):
+        """Replaces the stored output of the failed merges of a request. With
+        a snapshot, it is only written by _write_snapshot.
+
+        :param revision: SHA of the request that was merged
+        :param conflicts: List of (id of the pickme, 0 for master, git
+            stdout, git stderr) of the merges that failed
+        """
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+
+        request_id = int(request_id)
+        queries = [db.push_conflictdetails.delete().where(
+            db.push_conflictdetails.c.request == request_id
+        )]
+        for other, git_out, git_err in conflicts:
+            output, size = compress_conflict_output(
+                '\n'.join([git_out or '', git_err or '']),
+                cls.CONFLICT_OUTPUT_LIMIT
+            )
+            queries.append(db.InsertIgnore(db.push_conflictdetails, {
+                'request': request_id,
+                'revision': revision or '',
+                'other': int(other),
+                'output': output,
+                'size': size,
+            }))
+        if snapshot is not None:
+            snapshot.queries.extend(queries)
+            return
+        db.execute_transaction_cb(queries, on_db_return)
+
+    @classmethod
+    def _clear_pickme_conflict_details(cls, req, snapshot=None):
         """Strips the conflict-pickme, conflict-master and no-conflicts tags from a
-        pickme, and clears the detailed conflict field.
+        pickme, and clears the conflict summary and details.
 
         :param req: Details of pickme request to clear conflict details of
+        :param snapshot: PushSnapshot to apply the update to, if any
         """
         updated_tags = del_from_tags_str(req['tags'], 'conflict-master')
         updated_tags = del_from_tags_str(updated_tags, 'conflict-pickme')
@@ -919,14 +1802,15 @@ class GitQueue(object):
             'tags': updated_tags,
             'conflicts': ''
         }
-        updated_request = cls._update_request(req, updated_values)
+        updated_request = cls._update_request(req, updated_values, snapshot=snapshot)
         if not updated_request:
             raise Exception("Failed to update pickme")
+        cls._store_conflict_details(req['id'], None, [], snapshot)
 
     @classmethod
     def _test_pickme_conflict_master(
             cls, worker_id, req, target_branch,
-            repo_path, pushmanager_url, requeue):
+            repo_path, pushmanager_url, requeue, req_sha=None, snapshot=None):
         """Test whether the pickme given by req can be successfully merged onto
         master.
 
@@ -937,6 +1821,8 @@ class GitQueue(object):
         :param req: Details of pickme request to test
         :param target_branch: The name of the test branch to use for testing
         :param repo_path: The location of the repository we are working in
+        :param req_sha: SHA of the pickme's branch, if known
+        :param snapshot: PushSnapshot of the push of req, if loaded
         """
 
         # Ensure we have a copy of the pickme branch
@@ -964,19 +1850,29 @@ class GitQueue(object):
                         target_branch,
                         repo_path,
                         pushmanager_url,
-                        requeue
+                        requeue,
+                        req_sha,
+                        snapshot
                     )
 
+            except GitTimeoutException:
+                raise
             except GitException, e:
                 updated_tags = add_to_tags_str(req['tags'], 'conflict-master')
                 updated_tags = del_from_tags_str(updated_tags, 'no-conflicts')
-                conflict_details = "<strong>Conflict with master:</strong><br/> %s <br/> %s" % (e.gitout, e.giterr)
+                conflict_details = cls._format_conflict_summary(req['id'], 0, "master", e.gitout, e.giterr)
+                cls._store_conflict_details(
+                    req['id'],
+                    req_sha or req.get('revision'),
+                    [(0, e.gitout, e.giterr)],
+                    snapshot
+                )
                 updated_values = {
                     'tags': updated_tags,
                     'conflicts': conflict_details
                 }
 
-                updated_request = cls._update_request(req, updated_values)
+                updated_request = cls._update_request(req, updated_values, snapshot=snapshot)
                 if not updated_request:
                     raise Exception("Failed to update pickme")
                 else:
@@ -998,26 +1894,30 @@ class GitQueue(object):
             should be added back into the GitQueue as a test conflict task.
         """
 
-        req = cls._get_request(request_id)
+        # The push and all of its requests are loaded once, and the updates
+        # of this task are written back together
+        snapshot = cls._get_push_snapshot(request_id=request_id)
+        req = snapshot.get_request(request_id) if snapshot else None
         if not req:
-            logging.error(
-                "Tried to test conflicts for invalid request id %s",
-                request_id
-            )
+            # Not part of a push, only look the request up to tell why
+            req = cls._get_request(request_id)
+            if not req:
+                logging.error(
+                    "Tried to test conflicts for invalid request id %s",
+                    request_id
+                )
+            elif req.get('state') in ('pickme', 'added'):
+                logging.error(
+                    "Request %s (%s) doesn't seem to be part of a push",
+                    request_id,
+                    req['title']
+                )
             return
 
         if 'state' not in req or req['state'] not in ('pickme', 'added'):
             return
 
-        push = cls._get_push_for_request(request_id)
-        if not push:
-            logging.error(
-                "Request %s (%s) doesn't seem to be part of a push",
-                request_id,
-                req['title']
-            )
-            return
-        push_id = push['push']
+        push_id = snapshot.push_id
 
         # Set up the environment as though we are preparing a deploy push
         # Create a branch pickme_test_PUSHID_PICKMEID
@@ -1050,7 +1950,7 @@ class GitQueue(object):
             return
 
         # Clear the pickme's conflict info
-        cls._clear_pickme_conflict_details(req)
+        cls._clear_pickme_conflict_details(req, snapshot)
 
         # Check for conflicts with master
         conflict, updated_pickme = cls._test_pickme_conflict_master(
@@ -1059,27 +1959,29 @@ class GitQueue(object):
             target_branch,
             repo_path,
             pushmanager_url,
-            requeue
+            requeue,
+            sha,
+            snapshot
         )
         if conflict:
             if updated_pickme is None:
                 raise Exception(
                     "Encountered merge conflict but was not passed details"
                 )
+            cls._write_snapshot(snapshot)
             cls.pickme_conflict_detected(updated_pickme, requeue, pushmanager_url)
         else:
             # If the request does not conflict here or anywhere else, mark it as
             # no-conflicts
-            req = cls._get_request(request_id)
-            if 'conflict' in req['tags']:
-                return
-            updated_tags = add_to_tags_str(req['tags'], 'no-conflicts')
-            updated_values = {
-                'tags': updated_tags,
-            }
-            updated_request = cls._update_request(req, updated_values)
-            if not updated_request:
-                raise Exception("Failed to update pickme")
+            if 'conflict' not in req['tags']:
+                updated_tags = add_to_tags_str(req['tags'], 'no-conflicts')
+                updated_values = {
+                    'tags': updated_tags,
+                }
+                updated_request = cls._update_request(req, updated_values, snapshot=snapshot)
+                if not updated_request:
+                    raise Exception("Failed to update pickme")
+            cls._write_snapshot(snapshot)
 
     @classmethod
     def pickme_conflict_detected(cls, updated_request, send_notifications, pushmanager_url):
@@ -1297,9 +2199,12 @@ class GitQueue(object):
 
     @classmethod
     def requeue_pickmes_for_push(cls, push_id, pushmanager_url, conflicting_only=False):
-        request_details = []
-        for pickme_id in cls._get_request_ids_in_push(push_id):
-            request_details.append(cls._get_request(pickme_id))
+        snapshot = cls._get_push_snapshot(push_id=push_id)
+        if snapshot is None:
+            return
+        request_details = [
+            snapshot.get_request(pickme_id) for pickme_id in snapshot.request_ids()
+        ]
 
         if conflicting_only:
             request_details = [
@@ -1315,6 +2220,208 @@ class GitQueue(object):
                 requeue=False
             )
 
+    @classmethod
+    def _get_deploy_inputs(cls, push_id):
+        """Returns the push, its accepted requests in the order they are
+        merged into the deploy branch candidate, and the recorded steps of
+        the candidate.
+        """
+        result = [None, [], []]
+
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+            push, requests, steps = db_results
+            push = push.first()
+            result[0] = dict(push.items()) if push else None
+            result[1] = [dict(req.items()) for req in requests]
+            result[2] = [dict(step.items()) for step in steps]
+
+        push_query = db.push_pushes.select().where(
+            db.push_pushes.c.id == push_id
+        )
+        requests_query = db.push_requests.select().where(and_(
+            db.push_requests.c.id == db.push_pushcontents.c.request,
+            db.push_pushcontents.c.push == push_id,
+            db.push_requests.c.state.in_(cls.DEPLOY_STATES),
+        )).order_by(db.push_requests.c.id)
+        steps_query = db.push_deploysteps.select().where(
+            db.push_deploysteps.c.push == push_id
+        ).order_by(db.push_deploysteps.c.position)
+        db.execute_transaction_cb([push_query, requests_query, steps_query], on_db_return)
+        return result
+
+    @classmethod
+    def _store_deploy_steps(cls, push_id, kept, steps, revision):
+        """Replaces the steps of a push's candidate from position kept on,
+        and sets the revision of the push.
+        """
+        def on_db_return(success, db_results):
+            assert success, "Database error."
+
+        delete_query = db.push_deploysteps.delete().where(and_(
+            db.push_deploysteps.c.push == push_id,
+            db.push_deploysteps.c.position >= kept,
+        ))
+        insert_queries = [db.push_deploysteps.insert(step) for step in steps]
+        update_query = db.push_pushes.update().where(
+            db.push_pushes.c.id == push_id
+        ).values({'revision': revision})
+        db.execute_transaction_cb([delete_query] + insert_queries + [update_query], on_db_return)
+
+    @classmethod
+    def _deploy_commit_env(cls, push):
+        """Environment for git commands committing to a deploy branch
+        candidate. Merge commits then only depend on their parents, tree and
+        message, and every worker builds the same SHAs.
+        """
+        date = '%d +0000' % (push['created'] or 0)
+        env = dict(os.environ)
+        env.update({
+            'GIT_AUTHOR_NAME': 'PushManager',
+            'GIT_AUTHOR_EMAIL': Settings['mail']['from'],
+            'GIT_AUTHOR_DATE': date,
+            'GIT_COMMITTER_NAME': 'PushManager',
+            'GIT_COMMITTER_EMAIL': Settings['mail']['from'],
+            'GIT_COMMITTER_DATE': date,
+        })
+        return env
+
+    @classmethod
+    def _merge_deploy_step(cls, worker_id, req, repo_path, env):
+        """Merges the revision of a request onto the current branch and
+        returns the SHA the branch ends up at.
+
+        :param req: Dictionary representing the request to merge
+        :param repo_path: On-disk path of the git repo to work in
+        :param env: Environment from _deploy_commit_env
+        """
+        query = GitQueryService.for_repo(repo_path)
+        if not query.object_exists(req['revision']):
+            cls.create_or_update_local_repo(
+                worker_id,
+                req['repo'],
+                branch=req['branch'],
+                fetch=True,
+                checkout=False
+            )
+
+        if query.is_ancestor(req['revision'], 'HEAD'):
+            # Already merged, e.g. into master
+            return query.rev_parse('HEAD')
+
+        summary = "{branch_title}\n\n(Merged from {repo}/{branch})".format(
+            branch_title=req['title'],
+            repo=req['repo'],
+            branch=req['branch']
+        )
+        GitCommand(
+            "merge", "--no-ff", "--no-commit", req['revision'],
+            cwd=repo_path, env=env
+        ).run()
+        GitCommand(
+            "commit", "-m", summary, "--no-verify",
+            cwd=repo_path, env=env
+        ).run()
+
+        changed_gitlinks = _get_changed_gitlinks(repo_path, 'HEAD^1', 'HEAD')
+        if changed_gitlinks:
+            _stale_submodule_check(repo_path, changed_gitlinks)
+        return query.rev_parse('HEAD')
+
+    @classmethod
+    def build_deploy_branch(cls, worker_id, push_id):
+        """Brings the deploy branch candidate of an accepting push up to
+        date: origin/master with the accepted requests of the push merged in
+        by order of id.
+
+        Each merge is recorded as a step in push_deploysteps. Steps that
+        still merge the same revision onto the same base are kept, so
+        accepting a request costs a single merge and removing one only redoes
+        the merges after it. Once every request merged, the candidate's SHA
+        is stored as the revision of the push. Candidates are only built in
+        the worker's repository, nothing is pushed.
+
+        :param push_id: ID number of the push to build the candidate of
+        """
+        push, reqs, steps = cls._get_deploy_inputs(push_id)
+        if not push or push['state'] != 'accepting':
+            return
+
+        cls.create_or_update_local_repo(
+            worker_id,
+            Settings['git']['main_repository'],
+            branch="master",
+            fetch=True
+        )
+        repo_path = cls._get_local_repository_uri(
+            Settings['git']['main_repository'],
+            worker_id
+        )
+        query = GitQueryService.for_repo(repo_path)
+        base = query.rev_parse('refs/remotes/origin/master')
+
+        # Keep the longest prefix of steps built from the same inputs, as
+        # long as this worker still has their commits
+        kept = 0
+        for req, step in zip(reqs, steps):
+            if (
+                step['request'] != req['id'] or
+                step['revision'] != req['revision'] or
+                step['base'] != base or
+                step['sha'] is None or
+                not query.object_exists(step['sha'])
+            ):
+                break
+            base = step['sha']
+            kept += 1
+        metrics.inc('pushmanager_deploy_steps_total', {'result': 'kept'}, kept)
+
+        if kept == len(reqs) == len(steps):
+            return
+
+        new_steps = []
+        env = cls._deploy_commit_env(push)
+        with git_branch_context_manager('deploy_candidate_%d' % push_id, repo_path):
+            git_reset_to_ref(base, repo_path)
+            for position, req in enumerate(reqs[kept:], kept):
+                step = {
+                    'push': push_id,
+                    'position': position,
+                    'request': req['id'],
+                    'revision': req['revision'],
+                    'base': base,
+                    'sha': None,
+                }
+                new_steps.append(step)
+                try:
+                    step['sha'] = cls._merge_deploy_step(worker_id, req, repo_path, env)
+                except GitTimeoutException:
+                    raise
+                except GitException, e:
+                    logging.info(
+                        "Request %s blocks the deploy branch of push %s: %s",
+                        req['id'],
+                        push_id,
+                        e.giterr
+                    )
+                    metrics.inc('pushmanager_deploy_steps_total', {'result': 'conflict'})
+                    git_reset_to_ref(base, repo_path)
+                    break
+                metrics.inc('pushmanager_deploy_steps_total', {'result': 'merged'})
+                base = step['sha']
+
+            # Keeps the commits of the candidate from being garbage collected
+            GitCommand(
+                'update-ref', 'refs/pushmanager/deploy/%d' % push_id, base,
+                cwd=repo_path
+            ).run()
+
+        if all(step['sha'] for step in new_steps):
+            revision = base
+        else:
+            revision = '0' * 40
+        cls._store_deploy_steps(push_id, kept, new_steps, revision)
+
     @classmethod
     def _notify_updated_request_sha(cls, updated_req, new_sha):
         msg = """
@@ -1356,57 +2463,115 @@ class GitQueue(object):
         Request states that currently fall under this label are 'requested', 'pickme',
         and 'added' states. Any of these are 'active' and possibly subject to more
         change before they've been merged.
+
+        Only ACTIVE_COLUMNS of the requests are kept, in memory. A full scan
+        loads them every ACTIVE_FULL_SCAN_INTERVAL seconds. In between, only
+        the rows changed since the last scan are read, whatever their state,
+        so requests that are no longer active are dropped.
         '''
         result = [None]
 
         def on_db_return(success, db_results):
             assert success, "Database error."
-            result[0] = db_results.fetchall()
+            result[0] = [dict(row.items()) for row in db_results]
             db_results.close()
 
-        req_active_query = db.push_requests.select(or_(
-            db.push_requests.c.state == 'requested',
-            db.push_requests.c.state == 'pickme',
-            db.push_requests.c.state == 'added')
+        now = time.time()
+        full_scan = (
+            cls.active_requests is None or
+            now - cls.active_full_scan >= cls.ACTIVE_FULL_SCAN_INTERVAL
         )
+        columns = [db.push_requests.c[name] for name in cls.ACTIVE_COLUMNS]
+        columns.append(db.push_requests.c.changed)
+        if full_scan:
+            req_active_query = select(
+                columns,
+                db.push_requests.c.state.in_(cls.ACTIVE_STATES)
+            )
+        else:
+            req_active_query = select(
+                columns,
+                db.push_requests.c.changed >= cls.active_watermark - cls.ACTIVE_SCAN_LOOKBACK
+            )
 
         db.execute_cb(req_active_query, on_db_return)
-        reqs = result[0]
-        return reqs
+
+        if full_scan:
+            cls.active_requests = {}
+            cls.active_watermark = int(now)
+            cls.active_full_scan = now
+        for req in result[0]:
+            changed = req.pop('changed')
+            if changed is not None:
+                cls.active_watermark = max(cls.active_watermark, changed)
+            if req['state'] in cls.ACTIVE_STATES:
+                cls.active_requests[req['id']] = req
+            else:
+                cls.active_requests.pop(req['id'], None)
+
+        return [cls.active_requests[req_id] for req_id in sorted(cls.active_requests)]
 
     @classmethod
-    def process_sha_queue(cls):
-        logging.info("Starting GitConflictQueue")
+    def _log_task_timeout(cls, queue_name, task, exception):
+        logging.error(
+            "%s task timed out (type %d, id %s): %s",
+            queue_name,
+            task.task_type,
+            task.request_id,
+            exception.details
+        )
+
+    @classmethod
+    def _get_sha_task(cls):
+        """Blocks until a SHA task is available, preferring the interactive
+        lane, and returns it along with the lane it was taken from."""
+        cls.sha_tasks.acquire()
         while True:
-            # Throttle
-            time.sleep(1)
+            for lane in (cls.sha_queue, cls.sha_background_queue):
+                try:
+                    return lane, lane.get_nowait()
+                except Empty:
+                    pass
+            # The task was counted before the queue's feeder thread flushed it
+            time.sleep(0.01)
 
-            task = cls.sha_queue.get()
+    @classmethod
+    def _task_timer(cls, queue, task):
+        return metrics.timer(
+            'pushmanager_worker_task_duration_seconds',
+            {'queue': queue, 'task': GIT_TASK_NAMES.get(task.task_type, 'unknown')}
+        )
+
+    @classmethod
+    def process_sha_queue(cls):
+        logging.info("Starting GitSHAQueue")
+        while True:
+            lane, task = cls._get_sha_task()
 
             if not isinstance(task, GitQueueTask):
                 logging.error("Non-task object in GitSHAQueue: %s", task)
                 continue
 
             try:
-                if task.task_type is GitTaskAction.VERIFY_BRANCH:
-                    cls.verify_branch(task.request_id, task.kwargs['pushmanager_url'])
-                else:
-                    logging.error(
-                        "GitSHAQueue encountered unknown task type %d",
-                        task.task_type
-                    )
+                with cls._task_timer('git-sha', task), git_task_deadline(Settings['git']['task_timeout']):
+                    if task.task_type is GitTaskAction.VERIFY_BRANCH:
+                        cls.verify_branch(task.request_id, task.kwargs['pushmanager_url'])
+                    else:
+                        logging.error(
+                            "GitSHAQueue encountered unknown task type %d",
+                            task.task_type
+                        )
+            except GitTimeoutException, e:
+                cls._log_task_timeout('GitSHAQueue', task, e)
             except Exception:
                 logging.error('THREAD ERROR:', exc_info=True)
             finally:
-                cls.sha_queue.task_done()
+                lane.task_done()
 
     @classmethod
     def process_conflict_queue(cls, worker_id):
         logging.error("Starting GitConflictQueue %d", worker_id)
         while True:
-            # Throttle
-            time.sleep(1)
-
             task = cls.conflict_queue.get()
 
             if not isinstance(task, GitQueueTask):
@@ -1414,17 +2579,26 @@ class GitQueue(object):
                 continue
 
             try:
-                if task.task_type is GitTaskAction.TEST_PICKME_CONFLICT:
-                    cls.test_pickme_conflicts(worker_id, task.request_id, **task.kwargs)
-                elif task.task_type is GitTaskAction.TEST_CONFLICTING_PICKMES:
-                    cls.requeue_pickmes_for_push(task.request_id, task.kwargs['pushmanager_url'], conflicting_only=True)
-                elif task.task_type is GitTaskAction.TEST_ALL_PICKMES:
-                    cls.requeue_pickmes_for_push(task.request_id, task.kwargs['pushmanager_url'])
-                else:
-                    logging.error(
-                        "GitConflictQueue encountered unknown task type %d",
-                        task.task_type
-                    )
+                with cls._task_timer('git-conflict', task), git_task_deadline(Settings['git']['task_timeout']):
+                    if task.task_type is GitTaskAction.TEST_PICKME_CONFLICT:
+                        cls.test_pickme_conflicts(worker_id, task.request_id, **task.kwargs)
+                    elif task.task_type is GitTaskAction.TEST_CONFLICTING_PICKMES:
+                        cls.requeue_pickmes_for_push(
+                            task.request_id,
+                            task.kwargs['pushmanager_url'],
+                            conflicting_only=True
+                        )
+                    elif task.task_type is GitTaskAction.TEST_ALL_PICKMES:
+                        cls.requeue_pickmes_for_push(task.request_id, task.kwargs['pushmanager_url'])
+                    elif task.task_type is GitTaskAction.BUILD_DEPLOY_BRANCH:
+                        cls.build_deploy_branch(worker_id, task.request_id)
+                    else:
+                        logging.error(
+                            "GitConflictQueue encountered unknown task type %d",
+                            task.task_type
+                        )
+            except GitTimeoutException, e:
+                cls._log_task_timeout('GitConflictQueue', task, e)
             except Exception:
                 logging.error('THREAD ERROR:', exc_info=True)
             finally:
@@ -1442,16 +2616,25 @@ class GitQueue(object):
         '''
 
         logging.info("Starting GitCheckActiveRequestSHADaemon")
+        sweep_started = None
         while True:
-            time.sleep(1)  # Throttle a bit
+            # Start a sweep at most every git.poll_interval seconds. Queries
+            # against the remotes are limited by their throttles.
+            if sweep_started is not None:
+                time.sleep(max(0, sweep_started + Settings['git']['poll_interval'] - time.time()))
+            sweep_started = time.time()
             active_requests = cls._get_active_requests()
 
             if active_requests is None:
                 continue
 
             for req in active_requests:
-                time.sleep(.04)  # Try not to hammer the git repo
-                sha = cls._get_branch_sha_from_repo(req, alert=False)
+                try:
+                    with git_task_deadline(Settings['git']['task_timeout']):
+                        sha = cls._get_branch_sha_from_repo(req, alert=False)
+                except GitTimeoutException, e:
+                    logging.error("Timed out polling request %s: %s", req['id'], e.details)
+                    continue
                 if sha is None:
                     sha = '0'*40
 
@@ -1488,10 +2671,14 @@ class GitQueue(object):
         GitQueue.enqueue_request(
             GitTaskAction.VERIFY_BRANCH,
             req['id'],
+            priority=GitQueuePriority.BACKGROUND,
             pushmanager_url=raw_url
         )
 
+        push = None
         if req['state'] in ('pickme', 'added'):
+            # None if the request left its push since it was polled
+            push = cls._get_push_for_request(req['id'])
             if 'no-conflicts' in req['tags'] or 'conflict-master' in req['tags']:
                 # Only run conflict checks on this branch, since any other affected by it will be new
                 # conflict-pickmes and caught normally
@@ -1500,22 +2687,33 @@ class GitQueue(object):
                     req['id'],
                     pushmanager_url=raw_url
                 )
-            elif 'conflict-pickme' in req['tags']:
+            elif 'conflict-pickme' in req['tags'] and push is not None:
                 # Run on all conflict checks on all conflict-pickmes since this might resolve
                 # conflicts between this branch and others
                 GitQueue.enqueue_request(
                     GitTaskAction.TEST_CONFLICTING_PICKMES,
-                    cls._get_push_for_request(req['id'])['push'],
+                    push['push'],
                     pushmanager_url=raw_url
                 )
 
+        if req['state'] == 'added' and push is not None:
+            GitQueue.enqueue_request(
+                GitTaskAction.BUILD_DEPLOY_BRANCH,
+                push['push']
+            )
+
     @classmethod
-    def enqueue_request(cls, task_type, request_id, **kwargs):
+    def enqueue_request(cls, task_type, request_id, priority=GitQueuePriority.INTERACTIVE, **kwargs):
         if task_type is GitTaskAction.VERIFY_BRANCH:
             if not cls.sha_queue:
                 logging.error("Attempted to put to nonexistent GitSHAQueue!")
                 return
-            cls.sha_queue.put(GitQueueTask(task_type, request_id, **kwargs))
+            if priority == GitQueuePriority.BACKGROUND:
+                lane = cls.sha_background_queue
+            else:
+                lane = cls.sha_queue
+            lane.put(GitQueueTask(task_type, request_id, **kwargs))
+            cls.sha_tasks.release()
         else:
             if not cls.conflict_queue:
                 logging.error("Attempted to put to nonexistent GitConflictQueue!")
@@ -6,6 +6,7 @@ from Queue import Empty
 from multiprocessing import JoinableQueue
 from multiprocessing import Process
 
+from pushmanager.core import metrics
 from pushmanager.core.settings import Settings
 
 
@@ -20,6 +21,7 @@ class MailQueue(object):
         if cls.worker_process is not None:
             return []
         cls.message_queue = JoinableQueue()
+        metrics.register_queue('mail', cls.message_queue)
         cls.worker_process = Process(target=cls.process_queue, name='mail-queue')
         cls.worker_process.daemon = True
         cls.worker_process.start()
@@ -36,7 +38,8 @@ class MailQueue(object):
             send_email_args = cls.message_queue.get(True)
             cls.smtp = smtplib.SMTP('127.0.0.1', 25)
             while True:
-                cls._send_email(*send_email_args)
+                with metrics.timer('pushmanager_worker_task_duration_seconds', {'queue': 'mail', 'task': 'send'}):
+                    cls._send_email(*send_email_args)
                 try:
                     # Only blocks for 5 seconds max, raises Empty if still nothing
                     send_email_args = cls.message_queue.get(True, 5)
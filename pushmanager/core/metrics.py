@@ -0,0 +1,306 @@
+"""
+Process-local metrics, aggregated across processes at scrape time.
+
+Tornado workers and queue workers are separate (forked) processes. Each one
+records counters and histograms in memory, and a background thread writes
+them every few seconds (and once more at exit) to a file of its own in the
+application's metrics directory (see init). Processes that block on a queue
+between tasks are reported without waiting for their next sample. The
+/metrics servlet merges the files of all processes and renders them in the
+Prometheus text format. Files of exited processes are kept, so counters only
+reset when the application restarts.
+
+Without a metrics directory (as in tests) only the current process is
+reported.
+"""
+import json
+import logging
+import multiprocessing.util
+import os
+import pwd
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from pushmanager.core.settings import Settings
+
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRICS = {
+    'pushmanager_http_request_duration_seconds': (
+        'histogram', 'Time spent handling HTTP requests, per servlet'),
+    'pushmanager_db_query_duration_seconds': (
+        'histogram', 'Time spent executing database queries, per call site'),
+    'pushmanager_db_pool_wait_seconds': (
+        'histogram', 'Time spent checking out a database connection, by process role'),
+    'pushmanager_db_pool_timeouts_total': (
+        'counter', 'Database connection checkouts that timed out, by process role'),
+    'pushmanager_worker_task_duration_seconds': (
+        'histogram', 'Time queue workers spent on a task'),
+    'pushmanager_ldap_duration_seconds': (
+        'histogram', 'Time spent authenticating against LDAP, by result'),
+    'pushmanager_cache_requests_total': (
+        'counter', 'Cache lookups, by cache and result (hit or miss)'),
+    'pushmanager_conflict_checks_total': (
+        'counter', 'Pickme pairs checked for conflicts, by result (pruned or merged)'),
+    'pushmanager_deploy_steps_total': (
+        'counter', 'Steps of deploy branch candidates, by result (kept, merged or conflict)'),
+    'pushmanager_queue_depth': (
+        'gauge', 'Number of items waiting in a queue'),
+}
+
+directory = None
+flush_interval = 5
+
+_pid = None
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_last_flush = 0
+# Whether anything was recorded since the last flush
+_dirty = False
+_flusher = None
+
+# Queues whose depth is sampled at scrape time. Queue workers register them
+# before forking, so all tornado workers can report them.
+queues = {}
+
+
+def init(name):
+    """Sets up (and empties) the metrics directory of application name. Has
+    to be called before any worker process is forked."""
+    global directory, flush_interval
+    if not Settings.get('metrics', {}).get('directory'):
+        return
+    directory = os.path.join(Settings['metrics']['directory'], name)
+    flush_interval = Settings['metrics']['flush_interval']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    if os.getuid() == 0:
+        # Tornado workers drop privileges once forked
+        os.chown(directory, pwd.getpwnam(Settings.get("username", "www-data"))[2], -1)
+
+
+def register_queue(name, queue):
+    queues[name] = queue
+
+
+def queue_depths():
+    """Returns the gauges of all registered queues, for render."""
+    depths = {}
+    for name, queue in queues.iteritems():
+        try:
+            depths[('pushmanager_queue_depth', (('queue', name),))] = queue.qsize()
+        except NotImplementedError:
+            # qsize relies on sem_getvalue, missing on Mac OS X
+            continue
+    return depths
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+def _check_pid():
+    """Forked children start with an empty set of metrics, the parent's
+    are reported by the parent."""
+    global _pid, _lock, _counters, _histograms, _last_flush, _dirty, _flusher
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _lock = threading.Lock()
+        _counters = {}
+        _histograms = {}
+        _last_flush = 0
+        _dirty = False
+        # Threads don't survive a fork
+        _flusher = None
+
+
+def _flush_periodically(pid):
+    while _pid == pid:
+        time.sleep(flush_interval)
+        if _dirty:
+            flush(force=True)
+
+
+def _start_flusher():
+    global _flusher
+    if directory is None or _flusher is not None:
+        return
+    _flusher = threading.Thread(target=_flush_periodically, args=(_pid,), name='metrics-flush')
+    _flusher.daemon = True
+    _flusher.start()
+    # Unlike atexit handlers, finalizers also run when a multiprocessing
+    # worker returns
+    multiprocessing.util.Finalize(None, flush, kwargs={'force': True}, exitpriority=0)
+
+
+def inc(name, labels=None, value=1):
+    global _dirty
+    _check_pid()
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _dirty = True
+    _start_flusher()
+    flush()
+
+
+def observe(name, value, labels=None):
+    global _dirty
+    _check_pid()
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # One count per bucket, then the sum and the overall count
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+        _dirty = True
+    _start_flusher()
+    flush()
+
+
+def cache_lookup(cache, hit):
+    inc('pushmanager_cache_requests_total', {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+@contextmanager
+def timer(name, labels=None):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, labels)
+
+
+def caller_name(depth=2):
+    """Returns module.function of the caller of the function calling this."""
+    frame = sys._getframe(depth)
+    return '%s.%s' % (frame.f_globals.get('__name__'), frame.f_code.co_name)
+
+
+def _snapshot():
+    global _dirty
+    with _lock:
+        _dirty = False
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.iteritems()],
+            'histograms': [[name, labels, list(value)] for (name, labels), value in _histograms.iteritems()],
+        }
+
+
+def flush(force=False):
+    """Writes the metrics of this process to its file, at most every
+    flush_interval seconds unless forced."""
+    global _last_flush
+    if directory is None:
+        return
+    _check_pid()
+    now = time.time()
+    if not force and now - _last_flush < flush_interval:
+        return
+    _last_flush = now
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        with os.fdopen(fd, 'w') as metrics_file:
+            json.dump(_snapshot(), metrics_file)
+        os.rename(temp_path, os.path.join(directory, '%d.json' % _pid))
+    except (IOError, OSError):
+        logging.warning("Could not write metrics to %s", directory, exc_info=True)
+
+
+def collect():
+    """Merges the metrics of all processes.
+
+    :return: Tuple of dicts (counters, histograms), keyed by (name, labels)
+    """
+    _check_pid()
+    flush(force=True)
+
+    snapshots = []
+    if directory is None:
+        snapshots.append(_snapshot())
+    else:
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as metrics_file:
+                    snapshots.append(json.load(metrics_file))
+            except (IOError, ValueError):
+                # Process died mid-write or the file was just replaced
+                continue
+
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = _key(name, dict(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot['histograms']:
+            key = _key(name, dict(labels))
+            merged = histograms.setdefault(key, [0] * len(value))
+            for i, count in enumerate(value):
+                merged[i] += count
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (label, unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in labels
+    )
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=None):
+    """Renders the merged metrics of all processes, plus gauges sampled by
+    the caller, in the Prometheus text exposition format.
+
+    :param gauges: Dict of (name, labels dict) -> value
+    """
+    counters, histograms = collect()
+    for (name, labels), value in (gauges or {}).iteritems():
+        counters[_key(name, dict(labels))] = value
+
+    by_name = {}
+    for (name, labels), value in counters.iteritems():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), value in histograms.iteritems():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for labels, value in sorted(by_name[name]):
+            if metric_type != 'histogram':
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value):
+                cumulative += count
+                bucket_labels = _format_labels(labels, [('le', repr(float(bound)))])
+                lines.append('%s_bucket%s %d' % (name, bucket_labels, cumulative))
+            lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', '+Inf')]), value[-1]))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(value[-2])))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), value[-1]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,180 @@
+"""
+Plans which pickmes of a push to accept together.
+
+Conflict workers record the pairs of pickmes that fail to merge on top of
+each other in push_conflictpairs. Those pairs form a graph, and the largest
+set of pickmes that merge together is a maximum weight independent set of
+that graph. Pickmes without conflicts are always in it, and pairs only
+conflict with a few others, so the set is searched for exactly in every
+connected component of conflicting pickmes. Components larger than
+MAX_EXACT_COMPONENT are solved greedily instead.
+"""
+import time
+
+from pushmanager.core.util import tags_contain
+
+
+# How requests are weighed against each other:
+#  - count: every request counts the same, the plan keeps as many as it can
+#  - age: older requests weigh more (one more per day they have been open)
+#  - urgent: requests tagged urgent outweigh all others together
+WEIGHTS = ('count', 'age', 'urgent')
+
+MAX_EXACT_COMPONENT = 20
+
+
+def _is_urgent(request):
+    return tags_contain(request['tags'] or '', ['urgent'])
+
+
+def request_weights(requests, weight='count', now=None):
+    """Returns a dict of request id -> weight of the request."""
+    if weight not in WEIGHTS:
+        raise ValueError("Unknown weight %r" % weight)
+    if now is None:
+        now = time.time()
+
+    weights = {}
+    for request in requests:
+        if weight == 'age':
+            created = now if request['created'] is None else request['created']
+            weights[request['id']] = 1 + max(now - created, 0) / 86400.0
+        elif weight == 'urgent' and _is_urgent(request):
+            weights[request['id']] = len(requests) + 1
+        else:
+            weights[request['id']] = 1
+    return weights
+
+
+def _components(nodes, neighbours):
+    seen = set()
+    for node in sorted(nodes):
+        if node in seen:
+            continue
+        component = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current in component:
+                continue
+            component.add(current)
+            stack.extend(neighbours[current] - component)
+        seen |= component
+        yield component
+
+
+def _greedy_independent_set(nodes, weights, neighbours):
+    chosen = set()
+    remaining = set(nodes)
+    while remaining:
+        node = max(
+            remaining,
+            key=lambda n: (weights[n] / (len(neighbours[n] & remaining) + 1.0), -n)
+        )
+        chosen.add(node)
+        remaining -= neighbours[node] | set([node])
+    return chosen
+
+
+def _exact_independent_set(nodes, weights, neighbours):
+    best = [-1, set()]
+
+    def search(remaining, chosen, total):
+        if total + sum(weights[n] for n in remaining) <= best[0]:
+            return
+        if not remaining:
+            best[0], best[1] = total, set(chosen)
+            return
+        # Branching on the most connected node removes the most candidates
+        node = max(remaining, key=lambda n: (len(neighbours[n] & remaining), weights[n], -n))
+        if not neighbours[node] & remaining:
+            # Nothing left conflicts, take everything
+            search(set(), chosen | remaining, total + sum(weights[n] for n in remaining))
+            return
+        search(remaining - neighbours[node] - set([node]), chosen | set([node]), total + weights[node])
+        search(remaining - set([node]), chosen, total)
+
+    search(set(nodes), set(), 0)
+    return best[1]
+
+
+def max_weight_conflict_free(candidates, weights, conflicts):
+    """Returns the set of candidates with the largest total weight such that
+    no two of them conflict.
+
+    :param candidates: Iterable of request ids
+    :param weights: Dict of request id -> weight
+    :param conflicts: Iterable of (request id, request id) pairs
+    """
+    candidates = set(candidates)
+    neighbours = dict((node, set()) for node in candidates)
+    for left, right in conflicts:
+        if left in candidates and right in candidates and left != right:
+            neighbours[left].add(right)
+            neighbours[right].add(left)
+
+    chosen = set()
+    for component in _components(candidates, neighbours):
+        if len(component) > MAX_EXACT_COMPONENT:
+            chosen |= _greedy_independent_set(component, weights, neighbours)
+        else:
+            chosen |= _exact_independent_set(component, weights, neighbours)
+    return chosen
+
+
+def plan_push(requests, conflicts, weight='count', now=None):
+    """Plans which pickmes of a push to accept.
+
+    Requests already added to the push stay in it, pickmes that conflict
+    with master or with an added request are left out, and of the remaining
+    pickmes the largest (by weight) conflict-free set is kept. The set is
+    suggested in merge order: urgent requests first, then the oldest.
+
+    :param requests: Pickme'd and added requests of the push (dicts)
+    :param conflicts: Iterable of (request id, request id) pairs that
+        conflict
+    :param weight: One of WEIGHTS
+    :return: Dict with the ids of the pickmes to accept in order ('accept'),
+        and those left out along with why ('excluded')
+    """
+    by_id = dict((request['id'], request) for request in requests)
+    conflicts = [(left, right) for left, right in conflicts if left in by_id and right in by_id]
+    conflicting = dict((request_id, set()) for request_id in by_id)
+    for left, right in conflicts:
+        conflicting[left].add(right)
+        conflicting[right].add(left)
+
+    added = set(request_id for request_id, request in by_id.iteritems() if request['state'] == 'added')
+    excluded = {}
+    candidates = set()
+    for request_id, request in by_id.iteritems():
+        if request_id in added:
+            continue
+        if tags_contain(request['tags'] or '', ['conflict-master']):
+            excluded[request_id] = 'conflict-master'
+        elif conflicting[request_id] & added:
+            excluded[request_id] = 'conflict-added'
+        else:
+            candidates.add(request_id)
+
+    weights = request_weights([by_id[request_id] for request_id in candidates], weight, now)
+    accept = max_weight_conflict_free(candidates, weights, conflicts)
+    for request_id in candidates - accept:
+        excluded[request_id] = 'conflict-pickme'
+
+    order = sorted(
+        accept,
+        key=lambda request_id: (not _is_urgent(by_id[request_id]), by_id[request_id]['created'], request_id)
+    )
+    return {
+        'weight': weight,
+        'accept': order,
+        'excluded': [
+            {
+                'id': request_id,
+                'reason': excluded[request_id],
+                'conflicts': sorted(conflicting[request_id] & (accept | added)),
+            }
+            for request_id in sorted(excluded)
+        ],
+    }
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Rate limiting for the queue workers.
+
+An AdaptiveThrottle is a token bucket whose rate follows the health of the
+service it protects: every call that finishes quickly raises the rate a
+little (up to the configured rate), every slow or failed call halves it (down
+to the configured minimum). Idle services are therefore queried at full
+speed, while overloaded ones are backed off from until they recover.
+
+The bucket lives in shared memory, so a throttle created before the workers
+are forked limits all of them together.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from multiprocessing import Array
+
+# Indexes into the shared state
+_TOKENS = 0
+_UPDATED = 1
+_RATE = 2
+
+
+class AdaptiveThrottle(object):
+
+    # Fraction of the configured rate regained after each fast call
+    INCREASE = 0.1
+    # Factor the rate is multiplied with after each slow or failed call
+    DECREASE = 0.5
+
+    def __init__(self, name, rate, burst=1, min_rate=None, latency_target=None):
+        """
+        :param name: Name of the throttled service, for logging
+        :param rate: Calls per second allowed while the service is healthy.
+            0 disables throttling.
+        :param burst: Number of calls that may be made at once after an idle
+            period
+        :param min_rate: Lowest rate backoff may go down to. Defaults to a
+            tenth of rate.
+        :param latency_target: Seconds after which a call counts as slow.
+            None only backs off on errors.
+        """
+        self.name = name
+        self.max_rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 10
+        self.latency_target = latency_target
+        self.state = Array('d', [self.burst, time.time(), self.max_rate])
+
+    @classmethod
+    def from_settings(cls, name, settings):
+        """Builds a throttle from a config section with the keys rate, burst,
+        min_rate and latency_target."""
+        return cls(
+            name,
+            settings['rate'],
+            burst=settings['burst'],
+            min_rate=settings['min_rate'],
+            latency_target=settings['latency_target'],
+        )
+
+    @property
+    def enabled(self):
+        return self.max_rate > 0
+
+    @property
+    def rate(self):
+        return self.state[_RATE]
+
+    def _take_token(self):
+        """Takes a token if one is available, otherwise returns the number of
+        seconds until the next one will be."""
+        with self.state.get_lock():
+            now = time.time()
+            tokens = min(
+                self.burst,
+                self.state[_TOKENS] + (now - self.state[_UPDATED]) * self.state[_RATE]
+            )
+            self.state[_UPDATED] = now
+            if tokens >= 1:
+                self.state[_TOKENS] = tokens - 1
+                return 0
+            self.state[_TOKENS] = tokens
+            return (1 - tokens) / self.state[_RATE]
+
+    def acquire(self):
+        """Blocks until the throttle allows another call."""
+        if not self.enabled:
+            return
+        wait = self._take_token()
+        while wait:
+            time.sleep(wait)
+            wait = self._take_token()
+
+    def _set_rate(self, rate):
+        with self.state.get_lock():
+            old_rate = self.state[_RATE]
+            self.state[_RATE] = max(self.min_rate, min(self.max_rate, rate))
+        return old_rate
+
+    def success(self, latency):
+        """Records a call that returned after latency seconds."""
+        if not self.enabled:
+            return
+        if self.latency_target is not None and latency > self.latency_target:
+            self.backoff("slow response (%.2fs)" % latency)
+        else:
+            self._set_rate(self.rate + self.max_rate * self.INCREASE)
+
+    def failure(self):
+        """Records a call that failed."""
+        if self.enabled:
+            self.backoff("error")
+
+    def backoff(self, reason):
+        old_rate = self._set_rate(self.rate * self.DECREASE)
+        if self.rate < old_rate:
+            logging.warning(
+                "Throttling %s to %.2f calls/s after %s",
+                self.name, self.rate, reason
+            )
+
+    @contextmanager
+    def throttled(self):
+        """Waits for a token, then times the wrapped call and adapts the rate
+        to how it went. Exceptions count as failures and are re-raised."""
+        self.acquire()
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            self.failure()
+            raise
+        self.success(time.time() - start)
+
+
+__all__ = ['AdaptiveThrottle']
@@ -2,76 +2,235 @@ import base64
 import httplib
 import json
 import logging
+import socket
+import threading
 import time
 from multiprocessing import JoinableQueue
 from multiprocessing import Process
+from Queue import Queue
 from urllib import urlencode
 
+from pushmanager.core import metrics
+from pushmanager.core.ratelimit import AdaptiveThrottle
 from pushmanager.core.settings import Settings
 
 
-class RBQueue(object):
+class ReviewBoardException(Exception):
+    pass
 
-    review_queue = None
-    worker_process = None
 
-    @classmethod
-    def start_worker(cls):
-        if cls.worker_process is not None:
-            return []
-        cls.review_queue = JoinableQueue()
-        cls.worker_process = Process(target=cls.process_queue, name='rb-queue')
-        cls.worker_process.daemon = True
-        cls.worker_process.start()
-        return [cls.worker_process.pid]
+class ReviewBoardClient(object):
+    """Marks reviews as submitted from a pool of threads, each keeping its
+    own connection to ReviewBoard alive between reviews.
+
+    Reviews that are already waiting or being worked on are not queued
+    again. Failed attempts are retried with exponential backoff.
+    """
+
+    def __init__(self, servername, username, password, concurrency=1, retries=0,
+                 retry_backoff=1, throttle=None, connection_class=httplib.HTTPSConnection):
+        self.servername = servername
+        self.credentials = base64.b64encode("%s:%s" % (username, password))
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.throttle = throttle
+        self.connection_class = connection_class
+
+        self.local = threading.local()
+        self.work_queue = Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'failed': 0,
+            'retried': 0,
+            'duplicates': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+        self.threads = []
 
     @classmethod
-    def process_queue(cls):
-        while True:
-            time.sleep(1)
+    def from_settings(cls):
+        return cls(
+            Settings['reviewboard']['servername'],
+            Settings['reviewboard']['username'],
+            Settings['reviewboard']['password'],
+            concurrency=Settings['reviewboard']['concurrency'],
+            retries=Settings['reviewboard']['retries'],
+            retry_backoff=Settings['reviewboard']['retry_backoff'],
+            throttle=AdaptiveThrottle.from_settings('ReviewBoard', Settings['reviewboard']['throttle']),
+        )
 
-            review_id = cls.review_queue.get()
+    def start(self):
+        for _ in range(self.concurrency - len(self.threads)):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, review_id, callback=None):
+        """Queues review_id to be marked as submitted, then calls
+        callback(review_id, success). Returns False if the review was
+        already queued, in which case callback is called right away."""
+        with self.lock:
+            duplicate = review_id in self.pending
+            if duplicate:
+                self.stats['duplicates'] += 1
+            else:
+                self.pending.add(review_id)
+        if duplicate:
+            if callback:
+                callback(review_id, True)
+            return False
+        self.work_queue.put((review_id, callback))
+        return True
+
+    def join(self):
+        """Blocks until all queued reviews have been handled."""
+        self.work_queue.join()
+
+    def _work(self):
+        while True:
+            review_id, callback = self.work_queue.get()
+            success = False
             try:
-                cls.mark_review_as_submitted(review_id)
+                with metrics.timer(
+                    'pushmanager_worker_task_duration_seconds',
+                    {'queue': 'reviewboard', 'task': 'submit'}
+                ):
+                    success = self.mark_review_as_submitted(review_id)
             except Exception:
                 logging.error(
                     "ReviewBoard queue worker encountered an error (review_id: %r)",
                     review_id, exc_info=True
                 )
             finally:
-                cls.review_queue.task_done()
+                with self.lock:
+                    self.pending.discard(review_id)
+                self.work_queue.task_done()
+                if callback:
+                    callback(review_id, success)
 
-    @classmethod
-    def mark_review_as_submitted(cls, review_id):
-        credentials = base64.b64encode("%s:%s" % (
-            Settings['reviewboard']['username'],
-            Settings['reviewboard']['password'],
-        ))
+    def _get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.connection_class(self.servername)
+            self.local.connection = connection
+        return connection
+
+    def _close_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
 
+    def _put(self, path, data):
         headers = {
             'Accept': 'application/json',
-            'Authorization': 'Basic %s' % credentials,
+            'Authorization': 'Basic %s' % self.credentials,
             'Content-Type': 'application/x-www-form-urlencoded',
         }
+        # A kept-alive connection may have been closed by the server in the
+        # meantime, which only shows once we use it. Retry those right away
+        # on a fresh connection.
+        for fresh in (False, True):
+            if fresh:
+                self._close_connection()
+            reused = getattr(self.local, 'connection', None) is not None
+            connection = self._get_connection()
+            try:
+                connection.request("PUT", path, data, headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                self._close_connection()
+                if fresh or not reused:
+                    raise
+                continue
+            if response.will_close:
+                self._close_connection()
+            return response.status, body
 
+    def _mark_review_as_submitted_once(self, review_id):
         data = urlencode({'status': 'submitted'})
-
-        conn = httplib.HTTPSConnection(Settings['reviewboard']['servername'])
-        conn.request("PUT", "/api/review-requests/%d/" % review_id, data, headers)
-        raw_result = conn.getresponse().read()
+        status, raw_result = self._put("/api/review-requests/%d/" % review_id, data)
         try:
             result = json.loads(raw_result)
         except Exception:
             result = None
-        conn.close()
-
         if not result or result.get('stat') != 'ok':
-            logging.error(
-                "Unable to mark review %r as submitted (%r)",
-                review_id,
-                raw_result,
-                exc_info=True
+            raise ReviewBoardException("HTTP %d: %r" % (status, raw_result))
+
+    def mark_review_as_submitted(self, review_id):
+        start = time.time()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self.lock:
+                    self.stats['retried'] += 1
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                if self.throttle:
+                    with self.throttle.throttled():
+                        self._mark_review_as_submitted_once(review_id)
+                else:
+                    self._mark_review_as_submitted_once(review_id)
+            except (ReviewBoardException, httplib.HTTPException, socket.error), e:
+                logging.warning(
+                    "Attempt %d to mark review %r as submitted failed (%r)",
+                    attempt + 1, review_id, e
+                )
+                error = e
+                continue
+
+            latency = time.time() - start
+            with self.lock:
+                self.stats['submitted'] += 1
+                self.stats['latency_total'] += latency
+                self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+            logging.info(
+                "Marked review %r as submitted in %.2fs (%d attempts)",
+                review_id, latency, attempt + 1
             )
+            return True
+
+        with self.lock:
+            self.stats['failed'] += 1
+        logging.error(
+            "Unable to mark review %r as submitted after %d attempts (%r)",
+            review_id, self.retries + 1, error
+        )
+        return False
+
+
+class RBQueue(object):
+
+    review_queue = None
+    worker_process = None
+
+    @classmethod
+    def start_worker(cls):
+        if cls.worker_process is not None:
+            return []
+        cls.review_queue = JoinableQueue()
+        metrics.register_queue('reviewboard', cls.review_queue)
+        cls.worker_process = Process(target=cls.process_queue, name='rb-queue')
+        cls.worker_process.daemon = True
+        cls.worker_process.start()
+        return [cls.worker_process.pid]
+
+    @classmethod
+    def process_queue(cls):
+        client = ReviewBoardClient.from_settings()
+        client.start()
+
+        def on_review_done(review_id, success):
+            cls.review_queue.task_done()
+
+        while True:
+            review_id = cls.review_queue.get()
+            client.submit(review_id, on_review_done)
 
     @classmethod
     def enqueue_review(cls, review_id):
@@ -7,6 +7,7 @@ import tornado.httpclient
 import tornado.stack_context
 import tornado.web
 
+from pushmanager.core import metrics
 from pushmanager.core.settings import JSSettings
 from pushmanager.core.settings import Settings
 
@@ -46,6 +47,17 @@ class RequestHandler(tornado.web.RequestHandler):
     def get_current_user(self):
         return self.get_secure_cookie("user")
 
+    def on_finish(self):
+        metrics.observe(
+            'pushmanager_http_request_duration_seconds',
+            self.request.request_time(),
+            {
+                'servlet': type(self).__name__,
+                'method': self.request.method,
+                'status': str(self.get_status()),
+            }
+        )
+
     @staticmethod
     def get_api_page(method):
         host = "%s:%d" % (
@@ -1,6 +1,7 @@
 import copy
 import datetime
 import subprocess
+from collections import OrderedDict
 
 from tornado.escape import xhtml_escape
 
@@ -33,6 +34,36 @@ class EscapedDict(object):
             return self.doc[key]
 
 
+class LRUCache(object):
+    """
+    Keeps the size most recently used entries of a mapping. A size of 0
+    disables caching altogether.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+
 def get_int_arg(request, field, default=None):
     """Try to get an integer value from a query arg."""
     try:
@@ -167,29 +198,79 @@ def del_from_tags_str(current_tags, tags):
     )
 
 
-def request_to_jsonable(request):
+# Fields of the JSON representation of a request
+REQUEST_FIELDS = (
+    'id',
+    'user',
+    'watchers',
+    'state',
+    'repo',
+    'branch',
+    'revision',
+    'tags',
+    'conflicts',
+    'created',
+    'modified',
+    'title',
+    'comments',
+    'reviewid',
+    'description'
+)
+
+# Unbounded text fields, which lists of requests leave out of their summary
+# representation. Views load them when a request is expanded.
+REQUEST_DETAIL_FIELDS = ('conflicts', 'comments', 'description')
+REQUEST_SUMMARY_FIELDS = tuple(field for field in REQUEST_FIELDS if field not in REQUEST_DETAIL_FIELDS)
+
+
+def request_fields(fields=None, required=('id',)):
+    """Parses the fields= argument of the request APIs: 'all' (the default),
+    'summary', or a comma separated list of fields. Required fields are
+    always included.
+
+    :return: Tuple of field names, in the order of REQUEST_FIELDS
+    :raises ValueError: On unknown fields
+    """
+    if not fields or fields == 'all':
+        fields = REQUEST_FIELDS
+    elif fields == 'summary':
+        fields = REQUEST_SUMMARY_FIELDS
+    else:
+        fields = set(field.strip() for field in fields.split(','))
+        unknown = fields - set(REQUEST_FIELDS)
+        if unknown:
+            raise ValueError("Unknown request fields: %s" % ', '.join(sorted(unknown)))
+    fields = set(fields) | set(required)
+    return tuple(field for field in REQUEST_FIELDS if field in fields)
+
+
+def request_to_jsonable(request, fields=REQUEST_FIELDS):
     """Get a request object and return a dict with desired key, value
     pairs that are to be encoded to json format
     """
-    return dict(
-        (k, request[k]) for k in (
-            'id',
-            'user',
-            'watchers',
-            'state',
-            'repo',
-            'branch',
-            'revision',
-            'tags',
-            'conflicts',
-            'created',
-            'modified',
-            'title',
-            'comments',
-            'reviewid',
-            'description'
-        )
-    )
+    return dict((k, request[k]) for k in fields)
+
+
+def requests_to_jsonable(rows, fields=REQUEST_FIELDS):
+    """Like request_to_jsonable, for rows that select exactly the given
+    fields in that order (see api.APIServlet._select_requests). Values are
+    paired with field names by position instead of looked up by key.
+    """
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def comment_to_jsonable(comment):
+    """Get a row of push_requestcomments and return a dict with desired
+    key, value pairs that are to be encoded to json format
+    """
+    return dict((k, comment[k]) for k in ('id', 'request', 'user', 'comment', 'created'))
+
+
+def format_request_comment(user, comment):
+    """Renders a comment on a request the way views display it below the
+    comments of the request's author.
+    """
+    return "Comment from %s:\n\n%s" % (user, comment)
 
 
 def push_to_jsonable(push):
@@ -202,6 +283,7 @@ def push_to_jsonable(push):
             'title',
             'user',
             'branch',
+            'revision',
             'stageenv',
             'state',
             'created',
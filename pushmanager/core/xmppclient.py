@@ -1,19 +1,19 @@
 import logging
 import time
+from collections import OrderedDict
 from multiprocessing import JoinableQueue
-from multiprocessing import Lock
 from multiprocessing import Process
+from Queue import Empty
 
 import xmpp
 
+from pushmanager.core import metrics
 from pushmanager.core.settings import Settings
 
 
 class XMPPQueue(object):
 
     MAX_RETRY_COUNT = 3
-    retry_messages = {}
-    retry_messages_lock = Lock()
 
     message_queue = None
     worker_process = None
@@ -23,55 +23,108 @@ class XMPPQueue(object):
         if cls.worker_process is not None:
             return []
         cls.message_queue = JoinableQueue()
+        metrics.register_queue('xmpp', cls.message_queue)
         cls.worker_process = Process(target=cls.process_queue, name='xmpp-queue')
         cls.worker_process.daemon = True
         cls.worker_process.start()
         return [cls.worker_process.pid]
 
     @classmethod
-    def _retry_message(cls, msg):
-        ret = True
-        cls.retry_messages_lock.acquire(True)
+    def _get_batch(cls, timeout):
+        """Waits up to timeout seconds for a message, then keeps collecting
+        messages for xmpp.coalesce_window seconds or until xmpp.batch_size
+        messages are queued.
+
+        :return: List of (recipient, message, attempts) tuples. Every one of
+            them has to be marked as done on the message queue.
+        """
+        batch = []
+        try:
+            batch.append(cls.message_queue.get(True, timeout))
+        except Empty:
+            return batch
 
-        cls.retry_messages[msg] = cls.retry_messages.get(msg, 0) + 1
-        if cls.retry_messages[msg] >= cls.MAX_RETRY_COUNT:
-            del cls.retry_messages[msg]
-            ret = False
+        window_end = time.time() + Settings['xmpp']['coalesce_window']
+        while len(batch) < Settings['xmpp']['batch_size']:
+            remaining = window_end - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(cls.message_queue.get(True, remaining))
+                else:
+                    batch.append(cls.message_queue.get_nowait())
+            except Empty:
+                break
 
-        cls.retry_messages_lock.release()
-        return ret
+        # Messages put back for a retry carry their number of attempts
+        return [item if len(item) == 3 else item + (0,) for item in batch]
 
     @classmethod
-    def _del_retry_message(cls, msg):
-        cls.retry_messages_lock.acquire(True)
-        if msg in cls.retry_messages:
-            del cls.retry_messages[msg]
-        cls.retry_messages_lock.release()
+    def _coalesce(cls, batch):
+        """Merges the messages of a batch going to the same JID into one
+        message each, in the order they were queued. Duplicates are dropped.
+
+        :return: List of (recipient, message, attempts) tuples
+        """
+        merged = OrderedDict()
+        for recipient, message, attempts in batch:
+            # Apply alias mapping, if any exists
+            recipient = Settings['aliases'].get(recipient, recipient)
+            messages, prev_attempts = merged.get(recipient, ([], 0))
+            if message not in messages:
+                messages.append(message)
+            merged[recipient] = (messages, max(attempts, prev_attempts))
+        return [
+            (jid, '\n\n'.join(jid_messages), jid_attempts)
+            for jid, (jid_messages, jid_attempts) in merged.iteritems()
+        ]
 
     @classmethod
-    def _process_queue_item(cls, jabber_client):
-        msg = cls.message_queue.get(True)  # Blocks until a message is queued
-        recipient, message = msg
+    def _retry_message(cls, recipient, message, attempts):
+        if attempts + 1 >= cls.MAX_RETRY_COUNT:
+            logging.error("Couldn't send the message %s" % repr((recipient, message)))
+            return
+        logging.warning("Couldn't send the message, will retry... %s" % repr((recipient, message)))
+        cls.message_queue.put((recipient, message, attempts + 1))
 
-        # Apply alias mapping, if any exists
-        recipient = Settings['aliases'].get(recipient, recipient)
+    @classmethod
+    def _send_batch(cls, jabber_client, messages):
+        """Writes all messages to the stream without waiting in between.
+
+        :return: False if the stream failed, in which case the failed message
+            and the ones after it were put back into the queue.
+        """
+        for i, (recipient, message, attempts) in enumerate(messages):
+            xmpp_message = xmpp.protocol.Message(recipient, message)
+            try:
+                jabber_client.send(xmpp_message)
+            except IOError, e:
+                logging.error(repr(e))
+                cls._retry_message(recipient, message, attempts)
+                # The messages after it never made it to the stream
+                for item in messages[i + 1:]:
+                    cls.message_queue.put(item)
+                return False
+            except Exception, e:
+                logging.error("Couldn't send the message %s" % repr((recipient, message)))
+                logging.error(repr(e))
+        return True
 
-        xmpp_message = xmpp.protocol.Message(recipient, message)
+    @classmethod
+    def _process_queue_batch(cls, jabber_client, timeout):
+        """Sends the next batch of messages, waiting up to timeout seconds
+        for one to be queued.
+
+        :return: False if the connection to the server failed
+        """
+        batch = cls._get_batch(timeout)
+        if not batch:
+            return True
         try:
-            jabber_client.send(xmpp_message)
-            cls._del_retry_message(msg)
-        except IOError, e:
-            if cls._retry_message(msg):
-                logging.warning("Couldn't send the message, will retry... %s" % repr(msg))
-                cls.message_queue.put(msg)
-            else:
-                logging.error("Couldn't send the message %s" % repr(msg))
-                logging.error(repr(e))
-        except Exception, e:
-            logging.error("Couldn't send the message %s" % repr(msg))
-            logging.error(repr(e))
+            with metrics.timer('pushmanager_worker_task_duration_seconds', {'queue': 'xmpp', 'task': 'send_batch'}):
+                return cls._send_batch(jabber_client, cls._coalesce(batch))
         finally:
-            cls.message_queue.task_done()
+            for _ in batch:
+                cls.message_queue.task_done()
 
     @classmethod
     def _xmpp_connect_and_auth(cls):
@@ -99,7 +152,8 @@ class XMPPQueue(object):
 
     @classmethod
     def _xmpp_check_and_reconnect(cls, jabber_client):
-        jabber_client.Process(1)
+        # Handle whatever the server sent us, without waiting for more
+        jabber_client.Process(0)
         if not jabber_client.isConnected():
             logging.warning("Client is disconnected from XMPP server, reconnecting...")
             jabber_client.reconnectAndReauth()
@@ -111,9 +165,15 @@ class XMPPQueue(object):
                 jabber_client = cls._xmpp_connect_and_auth()
                 if not jabber_client:
                     return
+                next_keepalive = time.time() + Settings['xmpp']['keepalive_interval']
                 while True:
-                    cls._process_queue_item(jabber_client)
-                    cls._xmpp_check_and_reconnect(jabber_client)
+                    connected = cls._process_queue_batch(
+                        jabber_client,
+                        max(0, next_keepalive - time.time())
+                    )
+                    if not connected or time.time() >= next_keepalive:
+                        cls._xmpp_check_and_reconnect(jabber_client)
+                        next_keepalive = time.time() + Settings['xmpp']['keepalive_interval']
             except Exception, e:
                 logging.error("Error processing queue, retrying... %s" % e)
             finally:
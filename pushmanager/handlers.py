@@ -3,7 +3,9 @@ from __future__ import with_statement
 
 import urlparse
 
-from pushmanager.core.auth import authenticate_ldap
+import tornado.gen
+import tornado.web
+from pushmanager.core.auth import authenticate_ldap_async
 from pushmanager.core.requesthandler import RequestHandler
 from pushmanager.core.settings import Settings
 
@@ -80,6 +82,7 @@ class LoginHandler(RequestHandler):
             return self.render("login.html", page_title="Login", next_url=next_url,
                                errors="No login strategy currently configured. Please have a friendly sysadmin")
 
+    @tornado.web.asynchronous
     def post(self):
         next_url = self.request.arguments.get('next', [None])[0]
         username = self.request.arguments.get('username', [None])[0]
@@ -93,10 +96,7 @@ class LoginHandler(RequestHandler):
             if not username or not password:
                 return self.render("login.html", page_title="Login", next_url=next_url,
                                    errors="Please enter both a username and a password.")
-            if not authenticate_ldap(username, password):
-                return self.render("login.html", page_title="Login", next_url=next_url,
-                                   errors="Invalid username or password specified.")
-            return login(self, username, next_url)
+            return self._ldap_login(username, password, next_url)
 
         elif Settings['login_strategy'] == 'saml':
             # They shouldn't be POSTing, but it's cool. Blatantly ignore their
@@ -110,6 +110,21 @@ class LoginHandler(RequestHandler):
         return self.render("login.html", page_title="Login", next_url=next_url,
                            errors="No login strategy currently configured.")
 
+    @tornado.gen.engine
+    def _ldap_login(self, username, password, next_url):
+        # Authenticates from a thread, the IOLoop keeps serving meanwhile
+        authenticated = yield tornado.gen.Task(
+            authenticate_ldap_async,
+            username,
+            password,
+            io_loop=self.request.connection.stream.io_loop,
+        )
+        if authenticated:
+            login(self, username, next_url)
+        else:
+            self.render("login.html", page_title="Login", next_url=next_url,
+                        errors="Invalid username or password specified.")
+
     def _saml_login(self):
         req = prepare_request_for_saml_toolkit(self.request)
         auth = authenticate_saml(req, custom_base_path=Settings['saml_config_folder'])
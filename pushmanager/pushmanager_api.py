@@ -7,16 +7,19 @@ import pushmanager.core.db as db
 import tornado.httpserver
 import tornado.process
 import pushmanager.ui_modules as ui_modules
+from pushmanager.core import metrics
 from pushmanager.core.application import Application
 from pushmanager.core.settings import Settings
 from pushmanager.core.util import get_servlet_urlspec
 from pushmanager.servlets.api import APIServlet
+from pushmanager.servlets.metrics import MetricsServlet
 
 
 api_application = tornado.web.Application(
     # Servlet dispatch rules
     [
         get_servlet_urlspec(APIServlet),
+        get_servlet_urlspec(MetricsServlet),
     ],
     # Server settings
     static_path=os.path.join(os.path.dirname(__file__), "static"),
@@ -34,6 +37,8 @@ class PushManagerAPIApp(Application):
     def start_services(self):
         # HTTP server (for api)
         sockets = tornado.netutil.bind_sockets(self.port, address=Settings['api_app']['servername'])
+        metrics.init(self.name)
+        db.set_pool_role('web')
         tornado.process.fork_processes(Settings['tornado']['num_workers'])
         server = tornado.httpserver.HTTPServer(api_application)
         server.add_sockets(sockets)
@@ -6,6 +6,7 @@ import tornado.httpserver
 import tornado.web
 import pushmanager.ui_methods as ui_methods
 import pushmanager.ui_modules as ui_modules
+from pushmanager.core import metrics
 from pushmanager.core import pid
 from pushmanager.core.application import Application
 from pushmanager.core.git import GitQueue
@@ -34,6 +35,7 @@ from pushmanager.servlets.discardpush import DiscardPushServlet
 from pushmanager.servlets.discardrequest import DiscardRequestServlet
 from pushmanager.servlets.editpush import EditPushServlet
 from pushmanager.servlets.livepush import LivePushServlet
+from pushmanager.servlets.metrics import MetricsServlet
 from pushmanager.servlets.msg import MsgServlet
 from pushmanager.servlets.newpush import NewPushServlet
 from pushmanager.servlets.newrequest import NewRequestServlet
@@ -96,7 +98,8 @@ def get_url_specs():
                     UserListServlet,
                     SummaryForBranchServlet,
                     MsgServlet,
-                    TestTagServlet):
+                    TestTagServlet,
+                    MetricsServlet):
         url_specs.append(get_servlet_urlspec(servlet))
     return url_specs
 
@@ -129,7 +132,11 @@ class PushManagerApp(Application):
         sockets = tornado.netutil.bind_sockets(self.port, address=Settings['main_app']['servername'])
         redir_sockets = tornado.netutil.bind_sockets(self.redir_port, address=Settings['main_app']['servername'])
 
+        # Queue workers and tornado workers all report their metrics
+        metrics.init(self.name)
+
         # Start the mail, git, reviewboard and XMPP queue handlers
+        db.set_pool_role('worker')
         worker_pids = []
         worker_pids.extend(MailQueue.start_worker())
         worker_pids.extend(RBQueue.start_worker())
@@ -139,6 +146,7 @@ class PushManagerApp(Application):
             pid.write(self.pid_file, append=True, pid=worker_pid)
         self.queue_worker_pids.extend(worker_pids)
 
+        db.set_pool_role('web')
         tornado.process.fork_processes(Settings['tornado']['num_workers'])
 
         server = tornado.httpserver.HTTPServer(self.main_app, ssl_options={
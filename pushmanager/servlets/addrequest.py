@@ -1,6 +1,8 @@
 import pushmanager.core.db as db
 import pushmanager.core.util
 from pushmanager.core.db import InsertIgnore
+from pushmanager.core.git import GitQueue
+from pushmanager.core.git import GitTaskAction
 from pushmanager.core.mail import MailQueue
 from pushmanager.core.requesthandler import RequestHandler
 from pushmanager.core.xmppclient import XMPPQueue
@@ -24,6 +26,7 @@ class AddRequestServlet(RequestHandler):
             db.push_requests.c.id.in_(self.request_ids))
 
         db.execute_transaction_cb(insert_queries + [update_query, request_query], self.on_db_complete)
+        db.refresh_dashboards(db.users_of_requests(self.request_ids))
 
     # allow both GET and POST
     get = post
@@ -68,3 +71,5 @@ class AddRequestServlet(RequestHandler):
                 self.pushid,
             )
             XMPPQueue.enqueue_user_xmpp(users, msg)
+
+        GitQueue.enqueue_request(GitTaskAction.BUILD_DEPLOY_BRANCH, self.pushid)
@@ -3,7 +3,9 @@ import json
 import sqlalchemy as SA
 
 from pushmanager.core import db
+from pushmanager.core import planner
 from pushmanager.core import util
+from pushmanager.core.git import decompress_conflict_output
 from pushmanager.core.requesthandler import RequestHandler
 
 
@@ -27,34 +29,111 @@ class APIServlet(RequestHandler):
         self.write(json.dumps(data))
         return self.finish()
 
+    def _request_fields(self, required=('id',)):
+        """Returns the request fields asked for with fields= (see
+        util.request_fields), or sends a 400 and returns None."""
+        try:
+            return util.request_fields(util.get_str_arg(self.request, 'fields'), required)
+        except ValueError:
+            self.send_error(400)
+            return None
+
+    @staticmethod
+    def _select_requests(fields, whereclause, **kwargs):
+        """Selects only the given fields of requests, in order, to be turned
+        into JSON by util.requests_to_jsonable."""
+        return SA.select([db.push_requests.c[field] for field in fields], whereclause, **kwargs)
+
+    def _with_archive(self, query):
+        """Returns query reading archived rows too (see db.with_archive) if
+        asked for with archive=1."""
+        if util.get_int_arg(self.request, 'archive'):
+            return db.with_archive(query)
+        return query
+
     def _api_USERLIST(self):
         """Returns a JSON list of users who used PushManager for a request at least once."""
-        query = db.push_requests.select(
+        query = SA.select(
+            [db.push_requests.c.user],
             group_by=db.push_requests.c.user,
         )
-        db.execute_cb(query, self._on_USERLIST_db_response)
+        db.execute_cb(self._with_archive(query), self._on_USERLIST_db_response)
 
     def _on_USERLIST_db_response(self, success, db_results):
         self.check_db_results(success, db_results)
         return self._xjson([r['user'] for r in db_results])
 
+    def _api_USERDASHBOARD(self):
+        """Returns the number of open requests of a user in each state, and
+        the oldest accepting push one of them is in."""
+        self.dashboard_user = util.get_str_arg(self.request, 'user')
+        if not self.dashboard_user:
+            return self.send_error(404)
+
+        query = db.push_userdashboard.select(db.push_userdashboard.c.user == self.dashboard_user)
+        db.execute_cb(query, self._on_USERDASHBOARD_db_response)
+
+    def _on_USERDASHBOARD_db_response(self, success, db_results):
+        self.check_db_results(success, db_results)
+
+        dashboard = db_results.first()
+        if dashboard:
+            return self._xjson(dict(dashboard.items()))
+        # Users without open requests have no dashboard row
+        dashboard = dict((state, 0) for state in db.OPEN_REQUEST_STATES)
+        dashboard.update({'user': self.dashboard_user, 'accepting_push': None, 'modified': None})
+        return self._xjson(dashboard)
+
     def _api_REQUEST(self):
         """Returns a JSON representation of a push request."""
         request_id = util.get_int_arg(self.request, 'id')
         if not request_id:
             return self.send_error(404)
+        self.fields = self._request_fields()
+        if not self.fields:
+            return
 
-        query = db.push_requests.select(db.push_requests.c.id == request_id)
-        db.execute_cb(query, self._on_REQUEST_db_response)
+        query = self._select_requests(self.fields, db.push_requests.c.id == request_id)
+        db.execute_cb(self._with_archive(query), self._on_REQUEST_db_response)
 
     def _on_REQUEST_db_response(self, success, db_results):
         self.check_db_results(success, db_results)
 
-        request = db_results.first()
-        if not request:
+        requests = util.requests_to_jsonable(db_results, self.fields)
+        if not requests:
             return self.send_error(404)
         else:
-            return self._xjson(util.request_to_jsonable(request))
+            return self._xjson(requests[0])
+
+    MAX_COMMENTS = 1000
+
+    def _api_REQUESTCOMMENTS(self):
+        """Returns the comments on a push request, oldest first.
+
+        Returns the latest limit (default 50) comments; pass the id of the
+        oldest comment returned as before to get the ones preceding it.
+        """
+        request_id = util.get_int_arg(self.request, 'id')
+        if not request_id:
+            return self.send_error(404)
+        limit = max(min(util.get_int_arg(self.request, 'limit', 50), self.MAX_COMMENTS), 1)
+        before = util.get_int_arg(self.request, 'before')
+
+        filters = [db.push_requestcomments.c.request == request_id]
+        if before:
+            filters.append(db.push_requestcomments.c.id < before)
+        query = db.push_requestcomments.select(
+            SA.and_(*filters),
+            order_by=db.push_requestcomments.c.id.desc(),
+            limit=limit,
+        )
+        db.execute_cb(query, self._on_REQUESTCOMMENTS_db_response)
+
+    def _on_REQUESTCOMMENTS_db_response(self, success, db_results):
+        self.check_db_results(success, db_results)
+        comments = [util.comment_to_jsonable(comment) for comment in db_results]
+        comments.reverse()
+        return self._xjson(comments)
 
     def _api_PUSH(self):
         """Returns a JSON representation of a push."""
@@ -80,19 +159,27 @@ class APIServlet(RequestHandler):
         push_id = util.get_int_arg(self.request, 'id')
         if not push_id:
             return self.send_error(404)
+        self.fields = self._request_fields(required=('id', 'state'))
+        if not self.fields:
+            return
 
         push_info_query = db.push_pushes.select(db.push_pushes.c.id == push_id)
-        contents_query = db.push_requests.select(
+        contents_query = self._select_requests(
+            self.fields,
             SA.and_(
                 db.push_requests.c.id == db.push_pushcontents.c.request,
                 db.push_pushcontents.c.push == push_id,
             ),
             order_by=(db.push_requests.c.user, db.push_requests.c.title),
         )
-        available_query = db.push_requests.select(
+        available_query = self._select_requests(
+            self.fields,
             db.push_requests.c.state == 'requested',
         )
-        db.execute_transaction_cb([push_info_query, contents_query, available_query], self._on_PUSHDATA_db_response)
+        db.execute_transaction_cb(
+            [push_info_query, self._with_archive(contents_query), available_query],
+            self._on_PUSHDATA_db_response
+        )
 
     def _on_PUSHDATA_db_response(self, success, db_results):
         self.check_db_results(success, db_results)
@@ -103,15 +190,102 @@ class APIServlet(RequestHandler):
             return self.send_error(404)
         push_info = util.push_to_jsonable(push_info)
 
-        available_requests = [util.request_to_jsonable(r) for r in available_requests.fetchall()]
+        available_requests = util.requests_to_jsonable(available_requests, self.fields)
         push_requests = {}
-        for request in push_contents:
-            request = util.request_to_jsonable(request)
+        for request in util.requests_to_jsonable(push_contents, self.fields):
             push_requests.setdefault(request['state'], []).append(request)
             push_requests.setdefault('all', []).append(request)
 
         return self._xjson([push_info, push_requests, available_requests])
 
+    # Fields of the requests planner.plan_push looks at
+    PLAN_FIELDS = ('id', 'state', 'tags', 'created')
+
+    def _api_CONFLICTPLAN(self):
+        """Returns the largest set of pickmes of a push that merge together,
+        in suggested merge order, and the pickmes left out. Pickmes are
+        weighed by weight (count, age or urgent)."""
+        self.plan_push_id = util.get_int_arg(self.request, 'id')
+        if not self.plan_push_id:
+            return self.send_error(404)
+        self.plan_weight = util.get_str_arg(self.request, 'weight', 'count')
+        if self.plan_weight not in planner.WEIGHTS:
+            return self.send_error(400)
+
+        requests_query = self._select_requests(
+            self.PLAN_FIELDS,
+            SA.and_(
+                db.push_requests.c.id == db.push_pushcontents.c.request,
+                db.push_pushcontents.c.push == self.plan_push_id,
+                db.push_requests.c.state.in_(('pickme', 'added')),
+            )
+        )
+        pairs_query = db.push_conflictpairs.select(db.push_conflictpairs.c.push == self.plan_push_id)
+        db.execute_transaction_cb([requests_query, pairs_query], self._on_CONFLICTPLAN_db_response)
+
+    def _on_CONFLICTPLAN_db_response(self, success, db_results):
+        self.check_db_results(success, db_results)
+
+        requests, pairs = db_results
+        plan = planner.plan_push(
+            util.requests_to_jsonable(requests, self.PLAN_FIELDS),
+            [(pair['request'], pair['other']) for pair in pairs],
+            self.plan_weight,
+        )
+        plan['push'] = self.plan_push_id
+        return self._xjson(plan)
+
+    def _api_CONFLICTDETAILS(self):
+        """Returns the full output of the merges that failed when a request
+        was last checked for conflicts. other narrows it down to the merge
+        against one pickme (0 for master). Output longer than
+        GitQueue.CONFLICT_OUTPUT_LIMIT is truncated, size is its full length."""
+        request_id = util.get_int_arg(self.request, 'id')
+        if not request_id:
+            return self.send_error(404)
+
+        filters = [db.push_conflictdetails.c.request == request_id]
+        other = util.get_int_arg(self.request, 'other')
+        if other is not None:
+            filters.append(db.push_conflictdetails.c.other == other)
+        query = db.push_conflictdetails.select(
+            SA.and_(*filters),
+            order_by=db.push_conflictdetails.c.other,
+        )
+        db.execute_cb(query, self._on_CONFLICTDETAILS_db_response)
+
+    def _on_CONFLICTDETAILS_db_response(self, success, db_results):
+        self.check_db_results(success, db_results)
+        details = []
+        for row in db_results:
+            output = decompress_conflict_output(row['output'])
+            details.append({
+                'request': row['request'],
+                'revision': row['revision'],
+                'other': row['other'],
+                'output': output,
+                'size': row['size'],
+                'truncated': row['size'] > len(output.encode('utf-8')),
+            })
+        return self._xjson(details)
+
+    def _api_DEPLOYSTEPS(self):
+        """Returns the merges making up the deploy branch candidate of a push,
+        in order. A step with a null sha could not be merged."""
+        push_id = util.get_int_arg(self.request, 'id')
+        if not push_id:
+            return self.send_error(404)
+
+        query = db.push_deploysteps.select(
+            db.push_deploysteps.c.push == push_id,
+            order_by=db.push_deploysteps.c.position,
+        )
+        db.execute_cb(query, self._on_DEPLOYSTEPS_db_response)
+
+    def _on_DEPLOYSTEPS_db_response(self, success, db_results):
+        self.check_db_results(success, db_results)
+        return self._xjson([dict(step.items()) for step in db_results])
+
     def _api_PUSHES(self):
         """Returns a JSON representation of pushes."""
         rpp = util.get_int_arg(self.request, 'rpp', 50)
@@ -158,18 +332,19 @@ class APIServlet(RequestHandler):
         push_id = util.get_int_arg(self.request, 'id')
         if not push_id:
             return self.send_error(404)
+        self.fields = self._request_fields()
+        if not self.fields:
+            return
 
-        query = db.push_requests.select(SA.and_(
+        query = self._select_requests(self.fields, SA.and_(
             db.push_requests.c.id == db.push_pushcontents.c.request,
             db.push_pushcontents.c.push == push_id,
         ))
-        db.execute_cb(query, self._on_PUSHCONTENTS_db_response)
+        db.execute_cb(self._with_archive(query), self._on_PUSHCONTENTS_db_response)
 
     def _on_PUSHCONTENTS_db_response(self, success, db_results):
         self.check_db_results(success, db_results)
-
-        requests = [util.request_to_jsonable(request) for request in db_results]
-        return self._xjson(requests)
+        return self._xjson(util.requests_to_jsonable(db_results, self.fields))
 
     def _api_PUSHBYREQUEST(self):
         """Returns a JSON representation of a PUSH given a request id."""
@@ -182,7 +357,7 @@ class APIServlet(RequestHandler):
             db.push_pushcontents.c.push == db.push_pushes.c.id,
             db.push_pushcontents.c.request == request_id,
         ))
-        db.execute_cb(query, self._on_PUSHBYREQUEST_db_response)
+        db.execute_cb(self._with_archive(query), self._on_PUSHBYREQUEST_db_response)
 
     def _on_PUSHBYREQUEST_db_response(self, success, db_results):
         self.check_db_results(success, db_results)
@@ -195,8 +370,12 @@ class APIServlet(RequestHandler):
         push_id = util.get_int_arg(self.request, 'push_id')
         if not push_id:
             return self.send_error(404)
+        self.fields = self._request_fields()
+        if not self.fields:
+            return
 
-        query = db.push_requests.select(
+        query = self._select_requests(
+            self.fields,
             SA.and_(
                 db.push_requests.c.id == db.push_pushcontents.c.request,
                 db.push_requests.c.state != 'pickme',
@@ -204,19 +383,91 @@ class APIServlet(RequestHandler):
             ),
             order_by=(db.push_requests.c.user, db.push_requests.c.title),
         )
-        db.execute_cb(query, self._on_PUSHITEMS_db_response)
+        db.execute_cb(self._with_archive(query), self._on_PUSHITEMS_db_response)
 
     def _on_PUSHITEMS_db_response(self, success, db_results):
         self.check_db_results(success, db_results)
-        return self._xjson([util.request_to_jsonable(request) for request in db_results])
+        return self._xjson(util.requests_to_jsonable(db_results, self.fields))
+
+    def _api_PUSHITEMCOMMENTS(self):
+        """Returns the latest comments on the requests listed by pushitems,
+        as a JSON object of their comments, oldest first, by request id.
+
+        Returns up to limit (default 5) comments per request, and no more
+        than MAX_COMMENTS in all.
+        """
+        push_id = util.get_int_arg(self.request, 'push_id')
+        if not push_id:
+            return self.send_error(404)
+        self.comments_limit = max(min(util.get_int_arg(self.request, 'limit', 5), self.MAX_COMMENTS), 1)
+
+        query = SA.select(
+            [db.push_requestcomments],
+            SA.and_(
+                db.push_requestcomments.c.request == db.push_requests.c.id,
+                db.push_requests.c.id == db.push_pushcontents.c.request,
+                db.push_requests.c.state != 'pickme',
+                db.push_pushcontents.c.push == push_id,
+            ),
+            order_by=db.push_requestcomments.c.id.desc(),
+            limit=self.MAX_COMMENTS,
+        )
+        db.execute_cb(self._with_archive(query), self._on_PUSHITEMCOMMENTS_db_response)
+
+    def _on_PUSHITEMCOMMENTS_db_response(self, success, db_results):
+        self.check_db_results(success, db_results)
+
+        comments = {}
+        for comment in db_results:
+            request_comments = comments.setdefault(comment['request'], [])
+            if len(request_comments) < self.comments_limit:
+                request_comments.append(util.comment_to_jsonable(comment))
+        for request_comments in comments.itervalues():
+            request_comments.reverse()
+        return self._xjson(comments)
+
+    def _api_SEARCH(self):
+        """Returns a list of requests whose title, description or comments
+        match the given full-text query, best matches first."""
+        terms = util.get_str_arg(self.request, 'q', '').strip()
+        if not terms:
+            return self.send_error(400)
+
+        self.fields = self._request_fields()
+        if not self.fields:
+            return
+
+        limit = max(min(1000, util.get_int_arg(self.request, 'limit', 50)), 1)
+        db.execute_cb(db.search_requests_query(terms, limit), self._on_SEARCH_db_response)
+
+    def _on_SEARCH_db_response(self, success, db_results):
+        if not success:
+            return self.send_error(500)
+
+        # Matches are whole rows, in the order of the table
+        return self._xjson([util.request_to_jsonable(request, self.fields) for request in db_results])
+
+    # Columns requests can be sorted by, prefixed with '-' for descending order
+    REQUEST_SORT_KEYS = ('id', 'created', 'modified', 'user', 'repo')
 
     def _api_REQUESTSEARCH(self):
-        """Returns a list of requests matching a the specified filter(s)."""
+        """Returns a list of requests matching a the specified filter(s).
+
+        With count=1, returns a list of the matching requests and the total
+        number of requests matching the filter(s) instead. Like the other
+        request lists, fields=summary leaves out comments, description and
+        conflicts (see util.request_fields). Archived requests are only
+        searched with archive=1.
+        """
+        self.fields = self._request_fields()
+        if not self.fields:
+            return
+
         filters = []
 
-        # Tag constraint
+        # Tag constraint, tags are stored comma separated
         for tag in self.request.arguments.get('tag', []):
-            filters.append(db.push_requests.c.tags.op('regexp')('[[:<:]]' + tag + '[[:>:]]'))
+            filters.append((',' + db.push_requests.c.tags + ',').like('%,' + tag + ',%'))
 
         # Timestamp constraint
         mbefore = util.get_int_arg(self.request, 'mbefore')
@@ -267,24 +518,59 @@ class APIServlet(RequestHandler):
         for title in self.request.arguments.get('title', []):
             filters.append(db.push_requests.c.title.like('%' + title + '%'))
 
+        # Conflict status constraint
+        conflicts = util.get_str_arg(self.request, 'conflicts')
+        if conflicts == 'yes':
+            filters.append(db.push_requests.c.conflicts != '')
+        elif conflicts == 'no':
+            filters.append(SA.or_(db.push_requests.c.conflicts.is_(None), db.push_requests.c.conflicts == ''))
+
         # Only allow searches with at least one constraint (to avoid
         # accidental dumps of the entire table)
         if not filters:
             return self.send_error(409)
 
-        query = db.push_requests.select(SA.and_(*filters))
-        query = query.order_by(db.push_requests.c.id.desc())
+        sort = util.get_str_arg(self.request, 'sort', '-id')
+        if sort.lstrip('-') not in self.REQUEST_SORT_KEYS:
+            return self.send_error(400)
+        sort_column = db.push_requests.c[sort.lstrip('-')]
+        query = self._select_requests(self.fields, SA.and_(*filters))
+        if sort.startswith('-'):
+            query = query.order_by(sort_column.desc(), db.push_requests.c.id.desc())
+        else:
+            query = query.order_by(sort_column.asc(), db.push_requests.c.id.asc())
 
         limit = util.get_int_arg(self.request, 'limit')
         if limit > 0:
             limit = max(min(1000, limit), 1)
             query = query.limit(limit)
 
-        db.execute_cb(query, self._on_REQUESTSEARCH_db_response)
+        offset = util.get_int_arg(self.request, 'offset')
+        if offset > 0:
+            query = query.offset(offset)
+
+        if util.get_int_arg(self.request, 'count'):
+            if util.get_int_arg(self.request, 'archive'):
+                count_query = db.count_with_archive(SA.select([db.push_requests.c.id], SA.and_(*filters)))
+            else:
+                count_query = SA.select([SA.func.count(db.push_requests.c.id)], SA.and_(*filters))
+            db.execute_transaction_cb(
+                [self._with_archive(query), count_query],
+                self._on_REQUESTSEARCH_COUNT_db_response
+            )
+        else:
+            db.execute_cb(self._with_archive(query), self._on_REQUESTSEARCH_db_response)
 
     def _on_REQUESTSEARCH_db_response(self, success, db_results):
         if not success:
             return self.send_error(500)
 
-        requests = [util.request_to_jsonable(request) for request in db_results]
-        return self._xjson(requests)
+        return self._xjson(util.requests_to_jsonable(db_results, self.fields))
+
+    def _on_REQUESTSEARCH_COUNT_db_response(self, success, db_results):
+        if not success:
+            return self.send_error(500)
+
+        request_results, requests_count = db_results
+        requests = util.requests_to_jsonable(request_results, self.fields)
+        return self._xjson([requests, requests_count.scalar()])
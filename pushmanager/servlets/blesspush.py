@@ -36,6 +36,7 @@ class BlessPushServlet(RequestHandler):
                 db.push_pushes.c.id == self.pushid,
         )
         db.execute_transaction_cb([request_query, blessed_query, push_query], self.on_db_complete)
+        db.refresh_dashboards(db.users_of_push(self.pushid))
 
     def on_db_complete(self, success, db_results):
         self.check_db_results(success, db_results)
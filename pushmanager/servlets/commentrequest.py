@@ -1,4 +1,4 @@
-import sqlalchemy as SA
+import time
 
 import pushmanager.core.db as db
 import pushmanager.core.util
@@ -20,19 +20,19 @@ class CommentRequestServlet(RequestHandler):
         if not comment:
             return self.send_error(500)
 
-        update_query = db.push_requests.update().where(
-            db.push_requests.c.id == requestid,
-        ).values({
-            'comments': SA.func.concat(
-                db.push_requests.c.comments,
-                '\n\n---\n\nComment from %s:\n\n' % self.current_user,
-                comment,
-            ),
+        insert_query = db.push_requestcomments.insert({
+            'request': requestid,
+            'user': self.current_user,
+            'comment': comment,
+            'created': int(time.time()),
         })
         select_query = db.push_requests.select().where(
             db.push_requests.c.id == requestid,
         )
-        db.execute_transaction_cb([update_query, select_query], self.on_db_complete)
+        db.execute_transaction_cb(
+            [insert_query] + db.search_index_queries(requestid) + [select_query],
+            self.on_db_complete
+        )
 
     get = post
 
@@ -40,7 +40,7 @@ class CommentRequestServlet(RequestHandler):
         self.check_db_results(success, db_results)
 
         if db_results:
-            req = db_results[1].first()
+            req = db_results[-1].first()
             msg = (
                 """
                 <p>
@@ -73,5 +73,4 @@ class CommentRequestServlet(RequestHandler):
                     'comment': self.comment,
                 }
             XMPPQueue.enqueue_user_xmpp([req['user']], msg)
-            newcomments = req[db.push_requests.c.comments]
-            self.write(xhtml_escape(newcomments))
+            self.write(xhtml_escape(pushmanager.core.util.format_request_comment(self.current_user, self.comment)))
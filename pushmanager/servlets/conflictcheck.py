@@ -14,4 +14,5 @@ class ConflictCheckServlet(RequestHandler):
             return self.send_error(403)
         self.pushid = pushmanager.core.util.get_int_arg(self.request, 'id')
         GitQueue.enqueue_request(GitTaskAction.TEST_ALL_PICKMES, self.pushid, pushmanager_url=self.get_base_url())
+        GitQueue.enqueue_request(GitTaskAction.BUILD_DEPLOY_BRANCH, self.pushid)
         self.redirect("/push?id=%d" % self.pushid)
@@ -28,6 +28,7 @@ class DelayRequestServlet(RequestHandler):
             db.push_requests.c.id == self.requestid,
         )
         db.execute_transaction_cb([update_query, delete_query, select_query], self.on_db_complete)
+        db.refresh_dashboards(db.users_of_requests([self.requestid]))
 
     get = post
 
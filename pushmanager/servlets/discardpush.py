@@ -50,10 +50,13 @@ class DiscardPushServlet(RequestHandler):
             )).values({
                 'state': 'requested',
             })
+        # Requests leave the push, their owners have to be known beforehand
+        dashboard_users = db.select_users(db.users_of_push(self.pushid))
         db.execute_transaction_cb(
             [push_query, request_query_pickme, delete_query, request_query_all],
             self.on_db_complete
         )
+        db.refresh_dashboards(dashboard_users)
 
     def on_db_complete(self, success, db_results):
         self.check_db_results(success, db_results)
@@ -23,6 +23,7 @@ class DiscardRequestServlet(RequestHandler):
             db.push_requests.c.id == self.requestid,
         )
         db.execute_transaction_cb([update_query, select_query], self.on_db_complete)
+        db.refresh_dashboards([self.current_user])
     # allow both GET and POST
     get = post
 
@@ -56,10 +56,13 @@ class LivePushServlet(RequestHandler):
                     db.push_pushcontents.c.push == self.pushid,
                     db.push_pushcontents.c.request == db.push_requests.c.id)
             )
+        # Reset pickmes leave the push, their owners have to be known beforehand
+        dashboard_users = db.select_users(db.users_of_push(self.pushid))
         db.execute_transaction_cb(
             [push_query, request_query, reset_query, delete_query, live_query],
             self.on_db_complete,
         )
+        db.refresh_dashboards(dashboard_users)
 
     def on_db_complete(self, success, db_results):
         self.check_db_results(success, db_results)
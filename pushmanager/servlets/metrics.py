@@ -0,0 +1,11 @@
+from pushmanager.core import metrics
+from pushmanager.core.requesthandler import RequestHandler
+
+
+class MetricsServlet(RequestHandler):
+    """Metrics of every process of the application, in the Prometheus text
+    exposition format."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render(metrics.queue_depths()))
@@ -61,11 +61,13 @@ class NewRequestServlet(RequestHandler):
             else:
                 self.request_user = self._arg('request-user')
 
-            query = db.push_requests.update().where(
+            queries = [
+                db.push_requests.update().where(
                     db.push_requests.c.id == self.requestid
                 ).values(updated_values)
+            ] + db.search_index_queries(self.requestid)
         else:
-            query = db.push_requests.insert({
+            queries = [db.push_requests.insert({
                 'title': self._arg('request-title'),
                 'user': self.current_user,
                 'tags': ','.join(self.tag_list),
@@ -79,16 +81,20 @@ class NewRequestServlet(RequestHandler):
                 'modified': time.time(),
                 'state': 'requested',
                 'revision': '0'*40,
-                })
+                })] + db.search_index_queries(inserted=True)
             self.request_user = self.current_user
 
-        db.execute_cb(query, self.on_request_upsert_complete)
+        db.execute_transaction_cb(queries, self.on_request_upsert_complete)
 
     def on_request_upsert_complete(self, success, db_results):
         self.check_db_results(success, db_results)
 
         if not self.requestid:
-            self.requestid = db_results.lastrowid
+            self.requestid = db_results[0].lastrowid
+
+        # Takeovers move the request from one dashboard to another
+        dashboard_users = set([self.request_user, self._arg('request-user') or self.request_user])
+        db.refresh_dashboards(list(dashboard_users))
 
         query = db.push_checklist.select().where(db.push_checklist.c.request == self.requestid)
         db.execute_cb(query, self.on_existing_checklist_retrieved)
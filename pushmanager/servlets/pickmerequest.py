@@ -59,6 +59,7 @@ class PickMeRequestServlet(RequestHandler):
             self.on_db_complete,
             condition=(condition_query, condition_fn)
         )
+        db.refresh_dashboards(db.users_of_requests(self.request_ids))
 
     # allow both GET and POST
     get = post
@@ -94,6 +95,7 @@ class UnpickMeRequestServlet(RequestHandler):
             )).values({'state': 'requested'})
 
         db.execute_transaction_cb([delete_query, update_query], self.on_db_complete)
+        db.refresh_dashboards(db.users_of_requests([self.request_id]))
 
     # allow both GET and POST
     get = post
@@ -3,8 +3,10 @@ import os
 import pushmanager.core.util
 import tornado.gen
 import tornado.web
+from pushmanager.core import planner
 from pushmanager.core.requesthandler import RequestHandler
 from pushmanager.core.settings import Settings
+from pushmanager.core.util import tags_contain
 
 
 def _repo(base):
@@ -21,14 +23,30 @@ class PushServlet(RequestHandler):
     def get(self):
         pushid = pushmanager.core.util.get_int_arg(self.request, 'id')
         override = pushmanager.core.util.get_int_arg(self.request, 'override')
+        # Requests of old pushes may have been archived
+        archive = pushmanager.core.util.get_int_arg(self.request, 'archive', 0)
         response = yield tornado.gen.Task(
                         self.async_api_call,
                         "pushdata",
-                        {"id": pushid}
+                        {"id": pushid, "fields": "summary", "archive": archive}
                     )
 
         push_info, push_requests, available_requests = self.get_api_results(response)
 
+        # Pickmes that conflict with each other get a plan of which to accept
+        conflict_plan = None
+        if any(tags_contain(request['tags'] or '', ['conflict-pickme'])
+               for request in push_requests.get('pickme', [])):
+            weight = pushmanager.core.util.get_str_arg(self.request, 'weight', 'count')
+            if weight not in planner.WEIGHTS:
+                weight = 'count'
+            response = yield tornado.gen.Task(
+                            self.async_api_call,
+                            "conflictplan",
+                            {"id": pushid, "weight": weight}
+                        )
+            conflict_plan = self.get_api_results(response)
+
         if not push_info['stageenv']:
             push_info['stageenv'] = '(to be determined)'
 
@@ -42,6 +60,8 @@ class PushServlet(RequestHandler):
             push_contents=push_requests,
             push_survey_url=push_survey_url,
             available_requests=available_requests,
+            conflict_plan=conflict_plan,
             fullrepo=_repo,
-            override=override
+            override=override,
+            archive=archive
         )
@@ -14,8 +14,20 @@ class PushItemsServlet(RequestHandler):
         response = yield tornado.gen.Task(
                         self.async_api_call,
                         "pushitems",
-                        {"push_id": pushid}
+                        {
+                            "push_id": pushid,
+                            "fields": "user,title,tags,reviewid,repo,branch,created,modified,comments",
+                        }
                     )
 
         results = self.get_api_results(response)
-        self.render("pushitems.html", requests=results)
+
+        # Comments other than the author's are kept apart from the requests
+        response = yield tornado.gen.Task(
+                        self.async_api_call,
+                        "pushitemcomments",
+                        {"push_id": pushid}
+                    )
+        comments = self.get_api_results(response)
+
+        self.render("pushitems.html", requests=results, comments=comments)
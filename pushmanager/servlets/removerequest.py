@@ -5,6 +5,8 @@ import sqlalchemy as SA
 import pushmanager.core.db as db
 import pushmanager.core.util
 import tornado.web
+from pushmanager.core.git import GitQueue
+from pushmanager.core.git import GitTaskAction
 from pushmanager.core.mail import MailQueue
 from pushmanager.core.requesthandler import RequestHandler
 from pushmanager.core.xmppclient import XMPPQueue
@@ -33,6 +35,7 @@ class RemoveRequestServlet(RequestHandler):
             db.push_pushcontents.c.request.in_(self.requestid),
         ))
         db.execute_transaction_cb([select_query, update_query, delete_query], self.on_db_complete)
+        db.refresh_dashboards(db.users_of_requests(self.requestid))
 
     # allow both GET and POST
     get = post
@@ -86,6 +89,8 @@ class RemoveRequestServlet(RequestHandler):
                 'timestamp': int(time.time()),
             })
 
+        GitQueue.enqueue_request(GitTaskAction.BUILD_DEPLOY_BRANCH, self.pushid)
+
         removal_queries = [db.push_removals.insert(removal) for removal in removal_dicts]
         db.execute_transaction_cb(removal_queries, self.on_db_insert_complete)
 
@@ -13,15 +13,17 @@ class RequestServlet(RequestHandler):
         request_id = pushmanager.core.util.get_int_arg(self.request, 'id')
         if not request_id:
             self.send_error(404)
+        # Links to archived requests ask for them with archive=1
+        archive = pushmanager.core.util.get_int_arg(self.request, 'archive', 0)
 
         response = yield tornado.gen.Task(
                         self.async_api_call,
                         "request",
-                        {'id': request_id}
+                        {'id': request_id, 'archive': archive}
                     )
 
         req = self.get_api_results(response)
         if not req:
             self.send_error()
 
-        self.render("request.html", page_title="Request #%d" % request_id, req=req)
+        self.render("request.html", page_title="Request #%d" % request_id, req=req, archive=archive)
@@ -1,3 +1,5 @@
+import time
+
 import pushmanager.core.util
 import tornado.gen
 import tornado.web
@@ -6,20 +8,37 @@ from pushmanager.core.requesthandler import RequestHandler
 
 class RequestsServlet(RequestHandler):
 
+    # Arguments passed on to the requestsearch API as they are
+    FILTERS = ('repo', 'tag', 'conflicts', 'sort')
+
     @tornado.web.asynchronous
     @tornado.web.authenticated
     @tornado.gen.engine
     def get(self):
         username = pushmanager.core.util.get_str_arg(self.request, 'user')
-        limit_count = pushmanager.core.util.get_int_arg(self.request, 'max')
-        arguments = {'limit': limit_count}
+        limit_count = pushmanager.core.util.get_int_arg(self.request, 'max', 50)
+        offset = pushmanager.core.util.get_int_arg(self.request, 'offset', 0)
+        # Only return more request entries, for "load more"
+        fragment = pushmanager.core.util.get_int_arg(self.request, 'fragment')
+        # Maximum age of requests, in days
+        age = pushmanager.core.util.get_int_arg(self.request, 'age')
+
+        arguments = {'limit': limit_count, 'offset': offset, 'count': 1, 'fields': 'summary'}
+        filters = {}
+        for name in self.FILTERS:
+            value = pushmanager.core.util.get_str_arg(self.request, name)
+            if value:
+                filters[name] = value
+        arguments.update(filters)
+        if age:
+            filters['age'] = age
+            arguments['cafter'] = int(time.time()) - age * 24 * 60 * 60
 
         if username:
             arguments['user'] = username
             page_title = 'Requests from %s' % username
             show_count = False
         else:
-            arguments['limit'] = 0
             arguments['state'] = 'requested'
             page_title = 'Open Requests'
             show_count = True
@@ -30,5 +49,35 @@ class RequestsServlet(RequestHandler):
                         arguments
                     )
 
-        requests = self.get_api_results(response)
-        self.render("requests.html", requests=requests, page_title=page_title, show_count=show_count)
+        results = self.get_api_results(response)
+        if results is None:
+            return
+        requests, requests_count = results
+
+        if fragment:
+            self.finish(self.render_string("requests-items.html", requests=requests))
+            return
+
+        dashboard = None
+        if username:
+            response = yield tornado.gen.Task(
+                            self.async_api_call,
+                            "userdashboard",
+                            {'user': username}
+                        )
+            dashboard = self.get_api_results(response)
+            if dashboard is None:
+                return
+
+        self.render(
+            "requests.html",
+            requests=requests,
+            requests_count=requests_count,
+            page_title=page_title,
+            show_count=show_count,
+            user=username,
+            filters=filters,
+            limit=limit_count,
+            offset=offset,
+            dashboard=dashboard,
+        )
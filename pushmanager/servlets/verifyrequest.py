@@ -41,6 +41,7 @@ class VerifyRequestServlet(RequestHandler):
                 )
             )))
         db.execute_transaction_cb([select_query, update_query, finished_query], self.on_db_complete)
+        db.refresh_dashboards(db.users_of_requests([self.requestid]))
 
     def on_db_complete(self, success, db_results):
         self.check_db_results(success, db_results)
@@ -56,19 +56,21 @@ $(function() {
             if(tags !== '') tags += ' ';
             tags += elem.classList[0].replace(/tag-/, '');
         });
-        PushManager.NewRequestDialog.open_new_request(
-            that.attr('request_title'),
-            that.attr('branch'),
-            that.attr('repo'),
-            that.attr('reviewid'),
-            that.find('.request-comments').text().replace(/\n{3,}/g, '\n\n'),
-            that.find('.request-description').text(),
-            that.attr('watchers'),
-            tags,
-            that.attr('request'),
-            that.attr('user'),
-            that.attr('user') != PushManager.current_user
-        );
+        PushManager.Request.load_details(that, function() {
+            PushManager.NewRequestDialog.open_new_request(
+                that.attr('request_title'),
+                that.attr('branch'),
+                that.attr('repo'),
+                that.attr('reviewid'),
+                that.find('.request-comments').text().replace(/\n{3,}/g, '\n\n'),
+                that.find('.request-description').text(),
+                that.attr('watchers'),
+                tags,
+                that.attr('request'),
+                that.attr('user'),
+                that.attr('user') != PushManager.current_user
+            );
+        });
     });
 
     $('.tag-suggestion').click(function() {
@@ -33,9 +33,98 @@ $(function() {
     $('.request-description').each(function() { PushManager.Request.format_comments_dom(this); });
 
 
+    // Lists of requests leave out conflicts, descriptions and comments.
+    // They are loaded the first time a request is expanded or edited.
+    PushManager.Request.load_details = function(req, callback) {
+        var details = req.find('.request-details[loaded=no]');
+        if(details.length == 0) {
+            if(callback) callback();
+            return;
+        }
+        details.attr('loaded', 'loading');
+        var data = {'id': req.attr('request'), 'fields': 'conflicts,description,comments'};
+        if(req.attr('archive')) {
+            data.archive = 1;
+        }
+        $.ajax({
+            'type': 'GET',
+            'url': '/api/request',
+            'data': data,
+            'dataType': 'json',
+            'success': function(request) {
+                if(request.conflicts) {
+                    details.append('<p>Conflicts:</p>');
+                    details.append($('<div class="request-conflicts"></div>').html(request.conflicts.replace(/\n/g, '<br />')));
+                }
+                if(request.description) {
+                    var description = $('<div class="request-description"></div>').text(request.description);
+                    details.append('<p>Description:</p>').append(description);
+                    PushManager.Request.format_comments_dom(description);
+                }
+                if(request.comments) {
+                    var comments = $('<div class="request-comments"></div>').text(request.comments);
+                    req.find('.request-extended-fields').append('<p>Comments:</p>').append(comments);
+                    PushManager.Request.format_comments_dom(comments);
+                }
+                details.attr('loaded', 'yes');
+                if(callback) callback();
+            },
+            'error': function() { details.attr('loaded', 'no'); }
+        });
+    };
+
+    PushManager.Request.COMMENTS_PAGE = 50;
+
+    PushManager.Request.render_comment = function(comment) {
+        var div = $('<div class="request-comment"></div>').attr('comment', comment.id);
+        div.text('Comment from ' + comment.user + ':\n\n' + comment.comment);
+        PushManager.Request.format_comments_dom(div);
+        return div;
+    };
+
+    // Comments on a request are paginated, the latest page is loaded the
+    // first time a request is expanded and older ones on demand.
+    PushManager.Request.load_comments = function(req, before) {
+        var thread = req.find('.request-comment-thread');
+        if(!before && thread.attr('loaded') != 'no') {
+            return;
+        }
+        thread.attr('loaded', 'loading');
+        var data = {'id': req.attr('request'), 'limit': PushManager.Request.COMMENTS_PAGE};
+        if(before) {
+            data.before = before;
+        }
+        $.ajax({
+            'type': 'GET',
+            'url': '/api/requestcomments',
+            'data': data,
+            'dataType': 'json',
+            'success': function(comments) {
+                thread.find('.request-older-comments').remove();
+                var page = $('<div></div>');
+                $.each(comments, function(i, comment) {
+                    page.append(PushManager.Request.render_comment(comment));
+                });
+                thread.prepend(page.children());
+                if(comments.length == PushManager.Request.COMMENTS_PAGE) {
+                    var older = $('<button class="request-older-comments">Older comments</button>');
+                    older.click(function() {
+                        PushManager.Request.load_comments(req, comments[0].id);
+                        return false;
+                    });
+                    thread.prepend(older);
+                }
+                thread.attr('loaded', 'yes');
+            },
+            'error': function() { thread.attr('loaded', before ? 'yes' : 'no'); }
+        });
+    };
+
     PushManager.Request.expand_push_item = function() {
         var that = $(this);
         var req = that.closest('.request-module');
+        PushManager.Request.load_details(req);
+        PushManager.Request.load_comments(req);
         req.find('.request-info-extended').toggle();
         var button = req.find('.request-item-expander');
         if(button.attr('src') == "/static/img/button_hide.gif") {
@@ -57,6 +146,29 @@ $(function() {
     $('.request-item-expander, .request-item-title').live('click', PushManager.Request.expand_push_item);
     $('.request-item-expander[expand=yes]').each(PushManager.Request.expand_push_item);
 
+    // Conflict summaries link to the full output of the failed merge
+    PushManager.Request.show_conflict_output = function() {
+        var link = $(this);
+        var shown = link.next('pre.conflict-output');
+        if(shown.length) {
+            shown.toggle();
+            return false;
+        }
+        $.ajax({
+            'type': 'GET',
+            'url': link.attr('href'),
+            'dataType': 'json',
+            'success': function(details) {
+                var output = $.map(details, function(detail) {
+                    return detail.output + (detail.truncated ? '\n[truncated, ' + detail.size + ' bytes total]' : '');
+                }).join('\n');
+                link.after($('<pre class="conflict-output"></pre>').text(output));
+            }
+        });
+        return false;
+    };
+    $('a.conflict-output').live('click', PushManager.Request.show_conflict_output);
+
 
     PushManager.Request.delay_request = function() {
         var that = $(this).closest('.request-module');
@@ -150,9 +150,11 @@ $(function() {
             'data': {'id': id, 'comment': comment},
             'dataType': 'html',
             'success': function(data) {
-                var that = $('.request-module[request="' + id + '"] .request-comments');
-                that.html(data);
-                PushManager.Request.format_comments_dom(that);
+                // Threads not loaded yet will fetch the comment with the others
+                var thread = $('.request-module[request="' + id + '"] .request-comment-thread[loaded=yes]');
+                var comment = $('<div class="request-comment"></div>').html(data);
+                thread.append(comment);
+                PushManager.Request.format_comments_dom(comment);
                 $('#comment-on-request').dialog('close');
             },
             'error': function() {
@@ -194,6 +196,13 @@ $(function() {
         PushManager.merge_dialog(true);
     });
 
+    $('#select-conflict-plan').click(function() {
+        $('.request-multi-select').attr('checked', '');
+        $('#conflict-plan li[request]').each(function() {
+            $('#pickme-items .request-module[request=' + $(this).attr('request') + '] .request-multi-select').attr('checked', 'checked');
+        });
+    });
+
     $('#rebuild-deploy-branch').click(function() {
         PushManager.on_done_merging = function(){return;};
         $('.request-multi-select').attr('checked', '');
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Helpers shared by the benchmarks in tools/: large generated datasets,
+latency statistics and machine-readable result files.
+"""
+
+import json
+import math
+import platform
+import random
+import time
+
+from pushmanager.__about__ import __version__
+from pushmanager.core import db
+from pushmanager.testing.testdb import FakeDataMixin
+
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of values (nearest rank)."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def summarize_latencies(latencies, wall_time, errors=0):
+    """Summarizes a list of per-operation latencies (in seconds) measured
+    over wall_time seconds."""
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / wall_time if wall_time else None,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else None,
+    }
+
+
+def write_results(path, benchmark, parameters, results):
+    """Writes benchmark results as JSON, along with what is needed to compare
+    them with other runs."""
+    document = {
+        'benchmark': benchmark,
+        'version': __version__,
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+    with open(path, 'w') as results_file:
+        json.dump(document, results_file, indent=2, sort_keys=True)
+    return document
+
+
+class BenchDataMixin(FakeDataMixin):
+    """Builds large, realistic datasets in the same shape as FakeDataMixin.
+
+    Most pushes are live and carry a handful of live requests each. A few
+    pushes are still accepting and carry many pickmes. The remaining requests
+    are spread over the other states.
+    """
+
+    request_states = [('discarded', 6), ('delayed', 2), ('requested', 2)]
+    tags = ['buildbot', 'git-ok', 'no-conflicts', 'search', 'plans', 'pushplans', 'seagull', 'hoods']
+
+    def insert_bench_data(self, requests=100000, pushes=10000, open_pushes=20,
+                          pickmes_per_push=50, users=500, seed=0):
+        """Inserts the dataset and returns a dict of ids the benchmarks can
+        query: open_pushes, live_pushes and users."""
+        rand = random.Random(seed)
+        user_names = ['benchuser%d' % i for i in range(users)]
+        now = int(time.time())
+        day = 24 * 60 * 60
+
+        push_rows = []
+        for push_id in range(1, pushes + 1):
+            is_open = push_id > pushes - open_pushes
+            created = now - (pushes - push_id) * day / 10
+            push_rows.append(self.make_push_dict([
+                push_id, 'Push %d' % push_id, rand.choice(user_names), 'deploy-%d' % push_id,
+                '', '%040x' % rand.getrandbits(160), 'accepting' if is_open else 'live',
+                created, created + 3600, 'regular', '',
+            ]))
+
+        request_rows = []
+        contents_rows = []
+        live_pushes = pushes - open_pushes
+        per_live_push = max(0, (requests - open_pushes * pickmes_per_push) * 7 / 10) / max(live_pushes, 1)
+        weighted_states = [state for state, weight in self.request_states for _ in range(weight)]
+
+        def add_request(state, push_id=None):
+            request_id = len(request_rows) + 1
+            user = rand.choice(user_names)
+            created = now - rand.randint(0, 1000 * day)
+            request_rows.append(self.make_request_dict([
+                request_id, user, state, user, 'branch_%d' % request_id,
+                ','.join(rand.sample(self.tags, rand.randint(0, 3))), '',
+                created, created + rand.randint(0, 10 * day),
+                'Request %d touching %s' % (request_id, rand.choice(self.tags)),
+                'Some comments', rand.randint(1, 500000), 'Description of request %d' % request_id,
+                '%040x' % rand.getrandbits(160), rand.choice(['', rand.choice(user_names)]),
+            ]))
+            if push_id is not None:
+                contents_rows.append({'request': request_id, 'push': push_id})
+
+        for push_id in range(1, pushes + 1):
+            if push_id > live_pushes:
+                for _ in range(pickmes_per_push):
+                    if len(request_rows) < requests:
+                        add_request('pickme', push_id)
+            else:
+                for _ in range(per_live_push):
+                    if len(request_rows) < requests:
+                        add_request('live', push_id)
+        while len(request_rows) < requests:
+            add_request(rand.choice(weighted_states))
+
+        # One executemany per table, execute_cb would run a statement per row
+        conn = db.engine.connect()
+        with conn.begin():
+            for table, rows in (
+                (db.push_pushes, push_rows),
+                (db.push_requests, request_rows),
+                (db.push_pushcontents, contents_rows),
+            ):
+                if rows:
+                    conn.execute(table.insert(), rows)
+        conn.close()
+
+        return {
+            'open_pushes': range(live_pushes + 1, pushes + 1),
+            'live_pushes': range(1, live_pushes + 1),
+            'users': user_names,
+        }
@@ -71,6 +71,7 @@ CREATE TABLE push_requests (
 	reviewid INTEGER,
 	description VARCHAR,
 	watchers VARCHAR,
+	changed INTEGER,
 	PRIMARY KEY (id)
 );
 INSERT INTO "push_requests" VALUES(1,
@@ -89,6 +90,7 @@ INSERT INTO "push_requests" VALUES(1,
        'Ship it! from someone.
 
 This branch fixes stuff.',
+       NULL,
        NULL
 );
 INSERT INTO "push_requests" VALUES(2,
@@ -105,6 +107,7 @@ INSERT INTO "push_requests" VALUES(2,
        '',
        123,
        'no comment',
+       NULL,
        NULL
 );
 INSERT INTO "push_requests" VALUES(3,
@@ -121,6 +124,7 @@ INSERT INTO "push_requests" VALUES(3,
        '',
        456,
        '',
+       NULL,
        NULL
 );
 CREATE TABLE push_checklist (
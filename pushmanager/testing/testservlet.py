@@ -74,6 +74,7 @@ class TemplateTestCase(T.TestCase):
         if self.authenticated:
             application.settings['cookie_secret'] = 'cookie_secret'
         request = turtle.Turtle()
+        request.request_time = lambda: 0.0
         self.servlet = RequestHandler(application, request)
 
     def render_etree(self, page, *args, **kwargs):
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import os
+import tempfile
+
+import testify as T
+from mock import patch
+from pushmanager.core.git import GitCommand
+from pushmanager.core.settings import Settings
+from pushmanager.testing.mocksettings import MockedSettings
+from tools import benchmark_git_conflicts
+
+
+class BenchmarkGitConflictsTest(T.TestCase):
+
+    def test_process_counter(self):
+        with benchmark_git_conflicts.GitProcessCounter() as counter:
+            GitCommand('--version').run()
+            GitCommand('--version').run()
+        GitCommand('--version').run()
+        T.assert_equal(counter.count, 2)
+
+    def test_run_benchmark(self):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            with patch.dict(Settings, copy.deepcopy(MockedSettings)), patch.dict(os.environ):
+                benchmark_git_conflicts.run_benchmark(
+                    push_sizes=[2, 3],
+                    passes=2,
+                    dev_repos=2,
+                    overlap=1,
+                    hot_lines=1,
+                    submodules=1,
+                    submodule_bumps=0.5,
+                    output=output,
+                )
+            with open(output) as results_file:
+                results = json.load(results_file)
+        finally:
+            os.unlink(output)
+
+        T.assert_equal(results['benchmark'], 'git_conflicts')
+        T.assert_equal(sorted(results['results']), ['2', '3'])
+        for size, passes in results['results'].iteritems():
+            T.assert_equal(len(passes), 2)
+            for result in passes:
+                # Every branch edits the same line, so they all conflict
+                T.assert_equal(result['conflicts'], int(size))
+                T.assert_gt(result['git_processes'], 0)
+                T.assert_gt(result['wall_time'], 0)
+                T.assert_in('pruned_pairs', result)
+                T.assert_in('merged_pairs', result)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+
+import testify as T
+from mock import patch
+from pushmanager.core.settings import Settings
+from pushmanager.testing.benchmark import percentile
+from pushmanager.testing.benchmark import summarize_latencies
+from pushmanager.testing.mocksettings import MockedSettings
+from tools import benchmark_servlets
+
+
+class BenchmarkServletsTest(T.TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        T.assert_equal(percentile(values, 50), 50)
+        T.assert_equal(percentile(values, 95), 95)
+        T.assert_equal(percentile(values, 99), 99)
+        T.assert_equal(percentile([3], 99), 3)
+        T.assert_equal(percentile([], 50), None)
+
+    def test_summarize_latencies(self):
+        summary = summarize_latencies([0.1, 0.3, 0.2, 0.4], 2.0, errors=1)
+        T.assert_equal(summary['count'], 4)
+        T.assert_equal(summary['errors'], 1)
+        T.assert_equal(summary['throughput'], 2.0)
+        T.assert_equal(summary['p50'], 0.2)
+        T.assert_equal(summary['max'], 0.4)
+
+    def test_run_benchmark(self):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            with patch.dict(Settings, MockedSettings):
+                benchmark_servlets.run_benchmark(
+                    requests=200, pushes=20, open_pushes=2, pickmes=5, iterations=2, output=output
+                )
+            with open(output) as results_file:
+                results = json.load(results_file)
+        finally:
+            os.unlink(output)
+
+        T.assert_equal(results['benchmark'], 'servlets')
+        T.assert_equal(results['parameters']['requests'], 200)
+        T.assert_equal(
+            sorted(results['results']),
+            sorted(name for name, _ in benchmark_servlets.get_targets({'open_pushes': [], 'live_pushes': []}))
+        )
+        for name, result in results['results'].iteritems():
+            T.assert_equal(result['errors'], 0, message=name)
+            T.assert_equal(result['count'], 2)
+            T.assert_lte(result['p50'], result['p99'])
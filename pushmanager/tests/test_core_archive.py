@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import os
+
+import sqlalchemy as SA
+import testify as T
+from mock import patch
+from pushmanager.core import archive
+from pushmanager.core import db
+from pushmanager.testing import testdb
+from pushmanager.testing.mocksettings import MockedSettings
+
+
+DAY = 86400
+NOW = 1000 * DAY
+
+
+class ArchiveTest(T.TestCase):
+
+    @T.setup_teardown
+    def setup_db(self):
+        self.db_file_path = testdb.create_temp_db_file()
+        MockedSettings['db_uri'] = testdb.get_temp_db_uri(self.db_file_path)
+        with patch.dict(db.Settings, MockedSettings):
+            db.init_db()
+            self.insert_rows()
+            yield
+            db.finalize_db()
+            os.unlink(self.db_file_path)
+
+    def on_db_return(self, success, db_results):
+        assert success
+
+    def insert_rows(self):
+        requests = [
+            # Written before changed was added
+            (18, 'live', NOW - 10 * DAY, None),
+            # Discarded without being edited
+            (19, 'discarded', NOW - 10 * DAY, NOW),
+            (20, 'live', NOW - 10 * DAY, NOW - 10 * DAY),
+            (21, 'discarded', NOW - 10 * DAY, NOW - 10 * DAY),
+            (22, 'live', NOW, NOW),
+            (23, 'requested', NOW - 10 * DAY, NOW - 10 * DAY),
+            # Always kept, as the latest request
+            (24, 'live', NOW - 10 * DAY, NOW - 10 * DAY),
+        ]
+        queries = [
+            db.push_requests.insert({
+                'id': request_id, 'user': 'archivist', 'state': state, 'repo': 'repo', 'branch': 'branch',
+                'title': 'Request %d' % request_id, 'created': modified, 'modified': modified, 'changed': changed,
+            })
+            for request_id, state, modified, changed in requests
+        ]
+        queries += [
+            db.push_pushcontents.insert({'request': 20, 'push': 5}),
+            db.push_pushcontents.insert({'request': 22, 'push': 5}),
+            db.push_checklist.insert({'request': 20, 'type': 'plans', 'complete': 0, 'target': 'stage'}),
+            db.push_removals.insert({
+                'request': 21, 'push': 5, 'reason': 'broken', 'pushmaster': 'pm', 'timestamp': NOW - 20 * DAY,
+            }),
+        ]
+        queries += db.search_index_queries()
+        db.execute_transaction_cb(queries, self.on_db_return)
+
+    def select(self, query, column):
+        values = []
+
+        def on_select(success, db_results):
+            assert success
+            values.extend(row[column] for row in db_results)
+        db.execute_cb(query, on_select)
+        return sorted(values)
+
+    def search_index_ids(self):
+        return self.select(SA.text("SELECT rowid AS id FROM %s" % db.SEARCH_INDEX), 'id')
+
+    def test_archive_requests(self):
+        T.assert_equal(archive.archive_requests(7, batch_size=1, now=NOW), 3)
+
+        T.assert_equal(self.select(db.push_requests.select(), 'id'), [19, 22, 23, 24])
+        T.assert_equal(self.select(db.push_requests_archive.select(), 'id'), [18, 20, 21])
+        T.assert_equal(self.search_index_ids(), [19, 22, 23, 24])
+        T.assert_equal(self.select(db.push_pushcontents.select(), 'request'), [22])
+        T.assert_equal(self.select(db.push_pushcontents_archive.select(), 'request'), [20])
+        T.assert_equal(self.select(db.push_checklist_archive.select(), 'request'), [20])
+        T.assert_equal(self.select(db.push_removals.select(), 'request'), [])
+        T.assert_equal(self.select(db.push_removals_archive.select(), 'request'), [21])
+
+        # Nothing left to archive
+        T.assert_equal(archive.archive_requests(7, batch_size=1, now=NOW), 0)
+
+    def test_archive_requests_changed_meanwhile(self):
+        execute_transaction_cb = db.execute_transaction_cb
+
+        def change_then_archive(queries, callback):
+            # Request 20 is discarded again between the select and the archiving
+            db.execute_cb(
+                db.push_requests.update().where(db.push_requests.c.id == 20).values({'changed': NOW}),
+                self.on_db_return
+            )
+            execute_transaction_cb(queries, callback)
+
+        with patch.object(db, 'execute_transaction_cb', side_effect=change_then_archive):
+            archive.archive_batch(NOW - 7 * DAY, batch_size=10)
+
+        T.assert_equal(self.select(db.push_requests_archive.select(), 'id'), [18, 21])
+        T.assert_equal(self.search_index_ids(), [19, 20, 22, 23, 24])
+
+    def test_with_archive(self):
+        archive.archive_requests(7, batch_size=10, now=NOW)
+        query = db.push_requests.select(SA.and_(
+            db.push_requests.c.id == db.push_pushcontents.c.request,
+            db.push_pushcontents.c.push == 5,
+        ))
+        T.assert_equal(self.select(query, 'id'), [22])
+        T.assert_equal(self.select(db.with_archive(query), 'id'), [20, 22])
+
+    def test_with_archive_ordered_and_counted(self):
+        archive.archive_requests(7, batch_size=10, now=NOW)
+        query = SA.select(
+            [db.push_requests.c.id],
+            db.push_requests.c.state == 'live',
+        ).order_by(db.push_requests.c.id.desc()).limit(2).offset(1)
+
+        ids = []
+        db.execute_cb(db.with_archive(query), lambda success, db_results: ids.extend(row[0] for row in db_results))
+        T.assert_equal(ids, [22, 20])
+
+        counts = []
+        db.execute_cb(
+            db.count_with_archive(query.limit(None).offset(None)),
+            lambda success, db_results: counts.append(db_results.scalar()),
+        )
+        T.assert_equal(counts, [4])
+
+
+if __name__ == '__main__':
+    T.run()
@@ -1,13 +1,129 @@
 #!/usr/bin/env python
 import logging
+import time
 
 import mock
 import testify as T
+import tornado.ioloop
 from pushmanager.core import auth
+from pushmanager.core.settings import Settings
+
+
+class FakeLDAPConnection(object):
+    """Stand-in for a python-ldap connection, checking binds against the
+    users of a FakeLDAPServer."""
+
+    def __init__(self, server):
+        self.server = server
+        self.options = {}
+        self.tls = False
+        self.bound = None
+
+    def set_option(self, option, value):
+        self.options[option] = value
+
+    def start_tls_s(self):
+        self.tls = True
+
+    def simple_bind_s(self, dn, password):
+        if self.server.down:
+            raise auth.ldap.SERVER_DOWN()
+        if self.server.users.get(dn) != password:
+            raise auth.ldap.INVALID_CREDENTIALS()
+        self.bound = dn
+
+    def search_s(self, basedn, scope):
+        assert self.tls and self.bound
+        return []
+
+    def unbind_s(self):
+        self.bound = None
+
+
+class FakeLDAPServer(object):
+
+    def __init__(self, users):
+        self.users = dict(
+            ('%s@%s' % (username, Settings['auth_ldap']['domain']), password)
+            for username, password in users.iteritems()
+        )
+        self.down = False
+        self.connections = []
+
+    def initialize(self, url):
+        connection = FakeLDAPConnection(self)
+        self.connections.append(connection)
+        return connection
 
 
 class TestAuthenticaton(T.TestCase):
 
+    @T.setup_teardown
+    def fake_ldap(self):
+        self.server = FakeLDAPServer({'testuser': 'secret', 'otheruser': 'other secret'})
+        self.authenticator = auth.LDAPAuthenticator('ldap://ldap.example.com', 2, 60)
+        with mock.patch.object(auth.ldap, 'initialize', side_effect=self.server.initialize):
+            yield
+
     def test_authenticate(self):
-        with mock.patch.object(logging, "exception"):
-            T.assert_equal(auth.authenticate_ldap("fake_user", "fake_password"), False)
+        with mock.patch.object(auth.ldap, 'initialize', side_effect=auth.ldap.SERVER_DOWN()):
+            with mock.patch.object(logging, "exception"):
+                T.assert_equal(auth.authenticate_ldap("fake_user", "fake_password"), False)
+
+    def test_connection_is_reused(self):
+        T.assert_equal(self.authenticator.authenticate('testuser', 'secret'), True)
+        T.assert_equal(self.authenticator.authenticate('testuser', 'wrong'), False)
+        T.assert_equal(self.authenticator.authenticate('otheruser', 'other secret'), True)
+        T.assert_length(self.server.connections, 1)
+        T.assert_equal(self.server.connections[0].tls, True)
+
+    def test_successful_logins_are_cached(self):
+        T.assert_equal(self.authenticator.authenticate('testuser', 'secret'), True)
+        self.server.users.clear()
+        T.assert_equal(self.authenticator.authenticate('testuser', 'secret'), True)
+        T.assert_equal(self.authenticator.authenticate('testuser', 'wrong'), False)
+
+        with mock.patch.object(auth.time, 'time', return_value=time.time() + 61):
+            T.assert_equal(self.authenticator.authenticate('testuser', 'secret'), False)
+
+    def test_failed_logins_are_not_cached(self):
+        T.assert_equal(self.authenticator.authenticate('testuser', 'wrong'), False)
+        self.server.users['testuser@%s' % Settings['auth_ldap']['domain']] = 'wrong'
+        T.assert_equal(self.authenticator.authenticate('testuser', 'wrong'), True)
+
+    def test_dropped_connection_is_replaced(self):
+        T.assert_equal(self.authenticator.authenticate('testuser', 'secret'), True)
+
+        original_bind = FakeLDAPConnection.simple_bind_s
+
+        def drop_first_connection(connection, dn, password):
+            if connection is self.server.connections[0]:
+                raise auth.ldap.SERVER_DOWN()
+            return original_bind(connection, dn, password)
+
+        with mock.patch.object(FakeLDAPConnection, 'simple_bind_s', drop_first_connection):
+            T.assert_equal(self.authenticator.authenticate('otheruser', 'other secret'), True)
+        T.assert_length(self.server.connections, 2)
+
+    def test_server_down(self):
+        self.server.down = True
+        with mock.patch.object(logging, "exception") as log_exception:
+            T.assert_equal(self.authenticator.authenticate('testuser', 'secret'), False)
+        T.assert_equal(log_exception.call_count, 1)
+
+    def test_authenticate_async(self):
+        io_loop = tornado.ioloop.IOLoop.instance()
+        results = []
+
+        def callback(success):
+            results.append(success)
+            if len(results) == 2:
+                io_loop.stop()
+
+        self.authenticator.authenticate_async('testuser', 'secret', callback)
+        self.authenticator.authenticate_async('testuser', 'wrong', callback)
+        timeout = io_loop.add_timeout(time.time() + 5, io_loop.stop)
+        io_loop.start()
+        io_loop.remove_timeout(timeout)
+
+        T.assert_equal(sorted(results), [False, True])
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os
+from contextlib import nested
 
 import sqlalchemy as SA
 from sqlalchemy.schema import Column
@@ -51,6 +52,24 @@ class CoreDBTest(T.TestCase, FakeDataMixin):
         first_push = self.make_push_dict(self.push_data[0])
         T.assert_equal(pushes[0].title, first_push['title'])
 
+    def search_requests(self, terms):
+        results = []
+
+        def on_db_return(success, db_results):
+            assert success
+            results.extend(request['id'] for request in db_results)
+
+        db.execute_cb(db.search_requests_query(terms, 10), on_db_return)
+        return results
+
+    def test_rebuild_search_index(self):
+        # Requests were inserted behind the index's back
+        T.assert_equal(self.search_requests('stuff'), [])
+
+        db.execute_transaction_cb(db.search_index_queries(), self.on_db_return)
+        T.assert_equal(sorted(self.search_requests('stuff')), [10, 11])
+        T.assert_equal(sorted(self.search_requests('yes comment')), [11, 13])
+
     def test_transaction_with_successful_condition(self):
         def on_return(success, _):
             assert success
@@ -86,6 +105,95 @@ class CoreDBTest(T.TestCase, FakeDataMixin):
                 )
             )
 
+    def test_refresh_dashboards(self):
+        dashboards = []
+
+        def on_db_return(success, db_results):
+            assert success
+            dashboards.extend(db_results.fetchall())
+
+        T.assert_equal(db.refresh_dashboards(db.users_of_requests([11])), True)
+        db.execute_cb(db.push_userdashboard.select(), on_db_return)
+        T.assert_equal([(row['user'], row['requested']) for row in dashboards], [('bmetin', 1)])
+
+        # Deadlocks between concurrent refreshes are retried
+        def on_deadlock(queries, callback_fn):
+            callback_fn(False, None)
+
+        with nested(
+            mock.patch.object(db, 'execute_transaction_cb', side_effect=on_deadlock),
+            mock.patch.object(db.logging, 'error'),
+        ) as (execute, error):
+            T.assert_equal(db.refresh_dashboards(['bmetin']), False)
+            T.assert_equal(execute.call_count, 2)
+            T.assert_equal(error.call_count, 1)
+
+    def test_engine_per_process(self):
+        parent_engine = db.engine
+        # As seen from a process forked after init_db
+        db._engine_pid = -1
+        with nested(
+            mock.patch.dict(db.Settings, MockedSettings),
+            mock.patch.object(db.metrics, 'observe'),
+        ) as (_, observe):
+            T.assert_equal(self.get_push_for_request(1), 1)
+            observe.assert_any_call('pushmanager_db_pool_wait_seconds', mock.ANY, {'role': 'default'})
+        T.assert_not_equal(db.engine, parent_engine)
+        T.assert_equal(db._parent_engine, parent_engine)
+        T.assert_equal(db._engine_pid, os.getpid())
+
+    def test_pool_role(self):
+        engine, pid = db.engine, db._engine_pid
+        settings = dict(MockedSettings, db_uri='mysql://user@host/db', db_pools={'web': {'pool_size': 3}})
+        try:
+            with nested(
+                mock.patch.dict(db.Settings, settings),
+                mock.patch.object(db.SA, 'create_engine'),
+            ) as (_, create_engine):
+                db.set_pool_role('web')
+                db._create_engine()
+                create_engine.assert_called_once_with('mysql://user@host/db', pool_recycle=3600, pool_size=3)
+        finally:
+            db.set_pool_role(None)
+            db.engine, db._engine_pid = engine, pid
+
+
+class SearchIndexModuleTest(T.TestCase, FakeDataMixin):
+    """Searches where SQLite lacks some of the full-text search modules."""
+
+    def on_db_return(self, success, db_results):
+        assert success
+
+    def search_requests(self, search_modules):
+        db_file_path = testdb.create_temp_db_file()
+        settings = dict(MockedSettings, db_uri=testdb.get_temp_db_uri(db_file_path))
+        results = []
+
+        def on_search(success, db_results):
+            assert success
+            results.extend(request['id'] for request in db_results)
+
+        try:
+            with nested(
+                mock.patch.dict(db.Settings, settings),
+                mock.patch.object(db, 'SEARCH_MODULES', search_modules),
+            ):
+                db.init_db()
+                self.insert_requests()
+                db.execute_transaction_cb(db.search_index_queries(), self.on_db_return)
+                module = db.search_module
+                db.execute_cb(db.search_requests_query('yes comment', 10), on_search)
+        finally:
+            db.finalize_db()
+            os.unlink(db_file_path)
+        return module, results
+
+    def test_search_with_fts4(self):
+        T.assert_equal(self.search_requests(('nosuchmodule', 'fts4')), ('fts4', [13, 11]))
+
+    def test_search_without_index(self):
+        T.assert_equal(self.search_requests(('nosuchmodule',)), (None, [13, 11]))
+
 
 class InsertIgnoreTestCase(T.TestCase):
 
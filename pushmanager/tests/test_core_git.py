@@ -9,11 +9,20 @@ import pushmanager.core.git
 import shutil
 import tempfile
 import testify as T
+import time
+from multiprocessing import BoundedSemaphore
+from multiprocessing import JoinableQueue
+from multiprocessing import Semaphore
 from pushmanager.core import db
 from pushmanager.core.git import GitCommand
 from pushmanager.core.git import GitException
+from pushmanager.core.git import GitQueryService
 from pushmanager.core.git import GitQueue
+from pushmanager.core.git import GitQueuePriority
+from pushmanager.core.git import GitQueueTask
 from pushmanager.core.git import GitTaskAction
+from pushmanager.core.git import GitTimeoutException
+from pushmanager.core.git import PushSnapshot
 from pushmanager.core.settings import Settings
 from pushmanager.testing import testdb
 from pushmanager.testing.mocksettings import MockedSettings
@@ -295,25 +304,33 @@ class CoreGitTest(T.TestCase):
             GC.assert_has_calls(calls)
 
     def test_merge_context_manager_success(self):
-        with mock.patch('pushmanager.core.git.GitCommand') as GC:
+        with nested(
+            mock.patch('pushmanager.core.git.GitCommand'),
+            mock.patch('pushmanager.core.git.GitQueryService.for_repo'),
+        ) as (GC, for_repo):
             GC.return_value = GC
-            GC.run.return_value = (0, "hashashash", "")
+            GC.run.return_value = (0, "", "")
+            for_repo.return_value.rev_parse.return_value = "hashashash"
             with pushmanager.core.git.git_merge_context_manager(
                     "name_of_test_branch",
                     "path_to_master_repo"):
                     pass
+            for_repo.assert_called_with('path_to_master_repo')
+            for_repo.return_value.rev_parse.assert_called_with('name_of_test_branch')
             calls = [
-                mock.call('rev-parse', 'name_of_test_branch', cwd='path_to_master_repo'),
-                mock.call.run(),
                 mock.call('reset', '--hard', 'hashashash', cwd='path_to_master_repo'),
                 mock.call.run()
             ]
             GC.assert_has_calls(calls)
 
     def test_merge_context_manager_failure(self):
-        with mock.patch('pushmanager.core.git.GitCommand') as GC:
+        with nested(
+            mock.patch('pushmanager.core.git.GitCommand'),
+            mock.patch('pushmanager.core.git.GitQueryService.for_repo'),
+        ) as (GC, for_repo):
             GC.return_value = GC
-            GC.run.return_value = (0, "hashashash", "")
+            GC.run.return_value = (0, "", "")
+            for_repo.return_value.rev_parse.return_value = "hashashash"
             try:
                 with pushmanager.core.git.git_merge_context_manager(
                         "name_of_test_branch",
@@ -323,8 +340,6 @@ class CoreGitTest(T.TestCase):
                 pass
 
             calls = [
-                mock.call('rev-parse', 'name_of_test_branch', cwd='path_to_master_repo'),
-                mock.call.run(),
                 mock.call('reset', '--hard', 'hashashash', cwd='path_to_master_repo'),
                 mock.call.run()
             ]
@@ -466,6 +481,7 @@ class CoreGitTest(T.TestCase):
     def test_clear_pickme_conflict_details(self):
         GQ = pushmanager.core.git.GitQueue()
         sample_req = {
+            'id': 1,
             'tags': 'asdasd,conflict-master,git-ok,conflict-pickme',
             'conflicts': 'This conflicts with everything!',
         }
@@ -473,9 +489,13 @@ class CoreGitTest(T.TestCase):
             'tags': 'asdasd,git-ok',
             'conflicts': '',
         }
-        with mock.patch('pushmanager.core.git.GitQueue._update_request') as update_req:
+        with nested(
+            mock.patch('pushmanager.core.git.GitQueue._update_request'),
+            mock.patch('pushmanager.core.git.GitQueue._store_conflict_details'),
+        ) as (update_req, store_details):
             GQ._clear_pickme_conflict_details(sample_req)
-            update_req.assert_called_with(sample_req, clean_req)
+            update_req.assert_called_with(sample_req, clean_req, snapshot=None)
+            store_details.assert_called_with(1, None, [], None)
 
     def test_pickme_conflict_pickme_integration_state_pickme(self):
         conflict, updated_request = self._pickme_conflict_pickme_integration('pickme')
@@ -498,6 +518,7 @@ class CoreGitTest(T.TestCase):
         added_request['state'] = 'added'
         added_request['tags'] = 'no-conflicts'
         pickme_request = copy.deepcopy(self.fake_request)
+        pickme_request['id'] = 2
         pickme_request['state'] = 'pickme'
         pickme_request['tags'] = 'no-conflicts'
         with nested(
@@ -505,13 +526,13 @@ class CoreGitTest(T.TestCase):
             mock.patch('pushmanager.core.git.GitQueue.git_merge_pickme'),
             mock.patch('pushmanager.core.git.git_branch_context_manager'),
             mock.patch('pushmanager.core.git.git_merge_context_manager'),
-            mock.patch('pushmanager.core.git.GitQueue._get_request_ids_in_push'),
-            mock.patch('pushmanager.core.git.GitQueue._get_request'),
+            mock.patch('pushmanager.core.git.GitQueue._get_push_snapshot'),
+            mock.patch('pushmanager.core.git.GitQueue._write_snapshot'),
             mock.patch('pushmanager.core.git.GitQueue.enqueue_request'),
             mock.patch('pushmanager.core.git.GitQueue._get_branch_sha_from_repo'),
             mock.patch('pushmanager.core.git.GitQueue._sha_exists_in_master'),
-        ) as (update_repo, merge_pickme, branch_mgr, merge_mgr, ids_in_push,
-              get_req, enqueue_req, get_sha, sha_in_master):
+        ) as (update_repo, merge_pickme, branch_mgr, merge_mgr, get_snapshot,
+              write_snapshot, enqueue_req, get_sha, sha_in_master):
 
             def throw_gitexn(*args):
                 raise GitException(
@@ -521,8 +542,7 @@ class CoreGitTest(T.TestCase):
                     gitout="some_stdout_string",
                 )
             merge_mgr.side_effect = throw_gitexn
-            ids_in_push.return_value = [2]
-            get_req.return_value = pickme_request
+            get_snapshot.return_value = PushSnapshot({'id': 1}, [added_request, pickme_request])
             get_sha.return_code = 'some_sha'
             sha_in_master.return_value = False
 
@@ -595,18 +615,14 @@ class CoreGitTest(T.TestCase):
             update_repo.assert_called_with(0, '.', 'change_german', checkout=False)
 
         with nested(
-                mock.patch('pushmanager.core.git.GitQueue._get_push_for_request'),
-                mock.patch('pushmanager.core.git.GitQueue._get_request_ids_in_push'),
-                mock.patch('pushmanager.core.git.GitQueue._get_request'),
+                mock.patch('pushmanager.core.git.GitQueue._get_push_snapshot'),
                 mock.patch('pushmanager.core.git.GitQueue._get_branch_sha_from_repo'),
                 mock.patch('pushmanager.core.git.GitQueue._sha_exists_in_master'),
                 mock.patch('pushmanager.core.git.GitQueue.create_or_update_local_repo'),
                 mock.patch('pushmanager.core.git.GitQueue._update_request'),
                 mock.patch.dict(Settings, test_settings, clear=True)
-        ) as (p_for_r, r_in_p, get_req, get_sha, sha_exists, _, update_req, _):
-            p_for_r.return_value = {'push': 1}
-            r_in_p.return_value = [1, 2]
-            get_req.return_value = welsh_req
+        ) as (get_snapshot, get_sha, sha_exists, _, update_req, _):
+            get_snapshot.return_value = PushSnapshot({'id': 1}, [german_req, welsh_req])
             get_sha.return_value = "0"*40
             sha_exists.return_value = False
             update_req.return_value = german_req
@@ -686,10 +702,9 @@ class CoreGitTest(T.TestCase):
 
     def test_requeue_pickmes_with_conflicts(self):
         with nested(
-            mock.patch.object(GitQueue, '_get_request_ids_in_push'),
-            mock.patch.object(GitQueue, '_get_request'),
+            mock.patch.object(GitQueue, '_get_push_snapshot'),
             mock.patch.object(GitQueue, 'enqueue_request')
-        ) as (ids_in_push, get_req, enqueue_req):
+        ) as (get_snapshot, enqueue_req):
 
             reqs = [
                 {'id': 1, 'tags': 'git-ok,conflict-pickme'},
@@ -697,13 +712,7 @@ class CoreGitTest(T.TestCase):
                 {'id': 3, 'tags': 'git-ok,feature'}
             ]
 
-            ids_in_push.return_value = [0, 1, 2]
-            get_req.return_value = reqs[0]
-
-            def update_get_req(i):
-                return reqs[i]
-
-            get_req.side_effect = update_get_req
+            get_snapshot.return_value = PushSnapshot({'id': 1}, reqs)
 
             pushmanager.core.git.GitQueue.requeue_pickmes_for_push(1, pushmanager_url, conflicting_only=True)
 
@@ -713,10 +722,9 @@ class CoreGitTest(T.TestCase):
 
     def test_requeue_all_pickmes(self):
         with nested(
-            mock.patch.object(GitQueue, '_get_request_ids_in_push'),
-            mock.patch.object(GitQueue, '_get_request'),
+            mock.patch.object(GitQueue, '_get_push_snapshot'),
             mock.patch.object(GitQueue, 'enqueue_request')
-        ) as (ids_in_push, get_req, enqueue_req):
+        ) as (get_snapshot, enqueue_req):
 
             reqs = [
                 {'id': 1, 'tags': 'git-ok,conflict-pickme'},
@@ -724,13 +732,7 @@ class CoreGitTest(T.TestCase):
                 {'id': 3, 'tags': 'git-ok,feature'}
             ]
 
-            ids_in_push.return_value = [0, 1, 2]
-            get_req.return_value = reqs[0]
-
-            def update_get_req(i):
-                return reqs[i]
-
-            get_req.side_effect = update_get_req
+            get_snapshot.return_value = PushSnapshot({'id': 1}, reqs)
 
             pushmanager.core.git.GitQueue.requeue_pickmes_for_push(1, pushmanager_url)
 
@@ -799,7 +801,437 @@ class CoreGitTest(T.TestCase):
         GitCommand('checkout', 'change_welsh', cwd=internal_submodule_path).run()
         GitCommand('checkout', 'master', cwd=repo_path).run()
 
-        T.assert_raises(GitException, pushmanager.core.git._stale_submodule_check, repo_path)
+        with mock.patch.dict(Settings, test_settings, clear=True):
+            T.assert_raises(GitException, pushmanager.core.git._stale_submodule_check, repo_path)
+
+    def _make_repo_with_submodule(self):
+        repo_path = tempfile.mkdtemp(prefix="pushmanager")
+        submodule_path = tempfile.mkdtemp(prefix="pushmanager")
+        self.temp_git_dirs.append(repo_path)
+        self.temp_git_dirs.append(submodule_path)
+
+        for path in (repo_path, submodule_path):
+            GitCommand('init', path, cwd=path).run()
+            GitCommand('config', 'user.email', 'test@pushmanager', cwd=path).run()
+            GitCommand('config', 'user.name', 'pushmanager tester', cwd=path).run()
+            with open(os.path.join(path, "code.py"), 'w') as f:
+                f.write('print("Hello World!")\n')
+            GitCommand('add', path, cwd=path).run()
+            GitCommand('commit', '-a', '-m', 'Master Commit', cwd=path).run()
+
+        GitCommand('submodule', 'add', submodule_path, 'sub', cwd=repo_path).run()
+        GitCommand('commit', '-a', '-m', 'Add submodule', cwd=repo_path).run()
+        return repo_path, submodule_path
+
+    def test_get_changed_gitlinks(self):
+        repo_path, submodule_path = self._make_repo_with_submodule()
+        _, old_sha, _ = GitCommand('rev-parse', 'HEAD', cwd=submodule_path).run()
+
+        with open(os.path.join(submodule_path, "code.py"), 'w') as f:
+            f.write('print("Hallo Welt!")\n')
+        GitCommand('commit', '-a', '-m', 'verpflichten', cwd=submodule_path).run()
+        _, new_sha, _ = GitCommand('rev-parse', 'HEAD', cwd=submodule_path).run()
+
+        GitCommand('pull', 'origin', 'master', cwd=os.path.join(repo_path, 'sub')).run()
+        with open(os.path.join(repo_path, "code.py"), 'w') as f:
+            f.write('print("Helo Byd!")\n')
+        GitCommand('commit', '-a', '-m', 'Bump submodule', cwd=repo_path).run()
+
+        T.assert_equal(
+            pushmanager.core.git._get_changed_gitlinks(repo_path, 'HEAD^', 'HEAD'),
+            {'sub': (old_sha.strip(), new_sha.strip())}
+        )
+        T.assert_equal(
+            pushmanager.core.git._get_changed_gitlinks(repo_path, 'HEAD~2', 'HEAD~1'),
+            {'sub': (None, old_sha.strip())}
+        )
+        T.assert_equal(pushmanager.core.git._get_changed_gitlinks(repo_path, 'HEAD', 'HEAD'), {})
+
+    def test_changed_paths_overlap(self):
+        overlap = pushmanager.core.git.changed_paths_overlap
+        T.assert_equal(overlap(['a.py', 'lib/b.py'], ['c.py', 'lib/d.py']), False)
+        T.assert_equal(overlap(['a.py', 'lib/b.py'], ['lib/b.py']), True)
+        # A file in one branch is a directory in the other
+        T.assert_equal(overlap(['lib'], ['lib/d.py']), True)
+        T.assert_equal(overlap(['lib/sub/d.py'], ['lib/sub']), True)
+        T.assert_equal(overlap(['lib/b.py'], ['lib/b.pyc']), False)
+        T.assert_equal(overlap([], ['a.py']), False)
+
+    def _make_repo_with_disjoint_branches(self):
+        repo_path = tempfile.mkdtemp(prefix="pushmanager")
+        self.temp_git_dirs.append(repo_path)
+        GitCommand('init', repo_path, cwd=repo_path).run()
+        GitCommand('config', 'user.email', 'test@pushmanager', cwd=repo_path).run()
+        GitCommand('config', 'user.name', 'pushmanager tester', cwd=repo_path).run()
+        for name in ('german.py', 'welsh.py'):
+            with open(os.path.join(repo_path, name), 'w') as f:
+                f.write('print("Hello World!")\n')
+        GitCommand('add', '.', cwd=repo_path).run()
+        GitCommand('commit', '-m', 'Master Commit', cwd=repo_path).run()
+        GitCommand('update-ref', 'refs/remotes/origin/master', 'master', cwd=repo_path).run()
+
+        shas = {}
+        branches = (('change_german', 'german.py', 'Hallo Welt!'), ('change_welsh', 'welsh.py', 'Helo Byd!'))
+        for branch, name, text in branches:
+            GitCommand('checkout', '-b', branch, 'master', cwd=repo_path).run()
+            with open(os.path.join(repo_path, name), 'w') as f:
+                f.write('print("%s")\n' % text)
+            GitCommand('commit', '-a', '-m', branch, cwd=repo_path).run()
+            _, sha, _ = GitCommand('rev-parse', 'HEAD', cwd=repo_path).run()
+            shas[branch] = sha.strip()
+        GitCommand('checkout', 'master', cwd=repo_path).run()
+        return repo_path, shas
+
+    def test_check_submodule_head_is_in_master(self):
+        repo_path, shas = self._make_repo_with_disjoint_branches()
+        _, master_sha, _ = GitCommand('rev-parse', 'master', cwd=repo_path).run()
+        _, dangling_sha, _ = GitCommand('commit-tree', 'master^{tree}', '-m', 'dangling', cwd=repo_path).run()
+
+        check = pushmanager.core.git._check_submodule_head_is_in_master
+        T.assert_equal(check(repo_path, master_sha.strip()), True)
+        # Pushed to a branch other than master
+        T.assert_equal(check(repo_path, shas['change_german']), True)
+        T.assert_equal(check(repo_path, dangling_sha.strip()), False)
+        T.assert_equal(check(repo_path, '0' * 40), False)
+
+    def test_get_changed_paths(self):
+        repo_path, shas = self._make_repo_with_disjoint_branches()
+        T.assert_equal(GitQueue._get_changed_paths(repo_path, 100, shas['change_german']), ['german.py'])
+
+        # Computed once per request and SHA
+        with mock.patch('pushmanager.core.git.GitCommand') as GC:
+            T.assert_equal(GitQueue._get_changed_paths(repo_path, 100, shas['change_german']), ['german.py'])
+            T.assert_equal(GC.call_count, 0)
+
+        # Only the latest SHA of a request is kept
+        T.assert_equal(GitQueue._get_changed_paths(repo_path, 100, shas['change_welsh']), ['welsh.py'])
+        rows = []
+        db.execute_cb(
+            db.push_changedpaths.select(db.push_changedpaths.c.request == 100),
+            lambda success, results: rows.extend(results.fetchall())
+        )
+        T.assert_equal([row['revision'] for row in rows], [shas['change_welsh']])
+
+        T.assert_equal(GitQueue._get_changed_paths(repo_path, 101, '1' * 40), None)
+
+    def test_pickme_conflict_pickme_prunes_disjoint_pickmes(self):
+        repo_path, shas = self._make_repo_with_disjoint_branches()
+        german_req = {'id': 102, 'state': 'pickme', 'tags': 'no-conflicts', 'repo': '.', 'branch': 'change_german'}
+        welsh_req = {'id': 103, 'state': 'pickme', 'tags': 'no-conflicts', 'repo': '.', 'branch': 'change_welsh'}
+
+        with nested(
+            mock.patch(
+                'pushmanager.core.git.GitQueue._get_push_snapshot',
+                side_effect=lambda **kwargs: PushSnapshot({'id': 1}, [german_req, welsh_req])
+            ),
+            mock.patch('pushmanager.core.git.GitQueue._get_branch_sha_from_repo', return_value=shas['change_welsh']),
+            mock.patch('pushmanager.core.git.GitQueue._sha_exists_in_master', return_value=False),
+            mock.patch('pushmanager.core.git.GitQueue.create_or_update_local_repo'),
+            mock.patch('pushmanager.core.git.GitQueue.git_merge_pickme'),
+            mock.patch('pushmanager.core.git.metrics.inc'),
+        ) as (_, _, _, _, merge_pickme, inc):
+            conflict, _ = GitQueue._test_pickme_conflict_pickme(
+                0, german_req, 'master', repo_path, pushmanager_url, False, shas['change_german']
+            )
+            T.assert_equal(conflict, False)
+            T.assert_equal(merge_pickme.call_count, 0)
+            inc.assert_any_call('pushmanager_conflict_checks_total', {'result': 'pruned'})
+
+            # Without the SHA of the merged pickme, every pickme is merged
+            GitQueue._test_pickme_conflict_pickme(0, german_req, 'master', repo_path, pushmanager_url, False)
+            T.assert_equal(merge_pickme.call_count, 1)
+
+    def test_pickme_conflict_pickme_prunes_before_fetching(self):
+        repo_path, shas = self._make_repo_with_disjoint_branches()
+        german_req = {'id': 102, 'state': 'pickme', 'tags': 'no-conflicts', 'repo': '.', 'branch': 'change_german'}
+        welsh_req = {
+            'id': 103, 'state': 'pickme', 'tags': 'no-conflicts', 'repo': '.', 'branch': 'change_welsh',
+            'revision': shas['change_welsh'],
+        }
+        changed_paths = {(103, shas['change_welsh']): ['welsh.py']}
+
+        with nested(
+            mock.patch(
+                'pushmanager.core.git.GitQueue._get_push_snapshot',
+                side_effect=lambda **kwargs: PushSnapshot({'id': 1}, [german_req, welsh_req], changed_paths)
+            ),
+            mock.patch('pushmanager.core.git.GitQueue._get_branch_sha_from_repo'),
+            mock.patch('pushmanager.core.git.GitQueue.create_or_update_local_repo'),
+            mock.patch('pushmanager.core.git.GitQueue.git_merge_pickme'),
+        ) as (_, get_branch_sha, update_local_repo, merge_pickme):
+            GitQueue._test_pickme_conflict_pickme(
+                0, german_req, 'master', repo_path, pushmanager_url, False, shas['change_german']
+            )
+            T.assert_equal(get_branch_sha.call_count, 0)
+            T.assert_equal(update_local_repo.call_count, 0)
+            T.assert_equal(merge_pickme.call_count, 0)
+
+    def test_store_conflict_pairs(self):
+        def get_pairs():
+            pairs = []
+            db.execute_cb(
+                db.push_conflictpairs.select(db.push_conflictpairs.c.push == 50),
+                lambda success, results: pairs.extend((row['request'], row['other']) for row in results)
+            )
+            return sorted(pairs)
+
+        GitQueue._store_conflict_pairs(50, 7, [3, 9], [3, 9])
+        GitQueue._store_conflict_pairs(50, '9', [7], [7])
+        T.assert_equal(get_pairs(), [(3, 7), (7, 9)])
+
+        # Pairs with pickmes skipped by a check are kept
+        GitQueue._store_conflict_pairs(50, 7, [], [])
+        T.assert_equal(get_pairs(), [(3, 7), (7, 9)])
+
+        # Pairs of a pickme are replaced when it is checked again
+        GitQueue._store_conflict_pairs(50, 7, [9], [])
+        T.assert_equal(get_pairs(), [(3, 7)])
+        GitQueue._store_conflict_pairs(50, 3, [7], [])
+        T.assert_equal(get_pairs(), [])
+
+    def test_conflict_summary(self):
+        git_out = (
+            "Auto-merging a.py\n"
+            "CONFLICT (content): Merge conflict in a.py\n"
+            "CONFLICT (modify/delete): b.py deleted in HEAD and modified in pickme.\n"
+            "CONFLICT (content): Merge conflict in a.py\n"
+        )
+        T.assert_equal(pushmanager.core.git.conflicting_paths(git_out), ['a.py', 'b.py'])
+
+        summary = GitQueue._format_conflict_summary(7, 0, 'master', git_out, 'Automatic merge failed')
+        T.assert_in('a.py, b.py', summary)
+        T.assert_not_in('Auto-merging', summary)
+        T.assert_in('/api/conflictdetails?id=7&amp;other=0', summary)
+
+        with mock.patch.object(GitQueue, 'CONFLICT_SUMMARY_PATHS', 1):
+            summary = GitQueue._format_conflict_summary(7, 3, 'pickme', git_out, '')
+            T.assert_in('a.py and 1 more', summary)
+
+        # Without conflicting paths, the last line of output is kept
+        summary = GitQueue._format_conflict_summary(7, 0, 'master', 'stdout', 'fatal: <refusing>\n')
+        T.assert_in('fatal: &lt;refusing&gt;', summary)
+
+    def test_store_conflict_details(self):
+        def get_details():
+            details = []
+            db.execute_cb(
+                db.push_conflictdetails.select(db.push_conflictdetails.c.request == 70),
+                lambda success, results: details.extend(results.fetchall())
+            )
+            return sorted(details, key=lambda row: row['other'])
+
+        with mock.patch.object(GitQueue, 'CONFLICT_OUTPUT_LIMIT', 10):
+            GitQueue._store_conflict_details(70, 'a' * 40, [(3, 'x' * 20, 'y'), (9, 'out', 'err')])
+        details = get_details()
+        T.assert_equal([(row['other'], row['size']) for row in details], [(3, 22), (9, 7)])
+        T.assert_equal(pushmanager.core.git.decompress_conflict_output(details[0]['output']), 'x' * 10)
+        T.assert_equal(pushmanager.core.git.decompress_conflict_output(details[1]['output']), 'out\nerr')
+
+        # Details of a request are replaced when it is checked again
+        GitQueue._store_conflict_details(70, None, [])
+        T.assert_equal(get_details(), [])
+
+    def _insert_accepting_push(self, push_id, requests):
+        queries = [db.push_pushes.insert({
+            'id': push_id,
+            'title': 'Deploy Candidate',
+            'user': 'pushmaster',
+            'branch': 'deploy-candidate',
+            'revision': '0' * 40,
+            'state': 'accepting',
+            'created': 1346458663,
+            'modified': 1346458663,
+            'pushtype': 'regular',
+        })]
+        db.execute_transaction_cb(queries, lambda success, results: T.assert_equal(success, True))
+        self._add_to_push(push_id, requests)
+
+    def _add_to_push(self, push_id, requests):
+        queries = []
+        for req in requests:
+            queries.append(db.push_requests.insert(dict(req, state='added', user='testuser', repo='.')))
+            queries.append(db.push_pushcontents.insert({'request': req['id'], 'push': push_id}))
+        db.execute_transaction_cb(queries, lambda success, results: T.assert_equal(success, True))
+
+    def _get_deploy_candidate(self, push_id):
+        _, _, steps = GitQueue._get_deploy_inputs(push_id)
+        revision = []
+        db.execute_cb(
+            db.push_pushes.select(db.push_pushes.c.id == push_id),
+            lambda success, results: revision.append(results.first()['revision'])
+        )
+        return [(step['request'], step['sha']) for step in steps], revision[0]
+
+    def test_build_deploy_branch(self):
+        repo_path, shas = self._make_repo_with_disjoint_branches()
+        GitCommand('checkout', '-b', 'conflict_german', 'master', cwd=repo_path).run()
+        with open(os.path.join(repo_path, 'german.py'), 'w') as f:
+            f.write('print("Guten Tag Welt!")\n')
+        GitCommand('commit', '-a', '-m', 'conflict_german', cwd=repo_path).run()
+        _, conflict_sha, _ = GitCommand('rev-parse', 'HEAD', cwd=repo_path).run()
+        GitCommand('checkout', 'master', cwd=repo_path).run()
+
+        self._insert_accepting_push(100, [
+            {'id': 200, 'title': 'German', 'branch': 'change_german', 'revision': shas['change_german']},
+            {'id': 201, 'title': 'Welsh', 'branch': 'change_welsh', 'revision': shas['change_welsh']},
+        ])
+
+        with nested(
+            mock.patch('pushmanager.core.git.GitQueue.create_or_update_local_repo'),
+            mock.patch('pushmanager.core.git.GitQueue._get_local_repository_uri', return_value=repo_path),
+            mock.patch.object(GitQueue, '_merge_deploy_step', wraps=GitQueue._merge_deploy_step),
+        ) as (_, _, merge_step):
+            GitQueue.build_deploy_branch(0, 100)
+            steps, revision = self._get_deploy_candidate(100)
+            T.assert_equal([step[0] for step in steps], [200, 201])
+            T.assert_equal(revision, steps[-1][1])
+            _, german, _ = GitCommand('show', '%s:german.py' % revision, cwd=repo_path).run()
+            _, welsh, _ = GitCommand('show', '%s:welsh.py' % revision, cwd=repo_path).run()
+            T.assert_equal((german, welsh), ('print("Hallo Welt!")\n', 'print("Helo Byd!")\n'))
+            T.assert_equal(merge_step.call_count, 2)
+
+            # Nothing changed, nothing to merge
+            GitQueue.build_deploy_branch(0, 100)
+            T.assert_equal(merge_step.call_count, 2)
+
+            # Removing the last request keeps the first step
+            db.execute_cb(db.push_pushcontents.delete(db.push_pushcontents.c.request == 201), lambda *args: None)
+            GitQueue.build_deploy_branch(0, 100)
+            T.assert_equal(self._get_deploy_candidate(100), ([steps[0]], steps[0][1]))
+            T.assert_equal(merge_step.call_count, 2)
+
+            # Merge commits are reproducible
+            db.execute_cb(db.push_pushcontents.insert({'request': 201, 'push': 100}), lambda *args: None)
+            GitQueue.build_deploy_branch(0, 100)
+            T.assert_equal(self._get_deploy_candidate(100), (steps, revision))
+            T.assert_equal(merge_step.call_count, 3)
+
+            # A conflicting request ends the candidate
+            self._add_to_push(100, [
+                {'id': 202, 'title': 'Conflict', 'branch': 'conflict_german', 'revision': conflict_sha.strip()},
+            ])
+            GitQueue.build_deploy_branch(0, 100)
+            T.assert_equal(self._get_deploy_candidate(100), (steps + [(202, None)], '0' * 40))
+            T.assert_equal(merge_step.call_count, 4)
+
+    def test_push_snapshot(self):
+        self._insert_accepting_push(110, [
+            {'id': 210, 'title': 'German', 'branch': 'change_german', 'revision': '1' * 40, 'tags': 'git-ok'},
+            {'id': 211, 'title': 'Welsh', 'branch': 'change_welsh', 'revision': '2' * 40, 'tags': 'git-ok'},
+        ])
+        db.execute_cb(
+            db.push_changedpaths.insert({'request': 210, 'revision': '1' * 40, 'paths': '["german.py"]'}),
+            lambda success, results: T.assert_equal(success, True)
+        )
+
+        with mock.patch.object(db, 'execute_transaction_cb', wraps=db.execute_transaction_cb) as transaction:
+            snapshot = GitQueue._get_push_snapshot(request_id=211)
+            T.assert_equal(transaction.call_count, 1)
+        T.assert_equal(snapshot.push_id, 110)
+        T.assert_equal(snapshot.push['state'], 'accepting')
+        T.assert_equal(snapshot.request_ids(), [210, 211])
+        T.assert_equal(snapshot.get_request('211')['title'], 'Welsh')
+        T.assert_equal(snapshot.changed_paths, {(210, '1' * 40): ['german.py']})
+        T.assert_equal(GitQueue._get_push_snapshot(push_id=110).request_ids(), [210, 211])
+        T.assert_equal(GitQueue._get_push_snapshot(request_id=990), None)
+
+        # Updates are only visible in the database once written, together
+        updated = GitQueue._update_request(snapshot.get_request(210), {'tags': 'git-ok,conflict-pickme'}, snapshot)
+        GitQueue._update_request(snapshot.get_request(211), {'tags': 'git-ok,no-conflicts'}, snapshot)
+        GitQueue._store_conflict_pairs(110, 210, [211], [], snapshot)
+        T.assert_equal(updated['tags'], 'git-ok,conflict-pickme')
+        T.assert_equal(GitQueue._get_request(210)['tags'], 'git-ok')
+        with mock.patch.object(db, 'execute_transaction_cb', wraps=db.execute_transaction_cb) as transaction:
+            GitQueue._write_snapshot(snapshot)
+            GitQueue._write_snapshot(snapshot)
+            T.assert_equal(transaction.call_count, 1)
+        T.assert_equal(GitQueue._get_request(210)['tags'], 'git-ok,conflict-pickme')
+        T.assert_equal(GitQueue._get_request(211)['tags'], 'git-ok,no-conflicts')
+
+    def test_get_active_requests(self):
+        def get_active():
+            return dict((req['id'], req) for req in GitQueue._get_active_requests())
+
+        def execute(query):
+            db.execute_cb(query, lambda success, results: T.assert_equal(success, True))
+
+        self._add_to_push(120, [
+            {'id': 220, 'title': 'German', 'branch': 'change_german', 'revision': '1' * 40, 'tags': 'git-ok'},
+            {'id': 221, 'title': 'Welsh', 'branch': 'change_welsh', 'revision': '2' * 40, 'tags': 'git-ok'},
+            {'id': 222, 'title': 'Breton', 'branch': 'change_breton', 'revision': '3' * 40, 'tags': 'git-ok'},
+        ])
+        with nested(
+            mock.patch.object(GitQueue, 'active_requests', None),
+            mock.patch.object(GitQueue, 'active_watermark', None),
+            mock.patch.object(GitQueue, 'active_full_scan', None),
+        ):
+            active = get_active()
+            T.assert_equal(sorted(active[220]), sorted(GitQueue.ACTIVE_COLUMNS))
+            T.assert_equal(active[221]['revision'], '2' * 40)
+
+            # Only changed rows are read, including those no longer active
+            execute(db.push_requests.update().where(db.push_requests.c.id == 220).values({'state': 'live'}))
+            execute(db.push_requests.update().where(db.push_requests.c.id == 221).values({'revision': '3' * 40}))
+            execute("UPDATE push_requests SET tags = 'git-ok,urgent', changed = changed - 100 WHERE id = 222")
+            active = get_active()
+            T.assert_not_in(220, active)
+            T.assert_equal(active[221]['revision'], '3' * 40)
+            T.assert_equal(active[222]['tags'], 'git-ok')
+
+            # Full scans pick up rows written without updating changed
+            GitQueue.active_full_scan -= GitQueue.ACTIVE_FULL_SCAN_INTERVAL
+            T.assert_equal(get_active()[222]['tags'], 'git-ok,urgent')
+
+    def test_submodule_cache_is_shared(self):
+        repo_path, submodule_path = self._make_repo_with_submodule()
+        test_settings = copy.deepcopy(Settings)
+        test_settings['git']['local_repo_path'] = tempfile.mkdtemp(prefix="pushmanager")
+        self.temp_git_dirs.append(test_settings['git']['local_repo_path'])
+        gitlinks = pushmanager.core.git._get_changed_gitlinks(repo_path, 'HEAD^', 'HEAD')
+
+        with mock.patch.dict(Settings, test_settings, clear=True):
+            pushmanager.core.git._stale_submodule_check(repo_path, gitlinks)
+            cache_path = pushmanager.core.git._get_submodule_cache_path(submodule_path)
+            T.assert_equal(os.path.isdir(cache_path), True)
+
+            # A second check is answered from the cache without fetching
+            with mock.patch('pushmanager.core.git.GitCommand', wraps=GitCommand) as GC:
+                pushmanager.core.git._stale_submodule_check(repo_path, gitlinks)
+                for call in GC.call_args_list:
+                    T.assert_not_in(call[0][0], ('clone', 'fetch'))
+
+            # Commits that never made it to the submodule's master are refused
+            sub_checkout = os.path.join(repo_path, 'sub')
+            GitCommand('config', 'user.email', 'test@pushmanager', cwd=sub_checkout).run()
+            GitCommand('config', 'user.name', 'pushmanager tester', cwd=sub_checkout).run()
+            GitCommand('commit', '--allow-empty', '-m', 'Unpushed', cwd=sub_checkout).run()
+            GitCommand('commit', '-a', '-m', 'Bump submodule', cwd=repo_path).run()
+            gitlinks = pushmanager.core.git._get_changed_gitlinks(repo_path, 'HEAD^', 'HEAD')
+            T.assert_raises(GitException, pushmanager.core.git._stale_submodule_check, repo_path, gitlinks)
+
+    def test_git_reset_to_ref_updates_moved_submodules(self):
+        with nested(
+            mock.patch('pushmanager.core.git.GitCommand'),
+            mock.patch('pushmanager.core.git._get_changed_gitlinks'),
+        ) as (GC, changed_gitlinks):
+            changed_gitlinks.return_value = {'sub': ('0' * 40, '1' * 40)}
+            pushmanager.core.git.git_reset_to_ref('some_ref', 'git_dir')
+            changed_gitlinks.assert_called_with('git_dir', 'ORIG_HEAD', 'HEAD')
+            calls = [
+                mock.call('reset', '--hard', 'some_ref', cwd='git_dir'),
+                mock.call().run(),
+                mock.call('submodule', '--quiet', 'sync', cwd='git_dir'),
+                mock.call().run(),
+                mock.call('submodule', '--quiet', 'update', cwd='git_dir'),
+                mock.call().run(),
+            ]
+            GC.assert_has_calls(calls)
+
+            GC.reset_mock()
+            changed_gitlinks.return_value = {}
+            pushmanager.core.git.git_reset_to_ref('some_ref', 'git_dir')
+            GC.assert_has_calls([mock.call('reset', '--hard', 'some_ref', cwd='git_dir'), mock.call().run()])
+            T.assert_equal(GC.call_count, 1)
 
     def test_update_req_sha_and_queue_pickme_requested(self):
         new_sha = "1"*40
@@ -873,7 +1305,7 @@ class CoreGitTest(T.TestCase):
                 )
                 db.execute_cb(request_info_query, on_db_return)
                 T.assert_equal(result[0][5], new_sha)
-                T.assert_equals(enqueue_req.call_count, 2)
+                T.assert_equals(enqueue_req.call_count, 3)
                 enqueue_req.assert_has_calls([
                     mock.call(
                         GitTaskAction.TEST_CONFLICTING_PICKMES,
@@ -881,9 +1313,26 @@ class CoreGitTest(T.TestCase):
                         pushmanager_url='https://%s:%s' % (
                             MockedSettings['main_app']['servername'],
                             MockedSettings['main_app']['port'])
-                        )
+                        ),
+                    mock.call(
+                        GitTaskAction.BUILD_DEPLOY_BRANCH,
+                        GitQueue._get_push_for_request(pickme_request['id'])['push'],
+                    ),
                 ])
 
+    def test_update_req_sha_and_queue_pickme_removed_from_push(self):
+        new_sha = "1"*40
+        added_request = copy.deepcopy(self.fake_request)
+        added_request['state'] = 'added'
+        added_request['tags'] = 'conflict-pickme'
+        with nested(
+            mock.patch('pushmanager.core.git.GitQueue.enqueue_request'),
+            mock.patch('pushmanager.core.git.GitQueue._get_push_for_request', return_value=None),
+            mock.patch.dict(Settings, MockedSettings),
+        ) as (enqueue_req, _, _):
+            GitQueue._update_req_sha_and_queue_pickme(added_request, new_sha)
+            T.assert_equal([call[0][0] for call in enqueue_req.call_args_list], [GitTaskAction.VERIFY_BRANCH])
+
     def test_stderr_and_stdout_in_conflict_text(self):
         welsh_req = {
             'id': 2,
@@ -919,5 +1368,189 @@ class CoreGitTest(T.TestCase):
             )
 
             assert conflict is True
+            # The request only keeps a summary, the full output is stored aside
             assert "some_stderr_string" in details['conflicts']
-            assert "some_stdout_string" in details['conflicts']
+            assert "/api/conflictdetails?id=2&amp;other=0" in details['conflicts']
+            rows = []
+            db.execute_cb(
+                db.push_conflictdetails.select(db.push_conflictdetails.c.request == 2),
+                lambda success, results: rows.extend(results.fetchall())
+            )
+            T.assert_equal(len(rows), 1)
+            output = pushmanager.core.git.decompress_conflict_output(rows[0]['output'])
+            assert "some_stderr_string" in output
+            assert "some_stdout_string" in output
+
+    def test_command_timeout_kills_process_group(self):
+        start = time.time()
+        # The alias runs through a shell, so sleep is a grandchild of ours
+        # and only goes away if the whole process group is killed.
+        command = GitCommand('-c', 'alias.hang=!sleep 30', 'hang', timeout=0.5)
+        T.assert_raises(GitTimeoutException, command.run)
+        T.assert_lt(time.time() - start, 10)
+        T.assert_equal(command.timed_out, True)
+
+    def test_command_without_timeout(self):
+        _, stdout, _ = GitCommand('--version', timeout=None).run()
+        T.assert_in('git version', stdout)
+
+    def test_task_deadline(self):
+        with pushmanager.core.git.git_task_deadline(0.5):
+            command = GitCommand('-c', 'alias.hang=!sleep 30', 'hang', timeout=None)
+            T.assert_raises(GitTimeoutException, command.run)
+            # Nothing new may be started once the deadline has passed
+            T.assert_raises(GitTimeoutException, GitCommand, '--version')
+        T.assert_equal(GitCommand.deadline, None)
+
+    def test_timeouts_are_not_conflicts(self):
+        with nested(
+            mock.patch('pushmanager.core.git.GitQueue.create_or_update_local_repo'),
+            mock.patch('pushmanager.core.git.GitQueue.git_merge_pickme'),
+            mock.patch('pushmanager.core.git.git_branch_context_manager'),
+            mock.patch('pushmanager.core.git.git_merge_context_manager'),
+            mock.patch('pushmanager.core.git.GitQueue._update_request'),
+        ) as (_, _, _, merge_mgr, update_req):
+
+            def throw_timeout(*args):
+                raise GitTimeoutException("GitException: timed out", gitret=-9, giterr='', gitout='')
+            merge_mgr.side_effect = throw_timeout
+
+            T.assert_raises(
+                GitTimeoutException,
+                GitQueue._test_pickme_conflict_master,
+                0,
+                copy.deepcopy(self.fake_request),
+                'testing_pickme_branch',
+                '/local/repo/path/',
+                pushmanager_url,
+                False
+            )
+            T.assert_equal(update_req.call_count, 0)
+
+    def test_sha_queue_moves_on_after_timeout(self):
+        tasks = [
+            GitQueueTask(GitTaskAction.VERIFY_BRANCH, 1, pushmanager_url=pushmanager_url),
+            GitQueueTask(GitTaskAction.VERIFY_BRANCH, 2, pushmanager_url=pushmanager_url),
+        ]
+
+        class StopWorker(Exception):
+            pass
+
+        def next_task():
+            if not tasks:
+                raise StopWorker()
+            return tasks.pop(0)
+
+        def verify_branch(request_id, url):
+            if request_id == 1:
+                raise GitTimeoutException("GitException: timed out", gitret=-9, giterr='', gitout='')
+
+        lane = mock.Mock()
+        with nested(
+            mock.patch.object(GitQueue, '_get_sha_task', side_effect=lambda: (lane, next_task())),
+            mock.patch.object(GitQueue, 'verify_branch', side_effect=verify_branch),
+            mock.patch('pushmanager.core.git.logging'),
+        ) as (_, verify, logging):
+            T.assert_raises(StopWorker, GitQueue.process_sha_queue)
+            T.assert_equal(verify.call_count, 2)
+            T.assert_equal(lane.task_done.call_count, 2)
+            T.assert_in('timed out', logging.error.call_args_list[0][0][0])
+
+    def test_sha_queue_interactive_lane_first(self):
+        with nested(
+            mock.patch.object(GitQueue, 'sha_queue', JoinableQueue()),
+            mock.patch.object(GitQueue, 'sha_background_queue', JoinableQueue()),
+            mock.patch.object(GitQueue, 'sha_tasks', Semaphore(0)),
+        ):
+            GitQueue.enqueue_request(
+                GitTaskAction.VERIFY_BRANCH, 1,
+                priority=GitQueuePriority.BACKGROUND, pushmanager_url=pushmanager_url
+            )
+            GitQueue.enqueue_request(GitTaskAction.VERIFY_BRANCH, 2, pushmanager_url=pushmanager_url)
+
+            lane, task = GitQueue._get_sha_task()
+            T.assert_equal(lane, GitQueue.sha_queue)
+            T.assert_equal(task.request_id, 2)
+            lane, task = GitQueue._get_sha_task()
+            T.assert_equal(lane, GitQueue.sha_background_queue)
+            T.assert_equal(task.request_id, 1)
+            T.assert_equal(task.kwargs, {'pushmanager_url': pushmanager_url})
+            # Every task was handed out exactly once
+            T.assert_equal(GitQueue.sha_tasks.acquire(False), False)
+
+    def test_remote_slot(self):
+        with mock.patch.object(GitQueue, 'remote_slots', [BoundedSemaphore(1)]):
+            with GitQueue._remote_slot('git://git.example.com/devs/user'):
+                T.assert_equal(GitQueue.remote_slots[0].acquire(False), False)
+            T.assert_equal(GitQueue.remote_slots[0].acquire(False), True)
+        # Without slots configured there is no limit
+        with GitQueue._remote_slot('git://git.example.com/devs/user'):
+            pass
+
+    def test_remote_slot_is_throttled(self):
+        throttle = mock.MagicMock()
+        with mock.patch.object(GitQueue, 'remote_throttles', [throttle]):
+            with GitQueue._remote_slot('git://git.example.com/devs/user'):
+                T.assert_equal(throttle.throttled.return_value.__enter__.call_count, 1)
+            T.assert_equal(throttle.throttled.return_value.__exit__.call_count, 1)
+
+    def _make_linear_repo(self):
+        repo_path = tempfile.mkdtemp(prefix="pushmanager")
+        self.temp_git_dirs.append(repo_path)
+        GitCommand('init', repo_path, cwd=repo_path).run()
+        GitCommand('config', 'user.email', 'test@pushmanager', cwd=repo_path).run()
+        GitCommand('config', 'user.name', 'pushmanager tester', cwd=repo_path).run()
+        shas = []
+        for i in range(3):
+            with open(os.path.join(repo_path, "code.py"), 'w') as f:
+                f.write('print("%d")\n' % i)
+            GitCommand('add', 'code.py', cwd=repo_path).run()
+            GitCommand('commit', '-m', 'Commit %d' % i, cwd=repo_path).run()
+            _, sha, _ = GitCommand('rev-parse', 'HEAD', cwd=repo_path).run()
+            shas.append(sha.strip())
+        return repo_path, shas
+
+    def test_query_service_resolve(self):
+        repo_path, shas = self._make_linear_repo()
+        query = GitQueryService.for_repo(repo_path)
+        try:
+            T.assert_is(query, GitQueryService.for_repo(repo_path))
+            T.assert_equal(query.rev_parse('HEAD'), shas[-1])
+            T.assert_equal(
+                query.resolve('HEAD~2', shas[1][:10], 'no_such_branch', 'two words', ''),
+                [shas[0], shas[1], None, None, None]
+            )
+            T.assert_equal(query.object_exists('HEAD:code.py'), True)
+            T.assert_equal(query.object_exists('1' * 40), False)
+            # Still answering on the same process
+            process = query.process
+            T.assert_equal(query.rev_parse('HEAD~1'), shas[1])
+            T.assert_is(query.process, process)
+        finally:
+            query.close()
+
+    def test_query_service_is_ancestor(self):
+        repo_path, shas = self._make_linear_repo()
+        query = GitQueryService.for_repo(repo_path)
+        try:
+            T.assert_equal(query.is_ancestor(shas[0], 'HEAD'), True)
+            T.assert_equal(query.is_ancestor('HEAD', shas[0]), False)
+            T.assert_equal(query.is_ancestor('HEAD', 'HEAD'), True)
+            T.assert_equal(query.is_ancestor('1' * 40, 'HEAD'), False)
+
+            # Answers for known pairs don't need another git process
+            with mock.patch('pushmanager.core.git.GitCommand') as GC:
+                T.assert_equal(query.is_ancestor(shas[0], shas[-1]), True)
+                T.assert_equal(query.is_ancestor(shas[-1], shas[0]), False)
+                T.assert_equal(GC.call_count, 0)
+        finally:
+            query.close()
+
+    def test_query_service_batches(self):
+        repo_path, shas = self._make_linear_repo()
+        query = GitQueryService.for_repo(repo_path)
+        try:
+            with mock.patch.object(GitQueryService, 'MAX_BATCH', 2):
+                T.assert_equal(query.resolve(*(['HEAD'] * 5)), [shas[-1]] * 5)
+        finally:
+            query.close()
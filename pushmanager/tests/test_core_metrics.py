@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Event
+from multiprocessing import JoinableQueue
+from multiprocessing import Process
+
+import mock
+import testify as T
+from pushmanager.core import metrics
+from pushmanager.core.util import get_servlet_urlspec
+from pushmanager.servlets.metrics import MetricsServlet
+from pushmanager.testing.testservlet import ServletTestMixin
+
+
+def reset_metrics():
+    return mock.patch.multiple(
+        metrics,
+        directory=None,
+        flush_interval=5,
+        queues={},
+        _pid=None,
+        _counters={},
+        _histograms={},
+        _last_flush=0,
+        _dirty=False,
+        _flusher=None,
+    )
+
+
+def record_in_child():
+    metrics.inc('pushmanager_cache_requests_total', {'cache': 'test', 'result': 'hit'})
+    metrics.flush(force=True)
+
+
+def record_and_block(done):
+    # The first sample is written right away, the second one within the
+    # flush interval, while the worker is blocked waiting for work
+    metrics.inc('pushmanager_cache_requests_total', {'cache': 'test', 'result': 'hit'})
+    metrics.inc('pushmanager_cache_requests_total', {'cache': 'test', 'result': 'hit'})
+    done.wait()
+    # Recorded after the last background flush, written at exit
+    metrics.inc('pushmanager_cache_requests_total', {'cache': 'test', 'result': 'hit'})
+
+
+class MetricsTest(T.TestCase):
+
+    @T.setup_teardown
+    def mock_metrics(self):
+        with reset_metrics():
+            yield
+
+    def test_render_counter_and_histogram(self):
+        metrics.cache_lookup('test', True)
+        metrics.cache_lookup('test', True)
+        metrics.cache_lookup('test', False)
+        metrics.observe('pushmanager_db_query_duration_seconds', 0.02, {'call_site': 'a.b'})
+        metrics.observe('pushmanager_db_query_duration_seconds', 3, {'call_site': 'a.b'})
+
+        text = metrics.render()
+        T.assert_in('# TYPE pushmanager_cache_requests_total counter', text)
+        T.assert_in('pushmanager_cache_requests_total{cache="test",result="hit"} 2', text)
+        T.assert_in('pushmanager_cache_requests_total{cache="test",result="miss"} 1', text)
+        T.assert_in('# TYPE pushmanager_db_query_duration_seconds histogram', text)
+        T.assert_in('pushmanager_db_query_duration_seconds_bucket{call_site="a.b",le="0.01"} 0', text)
+        T.assert_in('pushmanager_db_query_duration_seconds_bucket{call_site="a.b",le="0.025"} 1', text)
+        T.assert_in('pushmanager_db_query_duration_seconds_bucket{call_site="a.b",le="5.0"} 2', text)
+        T.assert_in('pushmanager_db_query_duration_seconds_bucket{call_site="a.b",le="+Inf"} 2', text)
+        T.assert_in('pushmanager_db_query_duration_seconds_sum{call_site="a.b"} 3.02', text)
+        T.assert_in('pushmanager_db_query_duration_seconds_count{call_site="a.b"} 2', text)
+
+    def test_label_values_are_escaped(self):
+        metrics.cache_lookup('quote"back\\slash', True)
+        T.assert_in('cache="quote\\"back\\\\slash"', metrics.render())
+
+    def test_caller_name(self):
+        def execute():
+            return metrics.caller_name()
+        T.assert_equal(execute(), '%s.test_caller_name' % __name__)
+
+    def test_queue_depths(self):
+        queue = JoinableQueue()
+        metrics.register_queue('test', queue)
+        queue.put(1)
+        queue.put(2)
+        T.assert_equal(metrics.queue_depths(), {('pushmanager_queue_depth', (('queue', 'test'),)): 2})
+        T.assert_in('pushmanager_queue_depth{queue="test"} 2', metrics.render(metrics.queue_depths()))
+        queue.get()
+        queue.get()
+
+    def test_collect_merges_processes(self):
+        metrics.directory = tempfile.mkdtemp()
+        try:
+            metrics.cache_lookup('test', True)
+            metrics.observe('pushmanager_worker_task_duration_seconds', 1, {'queue': 'q'})
+
+            # Metrics of a forked child and of one that already exited
+            child = Process(target=record_in_child)
+            child.start()
+            child.join()
+            with open(os.path.join(metrics.directory, '1.json'), 'w') as metrics_file:
+                json.dump({
+                    'counters': [],
+                    'histograms': [[
+                        'pushmanager_worker_task_duration_seconds',
+                        [['queue', 'q']],
+                        [0] * len(metrics.BUCKETS) + [2, 1],
+                    ]],
+                }, metrics_file)
+
+            counters, histograms = metrics.collect()
+        finally:
+            shutil.rmtree(metrics.directory)
+
+        T.assert_equal(counters, {('pushmanager_cache_requests_total', (('cache', 'test'), ('result', 'hit'))): 2})
+        histogram = histograms[('pushmanager_worker_task_duration_seconds', (('queue', 'q'),))]
+        T.assert_equal(histogram[-2:], [3, 2])
+
+    def test_idle_workers_are_flushed(self):
+        metrics.directory = tempfile.mkdtemp()
+        metrics.flush_interval = 0.05
+        key = ('pushmanager_cache_requests_total', (('cache', 'test'), ('result', 'hit')))
+        done = Event()
+        child = Process(target=record_and_block, args=(done,))
+        try:
+            child.start()
+            deadline = time.time() + 5
+            while metrics.collect()[0].get(key) != 2 and time.time() < deadline:
+                time.sleep(0.01)
+            T.assert_equal(metrics.collect()[0].get(key), 2)
+
+            done.set()
+            child.join()
+            T.assert_equal(metrics.collect()[0].get(key), 3)
+        finally:
+            done.set()
+            shutil.rmtree(metrics.directory)
+
+    def test_flush_is_rate_limited(self):
+        metrics.directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(metrics.directory, '%d.json' % os.getpid())
+            metrics.cache_lookup('test', True)
+            T.assert_equal(os.path.exists(path), True)
+            os.unlink(path)
+            metrics.cache_lookup('test', True)
+            T.assert_equal(os.path.exists(path), False)
+            metrics.flush(force=True)
+            T.assert_equal(os.path.exists(path), True)
+        finally:
+            shutil.rmtree(metrics.directory)
+
+
+class MetricsServletTest(T.TestCase, ServletTestMixin):
+
+    @T.setup_teardown
+    def mock_metrics(self):
+        with reset_metrics():
+            yield
+
+    def get_handlers(self):
+        return [get_servlet_urlspec(MetricsServlet)]
+
+    def test_metrics_servlet(self):
+        metrics.register_queue('test', JoinableQueue())
+        self.fetch('/metrics')
+        response = self.fetch('/metrics')
+        T.assert_equal(response.code, 200)
+        T.assert_equal(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        T.assert_in('pushmanager_queue_depth{queue="test"} 0', response.body)
+        T.assert_in(
+            'pushmanager_http_request_duration_seconds_count{method="GET",servlet="MetricsServlet",status="200"} 1',
+            response.body
+        )
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import mock
+import testify as T
+from pushmanager.core import planner
+
+
+def make_request(request_id, state='pickme', tags='conflict-pickme', created=1000):
+    return {'id': request_id, 'state': state, 'tags': tags, 'created': created}
+
+
+class PlannerTest(T.TestCase):
+
+    def test_max_weight_conflict_free(self):
+        weights = dict((i, 1) for i in range(1, 6))
+        # 1 conflicts with 2 and 3, 4 with 5
+        conflicts = [(1, 2), (1, 3), (4, 5)]
+        chosen = planner.max_weight_conflict_free(range(1, 6), weights, conflicts)
+        T.assert_equal(len(chosen), 3)
+        T.assert_equal(chosen & set([2, 3]), set([2, 3]))
+        T.assert_equal(len(chosen & set([4, 5])), 1)
+
+        weights[1] = 3
+        T.assert_in(1, planner.max_weight_conflict_free(range(1, 6), weights, conflicts))
+
+    def test_large_components_are_solved_greedily(self):
+        # A path 1 - 2 - ... - 30, every other request can be kept
+        nodes = range(1, 31)
+        conflicts = zip(nodes, nodes[1:])
+        weights = dict((node, 1) for node in nodes)
+        with mock.patch.object(planner, '_exact_independent_set') as exact:
+            chosen = planner.max_weight_conflict_free(nodes, weights, conflicts)
+            T.assert_equal(exact.call_count, 0)
+        T.assert_equal(len(chosen), 15)
+        for left, right in conflicts:
+            T.assert_equal(left in chosen and right in chosen, False)
+
+    def test_plan_push(self):
+        requests = [
+            make_request(1, state='added', tags='no-conflicts'),
+            make_request(2),
+            make_request(3, created=900),
+            make_request(4),
+            make_request(5, tags='conflict-master'),
+            make_request(6, tags='no-conflicts', created=800),
+        ]
+        # 2 conflicts with the added request, 3 and 4 with each other
+        plan = planner.plan_push(requests, [(1, 2), (3, 4), (4, 99)])
+        T.assert_equal(plan['accept'], [6, 3])
+        T.assert_equal(plan['excluded'], [
+            {'id': 2, 'reason': 'conflict-added', 'conflicts': [1]},
+            {'id': 4, 'reason': 'conflict-pickme', 'conflicts': [3]},
+            {'id': 5, 'reason': 'conflict-master', 'conflicts': []},
+        ])
+
+    def test_plan_push_weights(self):
+        requests = [
+            make_request(1, tags='conflict-pickme,urgent', created=500000),
+            make_request(2, created=0),
+            make_request(3, created=0),
+        ]
+        conflicts = [(1, 2), (1, 3)]
+        T.assert_equal(planner.plan_push(requests, conflicts)['accept'], [2, 3])
+        T.assert_equal(planner.plan_push(requests, conflicts, 'urgent')['accept'], [1])
+
+        # A week old pickme outweighs two of a day
+        requests[0]['created'] = 0
+        requests[1]['created'] = requests[2]['created'] = 6 * 86400
+        T.assert_equal(planner.plan_push(requests, conflicts, 'age', now=7 * 86400)['accept'], [1])
+
+        T.assert_raises(ValueError, planner.plan_push, requests, conflicts, 'size')
+
+
+if __name__ == '__main__':
+    T.run()
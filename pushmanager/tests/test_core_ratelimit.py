@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+import mock
+import testify as T
+from pushmanager.core.ratelimit import AdaptiveThrottle
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class AdaptiveThrottleTest(T.TestCase):
+
+    @T.setup_teardown
+    def mock_clock(self):
+        self.clock = FakeClock()
+        with mock.patch('pushmanager.core.ratelimit.time', self.clock):
+            yield
+
+    def test_burst_then_rate(self):
+        throttle = AdaptiveThrottle('test', 2, burst=3)
+        for _ in range(3):
+            throttle.acquire()
+        T.assert_equal(self.clock.slept, [])
+
+        throttle.acquire()
+        T.assert_equal(self.clock.slept, [0.5])
+
+        # Idle time refills the bucket, but never beyond the burst size
+        self.clock.now += 60
+        for _ in range(3):
+            throttle.acquire()
+        T.assert_equal(self.clock.slept, [0.5])
+
+    def test_disabled(self):
+        throttle = AdaptiveThrottle('test', 0)
+        for _ in range(100):
+            with throttle.throttled():
+                pass
+        T.assert_equal(self.clock.slept, [])
+
+    def test_backoff_and_recovery(self):
+        throttle = AdaptiveThrottle('test', 10, min_rate=2, latency_target=1)
+        throttle.failure()
+        T.assert_equal(throttle.rate, 5)
+        throttle.success(5)
+        T.assert_equal(throttle.rate, 2.5)
+        throttle.failure()
+        T.assert_equal(throttle.rate, 2)
+
+        for _ in range(20):
+            throttle.success(0.1)
+        T.assert_equal(throttle.rate, 10)
+
+    def test_throttled_records_failures(self):
+        throttle = AdaptiveThrottle('test', 10)
+
+        def fail():
+            with throttle.throttled():
+                raise ValueError()
+
+        T.assert_raises(ValueError, fail)
+        T.assert_equal(throttle.rate, 5)
+
+        with throttle.throttled():
+            pass
+        T.assert_equal(throttle.rate, 6)
+
+    def test_from_settings(self):
+        throttle = AdaptiveThrottle.from_settings(
+            'test',
+            {'rate': 4, 'burst': 2, 'min_rate': None, 'latency_target': None}
+        )
+        T.assert_equal(throttle.max_rate, 4)
+        T.assert_equal(throttle.burst, 2)
+        T.assert_equal(throttle.min_rate, 0.4)
+
+        # Without a latency target slow calls are fine
+        throttle.success(600)
+        T.assert_equal(throttle.rate, 4)
+
+
+if __name__ == '__main__':
+    T.run()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import httplib
+import json
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+import mock
+import testify as T
+from pushmanager.core.rb import ReviewBoardClient
+
+
+class FakeReviewBoardServer(ThreadingMixIn, HTTPServer):
+    """Speaks just enough of the ReviewBoard API for ReviewBoardClient."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeReviewBoardHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        # Number of requests to answer with an error before succeeding
+        self.failures = 0
+        # Set to hold requests until released
+        self.release = threading.Event()
+        self.release.set()
+
+    @property
+    def servername(self):
+        return '%s:%d' % self.server_address
+
+
+class FakeReviewBoardHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.release.wait()
+        with self.server.lock:
+            self.server.requests.append((self.path, body, self.headers['Authorization']))
+            fail = self.server.failures > 0
+            self.server.failures -= 1
+
+        if fail:
+            status, result = 500, {'stat': 'fail'}
+        else:
+            status, result = 200, {'stat': 'ok'}
+        response = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class ReviewBoardClientTest(T.TestCase):
+
+    @T.setup_teardown
+    def start_server(self):
+        self.server = FakeReviewBoardServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        yield
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_client(self, **kwargs):
+        client = ReviewBoardClient(
+            self.server.servername, 'user', 'pass',
+            connection_class=httplib.HTTPConnection,
+            **kwargs
+        )
+        client.start()
+        return client
+
+    def test_connections_are_reused(self):
+        client = self.make_client(concurrency=2)
+        done = []
+        for review_id in range(10):
+            client.submit(review_id, lambda review_id, success: done.append(success))
+        client.join()
+
+        T.assert_equal(done, [True] * 10)
+        T.assert_equal(
+            sorted(path for path, _, _ in self.server.requests),
+            sorted('/api/review-requests/%d/' % review_id for review_id in range(10))
+        )
+        T.assert_equal(self.server.requests[0][1], 'status=submitted')
+        T.assert_equal(self.server.requests[0][2], 'Basic dXNlcjpwYXNz')
+        T.assert_lte(self.server.connections, 2)
+        T.assert_equal(client.stats['submitted'], 10)
+
+    def test_duplicates_are_dropped(self):
+        self.server.release.clear()
+        client = self.make_client()
+        T.assert_equal(client.submit(1), True)
+        T.assert_equal(client.submit(1), False)
+        T.assert_equal(client.submit(2), True)
+        self.server.release.set()
+        client.join()
+
+        T.assert_equal(len(self.server.requests), 2)
+        T.assert_equal(client.stats['duplicates'], 1)
+
+    def test_retries_with_backoff(self):
+        self.server.failures = 2
+        client = self.make_client(retries=2, retry_backoff=0.5)
+        with mock.patch('pushmanager.core.rb.time.sleep') as sleep:
+            T.assert_equal(client.mark_review_as_submitted(1), True)
+            sleep.assert_has_calls([mock.call(0.5), mock.call(1.0)])
+        T.assert_equal(len(self.server.requests), 3)
+        T.assert_equal(client.stats['retried'], 2)
+
+    def test_gives_up(self):
+        self.server.failures = 5
+        client = self.make_client(retries=1, retry_backoff=0)
+        with mock.patch('pushmanager.core.rb.logging') as logging:
+            T.assert_equal(client.mark_review_as_submitted(1), False)
+            T.assert_equal(logging.error.call_count, 1)
+        T.assert_equal(len(self.server.requests), 2)
+        T.assert_equal(client.stats['failed'], 1)
+
+    def test_reconnects_closed_connection(self):
+        client = self.make_client()
+        T.assert_equal(client.mark_review_as_submitted(1), True)
+        # The server dropped the kept-alive connection in the meantime
+        client.local.connection.sock.close()
+        T.assert_equal(client.mark_review_as_submitted(2), True)
+        T.assert_equal(client.stats['retried'], 0)
+        T.assert_equal(self.server.connections, 2)
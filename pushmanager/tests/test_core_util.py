@@ -13,6 +13,10 @@ from pushmanager.core.util import dict_copy_keys
 from pushmanager.core.util import EscapedDict
 from pushmanager.core.util import get_servlet_urlspec
 from pushmanager.core.util import pretty_date
+from pushmanager.core.util import request_fields
+from pushmanager.core.util import REQUEST_FIELDS
+from pushmanager.core.util import REQUEST_SUMMARY_FIELDS
+from pushmanager.core.util import requests_to_jsonable
 from pushmanager.core.util import tags_contain
 from pushmanager.core.util import tags_str_as_set
 from pushmanager.core.util import send_people_msg_in_groups
@@ -111,6 +115,22 @@ class CoreUtilFunctionsTest(T.TestCase):
         T.assert_equal(to_dict['c']['x'], from_dict['c']['x'])
         T.assert_equal(to_dict['c'].get('y', None), None)
 
+    def test_request_fields(self):
+        T.assert_equal(request_fields(), REQUEST_FIELDS)
+        T.assert_equal(request_fields('all'), REQUEST_FIELDS)
+        T.assert_equal(request_fields('summary'), REQUEST_SUMMARY_FIELDS)
+        T.assert_not_in('comments', REQUEST_SUMMARY_FIELDS)
+        T.assert_equal(request_fields('title, state'), ('id', 'state', 'title'))
+        T.assert_equal(request_fields('title', required=('state',)), ('state', 'title'))
+        T.assert_raises(ValueError, request_fields, 'title,changed')
+
+    def test_requests_to_jsonable(self):
+        rows = [(1, 'pickme', 'Fix stuff'), (2, 'added', 'Fix more')]
+        T.assert_equal(requests_to_jsonable(rows, ('id', 'state', 'title')), [
+            {'id': 1, 'state': 'pickme', 'title': 'Fix stuff'},
+            {'id': 2, 'state': 'added', 'title': 'Fix more'},
+        ])
+
     def test_send_people_msg_in_groups_split(self):
         people = ['111', '222', '333', '444', '555', '666']
         msg = 'Hello World!'
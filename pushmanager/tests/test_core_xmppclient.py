@@ -4,6 +4,7 @@ from contextlib import nested
 import copy
 import mock
 import testify as T
+from Queue import Empty
 
 from pushmanager.core.settings import Settings
 import pushmanager.core.xmppclient
@@ -55,44 +56,93 @@ class CoreXMPPClientTest(T.TestCase):
             pushmanager.core.xmppclient.XMPPQueue._xmpp_check_and_reconnect(jabber_client)
             T.assert_equal(jabber_client.reconnectAndReauth.call_count, 1)
 
-    def test_process_queue_item_successful(self):
+    @contextmanager
+    def fake_message_queue(self, messages):
+        self.MockedSettings['xmpp']['batch_size'] = 10
+        self.MockedSettings['xmpp']['coalesce_window'] = 0
+        self.MockedSettings['aliases'] = {'alias@example.com': 'testuser@example.com'}
+        queue = list(messages)
+        self.delivered = 0
+
+        def get(*args):
+            if not queue:
+                raise Empty()
+            self.delivered += 1
+            return queue.pop(0)
+
         with nested(
+            mock.patch("%s.pushmanager.core.xmppclient.logging" % __name__),
             mock.patch("%s.pushmanager.core.xmppclient.xmpp.Message" % __name__),
-            mock.patch("%s.pushmanager.core.xmppclient.XMPPQueue.message_queue" % __name__)
+            mock.patch("%s.pushmanager.core.xmppclient.XMPPQueue.message_queue" % __name__),
+            mock.patch.dict(pushmanager.core.xmppclient.Settings, self.MockedSettings),
         ):
+            message_queue = pushmanager.core.xmppclient.XMPPQueue.message_queue
+            message_queue.get.side_effect = get
+            message_queue.get_nowait.side_effect = get
+            message_queue.put.side_effect = queue.append
+            yield queue
+
+    def test_process_queue_batch_successful(self):
+        with self.fake_message_queue([
+            ('testuser@example.com', "Fake Message"),
+            ('otheruser@example.com', "Other Message"),
+        ]):
             jabber_client = mock.MagicMock()
-            pushmanager.core.xmppclient.XMPPQueue.message_queue.configure_mock(**self.fake_queue_attrs)
 
-            pushmanager.core.xmppclient.XMPPQueue._process_queue_item(jabber_client)
+            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue._process_queue_batch(jabber_client, 1), True)
 
-            T.assert_equal(jabber_client.send.call_count, 1)
-            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.get.call_count, 1)
+            T.assert_equal(jabber_client.send.call_count, 2)
             T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.put.call_count, 0)
-            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.task_done.call_count, 1)
+            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.task_done.call_count, 2)
 
-    def test_process_queue_item_retry(self):
-        def raise_ioerror(*args):
-            raise IOError("Fake IOError")
-
-        with nested(
-            mock.patch("%s.pushmanager.core.xmppclient.logging" % __name__),
-            mock.patch("%s.pushmanager.core.xmppclient.xmpp.Message" % __name__),
-            mock.patch("%s.pushmanager.core.xmppclient.XMPPQueue.message_queue" % __name__)
-        ):
+    def test_process_queue_batch_empty(self):
+        with self.fake_message_queue([]):
             jabber_client = mock.MagicMock()
-            jabber_client.send.side_effect = raise_ioerror
-            pushmanager.core.xmppclient.XMPPQueue.message_queue.configure_mock(**self.fake_queue_attrs)
-
-            # Try sending the same message more than max_retry_count
-            retry_count = pushmanager.core.xmppclient.XMPPQueue.MAX_RETRY_COUNT
+            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue._process_queue_batch(jabber_client, 1), True)
+            T.assert_equal(jabber_client.send.call_count, 0)
+            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.task_done.call_count, 0)
+
+    def test_coalesce(self):
+        with self.fake_message_queue([]):
+            T.assert_equal(
+                pushmanager.core.xmppclient.XMPPQueue._coalesce([
+                    ('testuser@example.com', "First", 0),
+                    ('otheruser@example.com', "Other", 0),
+                    ('alias@example.com', "Second", 1),
+                    ('testuser@example.com', "First", 0),
+                ]),
+                [
+                    ('testuser@example.com', "First\n\nSecond", 1),
+                    ('otheruser@example.com', "Other", 0),
+                ]
+            )
+
+    def test_process_queue_batch_retry(self):
+        with self.fake_message_queue([
+            ('testuser@example.com', "Fake Message"),
+            ('otheruser@example.com', "Other Message"),
+        ]) as queue:
+            jabber_client = mock.MagicMock()
+            jabber_client.send.side_effect = IOError("Fake IOError")
 
-            for _ in range(retry_count):
-                pushmanager.core.xmppclient.XMPPQueue._process_queue_item(jabber_client)
+            # The failed message is retried, the one after it is put back as is
+            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue._process_queue_batch(jabber_client, 1), False)
+            T.assert_equal(queue, [
+                ('testuser@example.com', "Fake Message", 1),
+                ('otheruser@example.com', "Other Message", 0),
+            ])
 
-            T.assert_equal(jabber_client.send.call_count, retry_count)
-            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.get.call_count, retry_count)
-            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.task_done.call_count, retry_count)
-            T.assert_equal(pushmanager.core.xmppclient.XMPPQueue.message_queue.put.call_count, retry_count - 1)
+            # Try sending the same messages more than max_retry_count
+            retry_count = pushmanager.core.xmppclient.XMPPQueue.MAX_RETRY_COUNT
+            for _ in range(retry_count * 2):
+                pushmanager.core.xmppclient.XMPPQueue._process_queue_batch(jabber_client, 1)
+
+            T.assert_equal(queue, [])
+            T.assert_equal(jabber_client.send.call_count, retry_count * 2)
+            T.assert_equal(
+                pushmanager.core.xmppclient.XMPPQueue.message_queue.task_done.call_count,
+                self.delivered
+            )
 
     def test_enqueue_user_xmpp_with_string(self):
         fake_domain = "fakedomain.com"
@@ -66,8 +66,9 @@ class AddRequestServletTest(T.TestCase, ServletTestMixin):
         num_results_after = len(self.results)
         T.assert_equal(num_results_after, num_results_before + 1, "Add new request failed.")
 
+    @mock.patch('pushmanager.core.db.refresh_dashboards')
     @mock.patch('pushmanager.core.db.execute_transaction_cb')
-    def test_pushcontent_insert_ignore(self, mock_transaction):
+    def test_pushcontent_insert_ignore(self, mock_transaction, _):
         request = {'request': 1, 'push': 1}
         response = self.fetch(
             '/addrequest',
@@ -1,7 +1,11 @@
 import json
 import time
 
+import mock
 import testify as T
+from pushmanager.core import db
+from pushmanager.core import util
+from pushmanager.core.git import compress_conflict_output
 from pushmanager.core.util import get_servlet_urlspec
 from pushmanager.servlets.api import APIServlet
 from pushmanager.testing.testdb import FakeDataMixin
@@ -22,10 +26,90 @@ class APITests(T.TestCase, ServletTestMixin, FakeDataMixin):
         results = self.api_call("userlist")
         T.assert_equal(results, ['bmetin', "otheruser"])
 
+    def test_userdashboard(self):
+        dashboard = self.api_call("userdashboard?user=bmetin")
+        T.assert_equal(dashboard['requested'], 1)
+        T.assert_equal(dashboard['pickme'], 1)
+        T.assert_equal(dashboard['accepting_push'], 1)
+
+        dashboard = self.api_call("userdashboard?user=nobody")
+        T.assert_equal(dashboard['requested'], 0)
+        T.assert_equal(dashboard['accepting_push'], None)
+
     def test_request(self):
         results = self.api_call("request?id=1")
         T.assert_equal(results['title'], "Fix stuff")
 
+    def test_request_fields(self):
+        request = self.api_call("request?id=1&fields=summary")
+        T.assert_equal(sorted(request), sorted(util.REQUEST_SUMMARY_FIELDS))
+
+        request = self.api_call("request?id=1&fields=description,comments")
+        T.assert_equal(sorted(request), ['comments', 'description', 'id'])
+        T.assert_in('This branch fixes stuff.', request['description'])
+
+        push_info, contents, requests = self.api_call("pushdata?id=1&fields=title")
+        T.assert_equal(sorted(contents['all'][0]), ['id', 'state', 'title'])
+        T.assert_equal(sorted(requests[0]), ['id', 'state', 'title'])
+
+        requests, _ = self.api_call("requestsearch?state=requested&fields=summary&count=1")
+        T.assert_not_in('comments', requests[0])
+
+        response = self.fetch("/api/requestsearch?state=requested&fields=title,password")
+        T.assert_equal(response.code, 400)
+
+    def test_requestcomments(self):
+        def on_db_return(success, db_results):
+            assert success
+        db.execute_transaction_cb([
+            db.push_requestcomments.insert({
+                'request': 1, 'user': 'pm', 'comment': 'comment %d' % i, 'created': i
+            })
+            for i in range(5)
+        ] + db.search_index_queries(1), on_db_return)
+
+        comments = self.api_call("requestcomments?id=1")
+        T.assert_equal([c['comment'] for c in comments], ['comment %d' % i for i in range(5)])
+
+        latest = self.api_call("requestcomments?id=1&limit=2")
+        T.assert_equal([c['comment'] for c in latest], ['comment 3', 'comment 4'])
+        older = self.api_call("requestcomments?id=1&limit=2&before=%d" % latest[0]['id'])
+        T.assert_equal([c['comment'] for c in older], ['comment 1', 'comment 2'])
+
+        # Limits are clamped, -1 would mean no limit at all to SQLite
+        with mock.patch.object(APIServlet, 'MAX_COMMENTS', 3):
+            T.assert_equal(len(self.api_call("requestcomments?id=1&limit=-1")), 1)
+            T.assert_equal(len(self.api_call("requestcomments?id=1&limit=100")), 3)
+
+        T.assert_equal(self.api_call("requestcomments?id=2"), [])
+
+        # Comments are searchable along with the request
+        requests = self.api_call("search?q=comment")
+        T.assert_in(1, [request['id'] for request in requests])
+
+    def test_archive(self):
+        db.execute_transaction_cb([
+            db.push_requests_archive.insert({
+                'id': 50, 'user': 'retired', 'state': 'live', 'title': 'Old fix', 'created': 1, 'modified': 1,
+            }),
+            db.push_pushcontents_archive.insert({'request': 50, 'push': 1}),
+        ], lambda *args: None)
+
+        T.assert_equal(self.fetch("/api/request?id=50").code, 404)
+        T.assert_equal(self.api_call("request?id=50&archive=1")['title'], 'Old fix')
+        # As request.js loads the details of archived requests on the push page
+        details = self.api_call("request?id=50&fields=conflicts,description,comments&archive=1")
+        T.assert_equal(details['id'], 50)
+
+        T.assert_equal(len(self.api_call("pushcontents?id=1")), 1)
+        T.assert_equal(len(self.api_call("pushcontents?id=1&archive=1")), 2)
+
+        T.assert_not_in('retired', self.api_call("userlist"))
+        T.assert_in('retired', self.api_call("userlist?archive=1"))
+
+        requests, count = self.api_call("requestsearch?user=retired&count=1&archive=1")
+        T.assert_equal(([request['id'] for request in requests], count), ([50], 1))
+
     def test_push(self):
         results = self.api_call("push?id=1")
         T.assert_equal(results['pushtype'], "regular")
@@ -36,6 +120,37 @@ class APITests(T.TestCase, ServletTestMixin, FakeDataMixin):
         T.assert_length(contents, 2)
         T.assert_equal(requests[0]['state'], "requested")
 
+    def test_conflictplan(self):
+        db.execute_cb(db.push_conflictpairs.insert({'push': 1, 'request': 1, 'other': 3}), lambda *args: None)
+        plan = self.api_call("conflictplan?id=1&weight=urgent")
+        T.assert_equal(plan, {'push': 1, 'weight': 'urgent', 'accept': [1], 'excluded': []})
+
+        response = self.fetch("/api/conflictplan?id=1&weight=size")
+        T.assert_equal(response.code, 400)
+
+    def test_deploysteps(self):
+        db.execute_cb(db.push_deploysteps.insert({
+            'push': 1, 'position': 0, 'request': 2, 'revision': '1' * 40, 'base': '0' * 40, 'sha': None,
+        }), lambda *args: None)
+        steps = self.api_call("deploysteps?id=1")
+        T.assert_equal([(step['request'], step['sha']) for step in steps], [(2, None)])
+
+    def test_conflictdetails(self):
+        for other, output in ((0, 'CONFLICT in master'), (2, 'CONFLICT (content): Merge conflict in a.py')):
+            compressed, size = compress_conflict_output(output, 10)
+            db.execute_cb(db.push_conflictdetails.insert({
+                'request': 1, 'revision': '1' * 40, 'other': other, 'output': compressed, 'size': size,
+            }), lambda *args: None)
+
+        details = self.api_call("conflictdetails?id=1")
+        T.assert_equal([(d['other'], d['output'], d['truncated']) for d in details], [
+            (0, 'CONFLICT i', True),
+            (2, 'CONFLICT (', True),
+        ])
+        details = self.api_call("conflictdetails?id=1&other=0")
+        T.assert_equal([d['other'] for d in details], [0])
+        T.assert_equal(self.api_call("conflictdetails?id=2"), [])
+
     def test_pushes(self):
         pushes, pushes_count = self.api_call("pushes")
         T.assert_length(pushes, 2)
@@ -105,6 +220,28 @@ class APITests(T.TestCase, ServletTestMixin, FakeDataMixin):
         pushitems = self.api_call("pushitems?push_id=1")
         T.assert_length(pushitems, 0)
 
+    def test_pushitemcomments(self):
+        def on_db_return(success, db_results):
+            assert success
+        db.execute_transaction_cb([
+            db.push_requests.update().where(db.push_requests.c.id == 2).values({'state': 'added'}),
+            db.push_pushcontents.insert({'request': 2, 'push': 1}),
+        ] + [
+            db.push_requestcomments.insert({
+                'request': request_id, 'user': 'pm', 'comment': 'comment %d' % i, 'created': i
+            })
+            for request_id in (1, 2)
+            for i in range(3)
+        ], on_db_return)
+
+        # Pickmes are left out, as by pushitems
+        comments = self.api_call("pushitemcomments?push_id=1&limit=2")
+        T.assert_equal(comments.keys(), ['2'])
+        T.assert_equal([c['comment'] for c in comments['2']], ['comment 1', 'comment 2'])
+
+        T.assert_equal(self.api_call("pushitemcomments?push_id=1&limit=2&archive=1"), comments)
+        T.assert_equal(self.api_call("pushitemcomments?push_id=2"), {})
+
     def test_requestsearch(self):
         requests = self.api_call("requestsearch?mbefore=%d" % time.time())
         T.assert_length(requests, 3)
@@ -133,6 +270,58 @@ class APITests(T.TestCase, ServletTestMixin, FakeDataMixin):
         requests = self.api_call("requestsearch?title=fix&limit=1")
         T.assert_length(requests, 1)
 
+    def test_requestsearch_tags(self):
+        requests = self.api_call("requestsearch?tag=buildbot")
+        T.assert_length(requests, 3)
+
+        requests = self.api_call("requestsearch?tag=plans&tag=urgent")
+        T.assert_equal([request['id'] for request in requests], [2])
+
+        requests = self.api_call("requestsearch?tag=build")
+        T.assert_length(requests, 0)
+
+    def test_requestsearch_sort_and_offset(self):
+        requests = self.api_call("requestsearch?state=requested&state=pickme")
+        T.assert_equal([request['id'] for request in requests], [3, 2, 1])
+
+        requests = self.api_call("requestsearch?state=requested&state=pickme&sort=user")
+        T.assert_equal([request['id'] for request in requests], [1, 2, 3])
+
+        requests = self.api_call("requestsearch?state=requested&state=pickme&sort=-modified&limit=1&offset=1")
+        T.assert_equal([request['id'] for request in requests], [2])
+
+        response = self.fetch("/api/requestsearch?state=requested&sort=comments")
+        T.assert_equal(response.code, 400)
+
+    def test_requestsearch_count(self):
+        requests, requests_count = self.api_call("requestsearch?state=requested&limit=1&count=1")
+        T.assert_length(requests, 1)
+        T.assert_equal(requests_count, 2)
+
+    def test_requestsearch_conflicts(self):
+        requests = self.api_call("requestsearch?state=requested&conflicts=no")
+        T.assert_length(requests, 2)
+
+        requests = self.api_call("requestsearch?state=requested&conflicts=yes")
+        T.assert_length(requests, 0)
+
     def test_requestsearch_when_user_and_repo_are_different(self):
         requests = self.api_call("requestsearch?user=otheruser&repo=testuser&branch=testuser_important_fixes")
         T.assert_length(requests, 1)
+
+    def test_search(self):
+        requests = self.api_call("search?q=important")
+        T.assert_equal([request['id'] for request in requests], [2])
+
+        # Matches the title of 2 and the description of 1
+        requests = self.api_call("search?q=fixes")
+        T.assert_equal([request['id'] for request in requests], [2, 1])
+
+        requests = self.api_call("search?q=fixes&limit=1")
+        T.assert_equal([request['id'] for request in requests], [2])
+
+        requests = self.api_call("search?q=%22stuff%20OR%20things%22")
+        T.assert_length(requests, 0)
+
+        response = self.fetch("/api/search?q=")
+        T.assert_equal(response.code, 400)
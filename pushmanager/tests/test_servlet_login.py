@@ -51,7 +51,12 @@ class LoginTest(T.TestCase, ServletTestMixin):
         MockedSettings['login_strategy'] = 'saml'
         with nested(mock.patch.object(logging, "exception"),
                     mock.patch.dict(Settings, MockedSettings)):
-            with mock.patch("pushmanager.handlers.LoginHandler._saml_login") as mock_saml_login:
+            # post is asynchronous, the stub has to finish the request
+            with mock.patch(
+                "pushmanager.handlers.LoginHandler._saml_login",
+                autospec=True,
+                side_effect=lambda handler: handler.redirect('/'),
+            ) as mock_saml_login:
 
                 request = {}
                 self.fetch(
@@ -102,6 +102,42 @@ class NewRequestServletTest(T.TestCase, ServletTestMixin, FakeDataMixin):
         basic_request.update({'user': 'testuser'})
         self.assert_request(basic_request, last_req)
 
+    def search_requests(self, terms):
+        results = []
+
+        def on_db_return(success, db_results):
+            assert success
+            results.extend(request['id'] for request in db_results)
+
+        db.execute_cb(db.search_requests_query(terms, 10), on_db_return)
+        return results
+
+    def test_newrequest_updates_search_index(self):
+        last_req = self.assert_submit_request(self.basic_request)
+        T.assert_equal(self.search_requests('approve'), [last_req['id']])
+
+        edited_request = dict(self.basic_request)
+        edited_request.update({
+            'request-id': last_req['id'],
+            'request-user': 'testuser',
+            'request-description': 'I reject this fix!',
+        })
+        self.assert_submit_request(edited_request, edit=True)
+        T.assert_equal(self.search_requests('approve'), [])
+        T.assert_equal(self.search_requests('reject'), [last_req['id']])
+
+    def test_search_index_updated_with_request(self):
+        # Indexed along with the request, not with its checklist
+        with mock.patch.object(
+            NewRequestServlet,
+            'on_existing_checklist_retrieved',
+            autospec=True,
+            side_effect=lambda handler, success, db_results: handler.send_error(500),
+        ):
+            response = self.fetch("/newrequest", method="POST", body=urllib.urlencode(self.basic_request))
+            T.assert_equal(response.code, 500)
+        T.assert_equal(self.search_requests('approve'), [self.get_requests()[-1]['id']])
+
     def test_strip_new_repo_branch(self):
         req_with_whitespace = dict(self.basic_request)
         req_with_whitespace['request-repo'] = ' testuser   '
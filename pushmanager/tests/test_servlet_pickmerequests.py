@@ -60,6 +60,22 @@ class PickMeRequestServletTest(T.TestCase, ServletTestMixin):
 
             T.assert_equal(num_contents_before + 1, num_contents_after)
 
+    def test_pickmerequest_updates_dashboard(self):
+        dashboards = []
+
+        def on_db_return(success, db_results):
+            assert success
+            dashboards.extend(db_results.fetchall())
+
+        with self.fake_pickme_request():
+            response = self.fetch("/pickmerequest?push=1&request=2")
+            T.assert_equal(response.error, None)
+
+            db.execute_cb(db.push_userdashboard.select(db.push_userdashboard.c.user == 'bmetin'), on_db_return)
+            T.assert_equal(dashboards[0]['requested'], 0)
+            T.assert_equal(dashboards[0]['pickme'], 2)
+            T.assert_equal(dashboards[0]['accepting_push'], 1)
+
     def test_pushcontents_duplicate_key(self):
         with self.fake_pickme_request_ignore_error():
             # push_pushcontents table should define a multi column
@@ -29,14 +29,25 @@ class PushsItemsServletTest(T.TestCase, ServletTestMixin):
             "reviewid": 10,
             "id": 1
         }
-        self.fake_requests_response = "[%s]" % json.dumps(self.fake_request_data)
+        self.fake_comments = {
+            "1": [{"id": 3, "request": 1, "user": "pm", "comment": "Merged, thanks", "created": 1346458700}],
+        }
+        self.api_responses = {
+            "pushitems": "[%s]" % json.dumps(self.fake_request_data),
+            "pushitemcomments": json.dumps(self.fake_comments),
+        }
+
+    def mocked_api_call(self, method, arguments, callback):
+        self.api_method = method
+        return super(PushsItemsServletTest, self).mocked_api_call(method, arguments, callback)
 
     def test_pushitems(self):
         with contextlib.nested(
             mock.patch.object(PushItemsServlet, "get_current_user", return_value=self.fake_request_data["user"]),
             mock.patch.object(PushItemsServlet, "async_api_call", side_effect=self.mocked_api_call),
-            mock.patch.object(self, "api_response", return_value=self.fake_requests_response)
+            mock.patch.object(self, "api_response", side_effect=lambda: self.api_responses[self.api_method])
         ):
             self.fetch("/pushitems?push=%d" % self.fake_request_data["id"])
             response = self.wait()
             T.assert_in(self.fake_request_data["title"], response.body)
+            T.assert_in("Merged, thanks", response.body)
@@ -0,0 +1,100 @@
+import contextlib
+import json
+
+import lxml.html
+
+import mock
+import testify as T
+from pushmanager.core.util import get_servlet_urlspec
+from pushmanager.servlets.requests import RequestsServlet
+from pushmanager.testing.testdb import FakeDataMixin
+from pushmanager.testing.testservlet import ServletTestMixin
+
+
+class RequestsServletTest(T.TestCase, ServletTestMixin, FakeDataMixin):
+
+    def get_handlers(self):
+        return [
+            get_servlet_urlspec(RequestsServlet),
+        ]
+
+    @T.setup_teardown
+    def mock_api(self):
+        with contextlib.nested(
+            mock.patch.object(RequestsServlet, "get_current_user", return_value="testuser"),
+            mock.patch.object(RequestsServlet, "async_api_call", side_effect=self.mocked_api_call),
+            mock.patch.object(self, "api_response", side_effect=lambda: self.api_responses[self.api_method]),
+        ):
+            self.api_responses = {}
+            yield
+
+    def mocked_api_call(self, method, arguments, callback):
+        self.api_method = method
+        return super(RequestsServletTest, self).mocked_api_call(method, arguments, callback)
+
+    def set_api_requests(self, request_ids, requests_count):
+        requests = [
+            self.make_request_dict(data)
+            for data in self.request_data if data[0] in request_ids
+        ]
+        self.api_responses['requestsearch'] = json.dumps([requests, requests_count])
+
+    def get_request_ids(self, body):
+        root = lxml.html.fromstring(body)
+        return [int(elt.get('requestid')) for elt in root.xpath("//li[@class='request']")]
+
+    def test_open_requests(self):
+        self.set_api_requests([10, 11], 3)
+        self.fetch("/requests?max=2&repo=bmetin&conflicts=no&age=7&sort=user")
+        response = self.wait()
+        T.assert_equal(response.error, None)
+
+        _, arguments = RequestsServlet.async_api_call.call_args[0][:2]
+        T.assert_equal(arguments['state'], 'requested')
+        T.assert_equal(arguments['limit'], 2)
+        T.assert_equal(arguments['offset'], 0)
+        T.assert_equal(arguments['count'], 1)
+        T.assert_equal(arguments['repo'], 'bmetin')
+        T.assert_equal(arguments['conflicts'], 'no')
+        T.assert_equal(arguments['sort'], 'user')
+        T.assert_in('cafter', arguments)
+
+        T.assert_equal(self.get_request_ids(response.body), [10, 11])
+        root = lxml.html.fromstring(response.body)
+        T.assert_equal(root.xpath("//span[@class='request-count']")[0].text, '3 requests')
+        T.assert_equal(root.xpath("//button[@id='load-more-requests']")[0].get('offset'), '2')
+
+    def test_load_more(self):
+        self.set_api_requests([12], 3)
+        self.fetch("/requests?max=2&offset=2&fragment=1")
+        response = self.wait()
+        T.assert_equal(response.error, None)
+
+        _, arguments = RequestsServlet.async_api_call.call_args[0][:2]
+        T.assert_equal(arguments['offset'], 2)
+        T.assert_equal(self.get_request_ids('<ul>%s</ul>' % response.body), [12])
+        T.assert_not_in('<html', response.body)
+        T.assert_not_in('load-more-requests', response.body)
+
+    def test_user_requests(self):
+        self.set_api_requests([11], 1)
+        self.api_responses['userdashboard'] = json.dumps({
+            'user': 'bmetin', 'requested': 1, 'pickme': 2, 'added': 0, 'staged': 0,
+            'verified': 0, 'blessed': 0, 'delayed': 0, 'accepting_push': 7, 'modified': 0,
+        })
+        self.fetch("/requests?user=bmetin")
+        response = self.wait()
+        T.assert_equal(response.error, None)
+
+        (_, search_arguments), (_, dashboard_arguments) = [
+            call[0][:2] for call in RequestsServlet.async_api_call.call_args_list
+        ]
+        T.assert_equal(search_arguments['user'], 'bmetin')
+        T.assert_not_in('state', search_arguments)
+        T.assert_equal(dashboard_arguments, {'user': 'bmetin'})
+        T.assert_equal(self.get_request_ids(response.body), [11])
+        root = lxml.html.fromstring(response.body)
+        T.assert_equal(root.xpath("//button[@id='load-more-requests']"), [])
+        dashboard = root.xpath("//span[@class='request-dashboard']")[0]
+        T.assert_in('1 requested, 2 pickme', dashboard.text)
+        T.assert_equal(dashboard.xpath("a")[0].get('href'), '/push?id=7')
@@ -0,0 +1,32 @@
+import mock
+import testify as T
+from pushmanager.core import db
+from pushmanager.servlets.smartdest import SmartDestServlet
+from pushmanager.testing.testservlet import ServletTestMixin
+
+
+class SmartDestServletTest(T.TestCase, ServletTestMixin):
+
+    def get_handlers(self):
+        return [(r'/', SmartDestServlet)]
+
+    def fetch_as(self, user):
+        with mock.patch.object(SmartDestServlet, "get_current_user", return_value=user):
+            return self.fetch("/", follow_redirects=False)
+
+    def test_redirect_to_accepting_push(self):
+        response = self.fetch_as("bmetin")
+        T.assert_equal(response.code, 302)
+        T.assert_equal(response.headers['Location'], '/push?id=1')
+
+    def test_redirect_to_pushes(self):
+        response = self.fetch_as("otheruser")
+        T.assert_equal(response.headers['Location'], '/pushes')
+
+    def test_redirect_after_push_is_discarded(self):
+        dashboard_queries = db.dashboard_queries(db.users_of_push(1))
+        update_query = db.push_pushes.update().where(db.push_pushes.c.id == 1).values({'state': 'discarded'})
+        db.execute_transaction_cb([update_query] + dashboard_queries, lambda success, _: T.assert_equal(success, True))
+
+        response = self.fetch_as("bmetin")
+        T.assert_equal(response.headers['Location'], '/pushes')
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+
+import testify as T
+from mock import patch
+from pushmanager.core import db
+from pushmanager.testing import testdb
+from pushmanager.testing.mocksettings import MockedSettings
+from pushmanager.testing.testdb import FakeDataMixin
+from tools import split_request_comments
+
+
+class SplitRequestCommentsTest(T.TestCase, FakeDataMixin):
+
+    @T.setup_teardown
+    def setup_db(self):
+        self.db_file_path = testdb.create_temp_db_file()
+        MockedSettings['db_uri'] = testdb.get_temp_db_uri(self.db_file_path)
+        with patch.dict(db.Settings, MockedSettings):
+            db.init_db()
+            self.insert_requests()
+            yield
+            db.finalize_db()
+            os.unlink(self.db_file_path)
+
+    def on_db_return(self, success, db_results):
+        assert success
+
+    def test_split_comments(self):
+        T.assert_equal(split_request_comments.split_comments('no comment'), ('no comment', []))
+        T.assert_equal(split_request_comments.split_comments(None), ('', []))
+        T.assert_equal(
+            split_request_comments.split_comments(
+                'please\n\n---\n\nComment from pm1:\n\nlooks good\n\n'
+                '---\n\nComment from pm2:\n\nconflicts:\nfoo.py'
+            ),
+            ('please', [('pm1', 'looks good'), ('pm2', 'conflicts:\nfoo.py')])
+        )
+
+    def test_split_request_comments(self):
+        db.execute_cb(
+            db.push_requests.update().where(db.push_requests.c.id == 11).values({
+                'comments': 'yes comment\n\n---\n\nComment from pm1:\n\nfirst\n\n---\n\nComment from pm2:\n\nsecond',
+            }),
+            self.on_db_return
+        )
+        split_request_comments.split_request_comments()
+
+        def on_comments(success, db_results):
+            assert success
+            T.assert_equal(
+                [(row['request'], row['user'], row['comment']) for row in db_results],
+                [(11, 'pm1', 'first'), (11, 'pm2', 'second')]
+            )
+        db.execute_cb(
+            db.push_requestcomments.select(order_by=db.push_requestcomments.c.id),
+            on_comments
+        )
+
+        def on_requests(success, db_results):
+            assert success
+            T.assert_equal(
+                sorted(row['comments'] for row in db_results),
+                ['no comment', 'no comment', 'yes comment', 'yes comment']
+            )
+        db.execute_cb(db.push_requests.select(), on_requests)
+
+
+if __name__ == '__main__':
+    T.run()
@@ -35,8 +35,10 @@ class PushTemplateTest(TemplateTestCase):
             'page_title': 'fake_push_title',
             'push_contents': {},
             'available_requests': [],
+            'conflict_plan': None,
             'fullrepo': 'not/a/repo',
             'override': False,
+            'archive': 0,
             'push_survey_url': None
             }
 
@@ -140,6 +142,17 @@ class PushTemplateTest(TemplateTestCase):
 
         T.assert_equal(1, len(found_h3))
 
+        links = [a for a in tree.iter('a') if a.get('id') == 'include-archived']
+        T.assert_equal([a.get('href') for a in links], ['/push?id=0&archive=1'])
+
+    def test_push_status_with_archive(self):
+        push = dict(self.basic_push)
+        push['state'] = 'live'
+        kwargs = dict(self.basic_kwargs, archive=1)
+
+        tree = self.render_etree(self.push_page, push_info=push, **kwargs)
+        T.assert_equal([a for a in tree.iter('a') if a.get('id') == 'include-archived'], [])
+
     def generate_push_contents(self, requests):
         push_contents = dict.fromkeys(self.accepting_push_sections, [])
         for section in self.accepting_push_sections:
@@ -249,6 +262,29 @@ class PushTemplateTest(TemplateTestCase):
 
         T.assert_equal(5, len(found_mockreq))
 
+    def test_conflict_plan(self):
+        pickmes = [dict(self.basic_request, id=request_id, title='pickme %d' % request_id) for request_id in (1, 2)]
+        kwargs = dict(self.basic_kwargs)
+        kwargs['push_contents'] = {'pickme': pickmes, 'all': pickmes}
+        kwargs['current_user'] = self.basic_push['user']
+        kwargs['conflict_plan'] = {
+            'weight': 'count',
+            'accept': [2],
+            'excluded': [{'id': 1, 'reason': 'conflict-pickme', 'conflicts': [2]}],
+        }
+
+        with self.no_ui_modules():
+            tree = self.render_etree(
+                self.push_status_page,
+                push_info=self.basic_push,
+                **kwargs)
+
+        plan = tree.xpath("//div[@id='conflict-plan']")[0]
+        T.assert_equal([li.attrib['request'] for li in plan.xpath("ol/li")], ['2'])
+        T.assert_equal(plan.xpath("ol/li/a")[0].text, 'pickme 2')
+        T.assert_equal([li.attrib['excluded'] for li in plan.xpath("ul/li")], ['1'])
+        T.assert_equal(len(plan.xpath("button[@id='select-conflict-plan']")), 1)
+
     def test_include_push_survey_exists(self):
         push = dict(self.basic_push)
         push['state'] = 'live'
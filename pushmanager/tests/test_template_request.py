@@ -38,6 +38,7 @@ class RequestTemplateTest(TemplateTestCase):
             'tags': None,
             'conflicts': None,
             'show_state_inline': False,
+            'archive': False,
             'review': None,
             'repo_url': 'non://existent',
             'branch_url': 'non://existent',
@@ -77,6 +78,37 @@ class RequestTemplateTest(TemplateTestCase):
 
         T.assert_equal(1, len(found_ul))
 
+    def request_details(self, request):
+        tree = self.render_module_request_with_users(request, 'testuser', 'testuser', **self.basic_kwargs)
+        return [div.get('class') for div in tree.iter('div') if div.get('class', '').startswith('request-')]
+
+    def test_request_details(self):
+        request = dict(self.basic_request, conflicts='<strong>Conflict</strong>')
+        T.assert_equal(self.request_details(request), [
+            'request-module', 'request-info-extended', 'request-conflicts',
+            'request-description', 'request-revision', 'request-comments',
+            'request-comment-thread',
+        ])
+
+    def test_request_details_loaded_on_expand(self):
+        # Summaries of requests leave the details to request.js
+        summary = dict(
+            (k, v) for k, v in self.basic_request.items()
+            if k not in ('conflicts', 'description', 'comments')
+        )
+        T.assert_equal(self.request_details(summary), [
+            'request-module', 'request-info-extended', 'request-details', 'request-revision',
+            'request-comment-thread',
+        ])
+
+    def test_archived_request_details(self):
+        kwargs = dict(self.basic_kwargs, archive=True)
+        tree = self.render_module_request_with_users(self.basic_request, 'testuser', 'testuser', **kwargs)
+        # request.js loads the details of archived requests with archive=1
+        module = tree.find(".//div[@class='request-module']")
+        T.assert_equal(module.get('archive'), '1')
+        T.assert_in('/request?id=0&archive=1', [a.get('href') for a in tree.iter('a')])
+
     def test_request_info_user_title(self):
         request = dict(self.basic_request)
         request['watchers'] = 'watcher1, watcher2'
@@ -1,7 +1,9 @@
 import mock
 import testify as T
+from pushmanager import ui_modules
 from pushmanager.ui_modules import Request
 from pushmanager.core.settings import Settings
+from pushmanager.core.util import LRUCache
 from pushmanager.testing.mocksettings import MockedSettings
 
 
@@ -30,3 +32,68 @@ class UIModuleTest(T.TestCase):
         with mock.patch.dict(Settings, MockedSettings):
             gen_tags = request._generate_tag_list(request_info, 'repo')
             T.assert_equals(gen_tags[0][1], 'https://example.com/?p=repo.git;a=log;h=refs/heads/test')
+
+    def make_request_info(self, **kwargs):
+        request_info = {
+            'id': 1,
+            'user': 'testuser',
+            'watchers': None,
+            'modified': 1000,
+            'revision': '0' * 40,
+            'state': 'requested',
+        }
+        request_info.update(kwargs)
+        return request_info
+
+    @T.setup_teardown
+    def clear_request_cache(self):
+        ui_modules.request_cache.clear()
+        yield
+        ui_modules.request_cache.clear()
+
+    def render_cached(self, module, request_info, **kwargs):
+        def fake_render(request, pretty_date, **kwargs):
+            return 'entry %s %s' % (request['state'], pretty_date(request['modified']))
+        with mock.patch.object(Request, '_render', side_effect=fake_render) as render:
+            return module.render(request_info, **kwargs), render.call_count
+
+    def test_render_cached(self):
+        module = Request(StubHandler())
+        request_info = self.make_request_info()
+        with mock.patch.object(ui_modules.util, 'pretty_date', return_value='just now'):
+            T.assert_equal(self.render_cached(module, request_info), ('entry requested just now', 1))
+            T.assert_equal(self.render_cached(module, request_info), ('entry requested just now', 0))
+        with mock.patch.object(ui_modules.util, 'pretty_date', return_value='a minute ago'):
+            T.assert_equal(self.render_cached(module, request_info), ('entry requested a minute ago', 0))
+
+    def test_render_cache_key(self):
+        module = Request(StubHandler())
+        self.render_cached(module, self.make_request_info())
+        # Updates that don't touch modified, different viewers and flags
+        T.assert_equal(self.render_cached(module, self.make_request_info(state='pickme'))[1], 1)
+        T.assert_equal(self.render_cached(module, self.make_request_info(user='curr_user'))[1], 1)
+        T.assert_equal(self.render_cached(module, self.make_request_info(), pushmaster=True)[1], 1)
+        T.assert_equal(self.render_cached(module, self.make_request_info(), tags=[])[1], 1)
+        T.assert_equal(self.render_cached(module, self.make_request_info(), tags=[])[1], 1)
+        T.assert_equal(len(ui_modules.request_cache), 4)
+
+    def test_render_cache_key_is_small(self):
+        module = Request(StubHandler())
+        self.render_cached(module, self.make_request_info(description='x' * 100000))
+        key, = ui_modules.request_cache.entries.keys()
+        T.assert_lt(len(repr(key)), 1000)
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        T.assert_equal(cache.get('a'), 1)
+        cache['c'] = 3
+        T.assert_equal(cache.get('b'), None)
+        T.assert_equal(cache.get('a'), 1)
+        T.assert_equal(cache.get('c'), 3)
+        T.assert_equal(len(cache), 2)
+
+        disabled = LRUCache(0)
+        disabled['a'] = 1
+        T.assert_equal(disabled.get('a'), None)
@@ -1,14 +1,38 @@
 import datetime
+import hashlib
 import os
+import re
 
+from pushmanager.core import metrics
 from pushmanager.core import util
 from pushmanager.core.settings import Settings
+from pushmanager.ui_methods import authorized_to_manage_request
 from tornado.web import UIModule
 
 
+# Rendered request entries, see Request.render
+request_cache = util.LRUCache(Settings['main_app']['request_cache_size'])
+
+# Cached entries carry this marker instead of relative dates. Escaped
+# request fields can't contain '<', so it can't be forged.
+PRETTY_DATE_MARKER = '<!--pretty_date:%d-->'
+PRETTY_DATE_MARKER_RE = re.compile(r'<!--pretty_date:(\d+)-->')
+
+
+def _pretty_date_marker(time):
+    return PRETTY_DATE_MARKER % time
+
+
+def _fill_pretty_dates(fragment):
+    return PRETTY_DATE_MARKER_RE.sub(lambda match: util.pretty_date(int(match.group(1))), fragment)
+
+
 class Request(UIModule):
     """Displays an individual request entry with expandable details/comments."""
 
+    # Keyword arguments the rendered entry can be cached for
+    CACHED_FLAGS = ('archive', 'edit_buttons', 'expand', 'push_buttons', 'pushmaster', 'show_ago', 'show_state_inline')
+
     def javascript_files(self):
         return [self.handler.static_url('js/modules/request.js')]
 
@@ -16,6 +40,9 @@ class Request(UIModule):
         return [self.handler.static_url('css/modules/request.css')]
 
     def render(self, request, **kwargs):
+        # Whether the request may have been archived, its details are then
+        # loaded with archive=1
+        kwargs.setdefault('archive', False)
         # Whether or not to show the 'Edit'/'Takeover' button
         kwargs.setdefault('edit_buttons', False)
         # Whether to automatically expand this entry (only used on /request)
@@ -29,6 +56,27 @@ class Request(UIModule):
         # Whether or not to show state (requested, added, etc) at the end of the entry
         kwargs.setdefault('show_state_inline', False)
 
+        if set(kwargs) - set(self.CACHED_FLAGS):
+            return self._render(request, util.pretty_date, **kwargs)
+
+        # Not every update of a request changes its modified time, all of its
+        # fields are part of the key. So are the permissions of the viewer.
+        # The fields are digested, entries don't keep a copy of the row.
+        key = (
+            request['id'],
+            hashlib.sha1(repr(sorted(request.iteritems()))).digest(),
+            request['user'] == self.current_user,
+            authorized_to_manage_request(None, request, self.current_user, kwargs['pushmaster']),
+            tuple(kwargs[flag] for flag in self.CACHED_FLAGS),
+        )
+        fragment = request_cache.get(key)
+        metrics.cache_lookup('request-fragment', fragment is not None)
+        if fragment is None:
+            fragment = self._render(request, _pretty_date_marker, **kwargs)
+            request_cache[key] = fragment
+        return _fill_pretty_dates(fragment)
+
+    def _render(self, request, pretty_date, **kwargs):
         if request['repo'] != Settings['git']['main_repository']:
             kwargs['cherry_string'] = '%s/%s' % (request['repo'], request['branch'])
         else:
@@ -66,7 +114,7 @@ class Request(UIModule):
         kwargs.setdefault('create_time', datetime.datetime.fromtimestamp(request['created']).strftime("%x %X"))
         kwargs.setdefault('modify_time', datetime.datetime.fromtimestamp(request['modified']).strftime("%x %X"))
 
-        return self.render_string('modules/request.html', request=request, pretty_date=util.pretty_date, **kwargs)
+        return self.render_string('modules/request.html', request=request, pretty_date=pretty_date, **kwargs)
 
     def _generate_tag_list(self, request, repo):
         tags = dict((tag, None) for tag in (request['tags'].split(',') if request['tags'] else []))
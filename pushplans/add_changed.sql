@@ -0,0 +1,25 @@
+/*
+Add changed column to push_requests.
+*/
+
+# MySQL Syntax
+ALTER TABLE `push_requests`
+  ADD COLUMN `changed` int(11) default NULL AFTER `watchers`,
+  ADD INDEX `ix_push_requests_changed` (`changed`);
+
+/* ROLLBACK COMMANDS
+
+ALTER TABLE `push_requests`
+  DROP INDEX `ix_push_requests_changed`,
+  DROP COLUMN `changed`;
+
+*/
+
+# Sqlite3 Syntax
+# WARNING: BACKUP DATABASE FIRST!
+# sqlite3 has no rollback equivalent for add column
+/*
+ALTER TABLE 'push_requests'
+  ADD COLUMN 'changed' INTEGER;
+CREATE INDEX 'ix_push_requests_changed' ON 'push_requests' ('changed');
+*/
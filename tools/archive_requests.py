@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Moves requests that went live or were discarded more than archive.max_age
+days ago to the archive tables (see pushmanager/core/archive.py).
+
+With an appropriate config.yaml running from the root of the pushmanager-service:
+python -u tools/archive_requests.py [max_age]
+
+Meant to be run periodically, e.g. from cron. Archived requests are only
+returned by the APIs when asked for with archive=1.
+"""
+import sys
+from optparse import OptionParser
+
+import pushmanager.core.db as db
+from pushmanager.core.archive import archive_requests
+from pushmanager.core.settings import Settings
+
+
+def main():
+    usage = 'usage: %prog [max_age]'
+    parser = OptionParser(usage)
+    (_, args) = parser.parse_args()
+
+    if len(args) <= 1:
+        max_age = int(args[0]) if args else Settings['archive']['max_age']
+        db.init_db()
+        print 'Archiving requests older than %d days' % max_age
+        archived = archive_requests(max_age, Settings['archive']['batch_size'])
+        print 'Archived %d requests' % archived
+        db.finalize_db()
+    else:
+        parser.error('Incorrect number of arguments')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
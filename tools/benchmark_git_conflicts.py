@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks pickme conflict detection against synthetic git repositories.
+
+With an appropriate config.yaml running from the root of the pushmanager-service:
+python -u tools/benchmark_git_conflicts.py --push-sizes 5,10,25 --output results.json
+
+Everything happens in a temporary directory; no network access is needed.
+A bare main repository, --dev-repos developer repositories and --submodules
+submodule repositories are created and served over file://, and
+Settings['git'] is pointed at them. One branch is created per pickme:
+--overlap of them edit one of --hot-lines lines of a shared file (and
+conflict with the branches editing the same line), --submodule-bumps of them move a submodule, the others edit
+files of their own.
+
+For every push size a push with that many pickmes is stored in a temporary
+database, and every pickme in it is rechecked for conflicts the way a
+conflict queue worker does it. The first pass starts from a fresh local
+clone of master, later passes (--passes) reuse the fetched branches. The
+wall time, the number of git processes started, the blocks read and
+written by pushmanager and its children, and the numbers of pickme pairs
+pruned by their changed paths or merged are written to the output file as
+JSON.
+"""
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from pushmanager.core import db
+from pushmanager.core import metrics
+from pushmanager.core.git import GitCommand
+from pushmanager.core.git import GitQueryService
+from pushmanager.core.git import GitQueue
+from pushmanager.core.settings import Settings
+from pushmanager.testing import testdb
+from pushmanager.testing.benchmark import write_results
+
+
+HOT_FILE = 'hot.py'
+PUSHMANAGER_URL = 'https://pushmanager.example.com'
+
+
+def git(*args, **kwargs):
+    kwargs.setdefault('timeout', None)
+    return GitCommand(*args, **kwargs).run()[1].strip()
+
+
+def commit_all(cwd, message):
+    git('add', '-A', '.', cwd=cwd)
+    git('commit', '-q', '-m', message, cwd=cwd)
+    return git('rev-parse', 'HEAD', cwd=cwd)
+
+
+def init_scratch_repo(path):
+    git('init', '-q', path, cwd=os.path.dirname(path))
+    git('config', 'user.email', 'bench@pushmanager', cwd=path)
+    git('config', 'user.name', 'pushmanager benchmark', cwd=path)
+
+
+class SyntheticRepositories(object):
+    """Builds the repositories and branches of one benchmark run under root."""
+
+    def __init__(self, root, branches, dev_repos, overlap, hot_lines, submodules, submodule_bumps, seed=0):
+        self.root = root
+        self.rand = random.Random(seed)
+        self.branches = branches
+        self.dev_repos = dev_repos
+        self.overlap = overlap
+        self.hot_lines = hot_lines
+        self.submodules = submodules
+        self.submodule_bumps = submodule_bumps
+
+        # Repository paths as _get_repository_uri builds them with an empty
+        # servername: file:///<main_repository>
+        self.main_repository = os.path.join(root, 'main-repository').lstrip('/')
+        self.dev_repositories_dir = os.path.join(root, 'devs').lstrip('/')
+        self.scratch = os.path.join(root, 'scratch')
+
+    def uri(self, path):
+        return 'file:///%s' % path
+
+    def dev_repo(self, branch_index):
+        return 'dev%d' % (branch_index % self.dev_repos)
+
+    def build(self):
+        os.makedirs(self.scratch)
+        submodule_paths = self._build_submodules()
+        self._build_main(submodule_paths)
+
+        os.makedirs('/' + self.dev_repositories_dir)
+        for i in range(self.dev_repos):
+            git(
+                'clone', '-q', '--bare', self.uri(self.main_repository),
+                '/' + os.path.join(self.dev_repositories_dir, 'dev%d' % i),
+                cwd=self.root
+            )
+
+        branches = []
+        for i in range(self.branches):
+            branches.append(self._build_branch(i, submodule_paths))
+        return branches
+
+    def _build_submodules(self):
+        submodule_paths = []
+        for i in range(self.submodules):
+            path = os.path.join(self.scratch, 'sub%d' % i)
+            init_scratch_repo(path)
+            with open(os.path.join(path, 'lib.py'), 'w') as f:
+                f.write('VERSION = 0\n')
+            commit_all(path, 'Initial submodule commit')
+            bare = os.path.join(self.root, 'sub%d.git' % i)
+            git('clone', '-q', '--bare', path, bare, cwd=self.root)
+            git('remote', 'add', 'origin', bare, cwd=path)
+            submodule_paths.append(path)
+        return submodule_paths
+
+    def _build_main(self, submodule_paths):
+        path = os.path.join(self.scratch, 'main')
+        init_scratch_repo(path)
+        with open(os.path.join(path, HOT_FILE), 'w') as f:
+            for line in range(self.hot_lines * 3):
+                f.write('value_%d = %d\n' % (line, line))
+        for i, submodule_path in enumerate(submodule_paths):
+            git(
+                '-c', 'protocol.file.allow=always',
+                'submodule', 'add', '-q', 'file://' + os.path.join(self.root, 'sub%d.git' % i), 'lib%d' % i,
+                cwd=path
+            )
+        commit_all(path, 'Initial commit')
+        git('clone', '-q', '--bare', path, '/' + self.main_repository, cwd=self.root)
+        git('remote', 'add', 'origin', '/' + self.main_repository, cwd=path)
+
+    def _build_branch(self, i, submodule_paths):
+        path = os.path.join(self.scratch, 'main')
+        branch = 'bench_%d' % i
+        git('checkout', '-q', '-b', branch, 'master', cwd=path)
+
+        if self.rand.random() < self.overlap:
+            # Lines are spaced so that only branches picking the same line
+            # conflict with each other
+            line = self.rand.randrange(self.hot_lines) * 3
+            with open(os.path.join(path, HOT_FILE)) as f:
+                lines = f.readlines()
+            lines[line] = 'value_%d = "%s"\n' % (line, branch)
+            with open(os.path.join(path, HOT_FILE), 'w') as f:
+                f.writelines(lines)
+        else:
+            with open(os.path.join(path, '%s.py' % branch), 'w') as f:
+                f.write('BRANCH = "%s"\n' % branch)
+
+        if submodule_paths and self.rand.random() < self.submodule_bumps:
+            k = self.rand.randrange(len(submodule_paths))
+            submodule_path = submodule_paths[k]
+            git('checkout', '-q', 'master', cwd=submodule_path)
+            git('pull', '-q', 'origin', 'master', cwd=submodule_path)
+            with open(os.path.join(submodule_path, 'lib.py'), 'w') as f:
+                f.write('VERSION = "%s"\n' % branch)
+            sha = commit_all(submodule_path, 'Bump for %s' % branch)
+            git('push', '-q', 'origin', 'master', cwd=submodule_path)
+            git('update-index', '--cacheinfo', '160000,%s,lib%d' % (sha, k), cwd=path)
+
+        sha = commit_all(path, 'Change %s' % branch)
+        git(
+            'push', '-q', '/' + os.path.join(self.dev_repositories_dir, self.dev_repo(i)),
+            '%s:refs/heads/%s' % (branch, branch),
+            cwd=path
+        )
+        git('checkout', '-q', 'master', cwd=path)
+        return {'repo': self.dev_repo(i), 'branch': branch, 'revision': sha}
+
+
+class GitProcessCounter(object):
+    """Counts git processes started through GitCommand while active."""
+
+    def __init__(self):
+        self.count = 0
+        self.original_init = None
+
+    def __enter__(self):
+        self.original_init = GitCommand.__init__
+        counter = self
+
+        def counting_init(command, *args, **kwargs):
+            counter.count += 1
+            counter.original_init(command, *args, **kwargs)
+        GitCommand.__init__ = counting_init
+        return self
+
+    def __exit__(self, *exc_info):
+        GitCommand.__init__ = self.original_init
+
+
+def get_block_io():
+    """Returns blocks read and written by this process and its waited-for
+    children so far."""
+    reads = writes = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        reads += usage.ru_inblock
+        writes += usage.ru_oublock
+    return reads, writes
+
+
+def insert_push(push_id, branches):
+    now = int(time.time())
+    queries = [db.push_pushes.insert({
+        'id': push_id, 'title': 'Push of %d' % len(branches), 'user': 'bench', 'branch': 'deploy-%d' % push_id,
+        'state': 'accepting', 'created': now, 'modified': now, 'pushtype': 'regular', 'extra_pings': '',
+    })]
+    request_ids = []
+    for branch in branches:
+        request_id = push_id * 10000 + len(request_ids)
+        queries.append(db.push_requests.insert({
+            'id': request_id, 'user': branch['repo'], 'state': 'pickme', 'repo': branch['repo'],
+            'branch': branch['branch'], 'revision': branch['revision'], 'tags': 'git-ok,no-conflicts',
+            'conflicts': '', 'created': now, 'modified': now, 'title': branch['branch'],
+            'comments': '', 'description': '', 'watchers': '',
+        }))
+        queries.append(db.push_pushcontents.insert({'request': request_id, 'push': push_id}))
+        request_ids.append(request_id)
+    db.execute_transaction_cb(queries, check_db_results)
+    return request_ids
+
+
+def reset_requests(request_ids):
+    db.execute_cb(
+        db.push_requests.update().where(
+            db.push_requests.c.id.in_(request_ids)
+        ).values({'tags': 'git-ok,no-conflicts', 'conflicts': ''}),
+        check_db_results
+    )
+
+
+def count_conflicts(request_ids):
+    result = [0]
+
+    def on_db_return(success, db_results):
+        check_db_results(success, db_results)
+        result[0] = len([r for r in db_results if 'conflict-' in r['tags']])
+
+    db.execute_cb(db.push_requests.select().where(db.push_requests.c.id.in_(request_ids)), on_db_return)
+    return result[0]
+
+
+def close_query_services():
+    for service in GitQueryService._services.values():
+        service.close()
+
+
+def count_conflict_checks():
+    """Returns the numbers of pickme pairs pruned and merged so far."""
+    counters, _ = metrics.collect()
+    return [
+        counters.get(('pushmanager_conflict_checks_total', (('result', result),)), 0)
+        for result in ('pruned', 'merged')
+    ]
+
+
+def recheck_push(request_ids):
+    """Rechecks every pickme of a push the way the conflict queue would."""
+    reset_requests(request_ids)
+    pruned, merged = count_conflict_checks()
+    reads, writes = get_block_io()
+    start = time.time()
+    with GitProcessCounter() as counter:
+        for request_id in request_ids:
+            GitQueue.test_pickme_conflicts(0, request_id, PUSHMANAGER_URL, requeue=False)
+        # Reap long running query processes so their I/O is accounted for
+        close_query_services()
+    wall_time = time.time() - start
+    end_reads, end_writes = get_block_io()
+    end_pruned, end_merged = count_conflict_checks()
+    return {
+        'wall_time': wall_time,
+        'git_processes': counter.count,
+        'read_blocks': end_reads - reads,
+        'write_blocks': end_writes - writes,
+        'conflicts': count_conflicts(request_ids),
+        'pruned_pairs': end_pruned - pruned,
+        'merged_pairs': end_merged - merged,
+    }
+
+
+def run_benchmark(push_sizes, passes, dev_repos, overlap, hot_lines, submodules, submodule_bumps, output):
+    root = tempfile.mkdtemp(prefix='pushmanager-bench-')
+    db_file = testdb.create_temp_db_file()
+    # Submodules are cloned over file://, which recent git only allows
+    # when asked to. Merges need an identity even on unconfigured hosts.
+    os.environ.update({
+        'GIT_CONFIG_COUNT': '1',
+        'GIT_CONFIG_KEY_0': 'protocol.file.allow',
+        'GIT_CONFIG_VALUE_0': 'always',
+        'GIT_AUTHOR_NAME': 'pushmanager benchmark',
+        'GIT_AUTHOR_EMAIL': 'bench@pushmanager',
+        'GIT_COMMITTER_NAME': 'pushmanager benchmark',
+        'GIT_COMMITTER_EMAIL': 'bench@pushmanager',
+    })
+    # Notifications can't be delivered here, don't report each of them
+    log_level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    try:
+        repos = SyntheticRepositories(
+            root, max(push_sizes), dev_repos, overlap, hot_lines, submodules, submodule_bumps
+        )
+        print 'Building %d branches in %s...' % (max(push_sizes), root)
+        branches = repos.build()
+
+        Settings['db_uri'] = testdb.get_temp_db_uri(db_file)
+        Settings['git'] = dict(Settings['git'], **{
+            'scheme': 'file',
+            'auth': '',
+            'port': '',
+            'servername': '',
+            'main_repository': repos.main_repository,
+            'dev_repositories_dir': repos.dev_repositories_dir,
+            'use_local_mirror': False,
+        })
+        db.init_db()
+
+        results = {}
+        for push_id, size in enumerate(push_sizes, 1):
+            request_ids = insert_push(push_id, branches[:size])
+
+            # Every push size starts from a fresh clone of master
+            Settings['git']['local_repo_path'] = os.path.join(root, 'local-%d' % size)
+            GitQueue.shas_in_master = {}
+            GitQueryService._services = {}
+            GitQueue.create_or_update_local_repo(0, Settings['git']['main_repository'], 'master', fetch=True)
+
+            results[str(size)] = []
+            for i in range(passes):
+                result = recheck_push(request_ids)
+                results[str(size)].append(result)
+                pairs = result['pruned_pairs'] + result['merged_pairs']
+                print (
+                    '%4d pickmes, pass %d: %7.2fs  %6d git processes  %8d blocks read  %8d written  %d conflicts'
+                    '  %d%% of pairs pruned'
+                ) % (
+                    size, i + 1, result['wall_time'], result['git_processes'],
+                    result['read_blocks'], result['write_blocks'], result['conflicts'],
+                    100 * result['pruned_pairs'] / pairs if pairs else 0,
+                )
+
+        return write_results(
+            output,
+            'git_conflicts',
+            {
+                'push_sizes': push_sizes,
+                'passes': passes,
+                'dev_repos': dev_repos,
+                'overlap': overlap,
+                'hot_lines': hot_lines,
+                'submodules': submodules,
+                'submodule_bumps': submodule_bumps,
+            },
+            results,
+        )
+    finally:
+        logging.getLogger().setLevel(log_level)
+        close_query_services()
+        db.finalize_db()
+        os.unlink(db_file)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def check_db_results(success, db_results):
+    if not success:
+        raise db.DatabaseError()
+
+
+def main():
+    usage = 'usage: %prog [options]'
+    parser = OptionParser(usage)
+    parser.add_option('--push-sizes', default='5,10,25', help='comma separated numbers of pickmes per push')
+    parser.add_option('--passes', type='int', default=2, help='rechecks of every push')
+    parser.add_option('--dev-repos', type='int', default=4, help='number of developer repositories')
+    parser.add_option('--overlap', type='float', default=0.3,
+                      help='fraction of branches editing lines shared with other branches')
+    parser.add_option('--hot-lines', type='int', default=10, help='number of shared lines branches edit')
+    parser.add_option('--submodules', type='int', default=1, help='number of submodules')
+    parser.add_option('--submodule-bumps', type='float', default=0.2,
+                      help='fraction of branches moving a submodule')
+    parser.add_option('--output', default='benchmark-git-conflicts.json', help='file to write the results to')
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error('Unexpected arguments')
+
+    run_benchmark(
+        [int(size) for size in options.push_sizes.split(',')],
+        options.passes,
+        options.dev_repos,
+        options.overlap,
+        options.hot_lines,
+        options.submodules,
+        options.submodule_bumps,
+        options.output,
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
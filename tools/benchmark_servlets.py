@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks API endpoints and pages against a large generated database.
+
+With an appropriate config.yaml running from the root of the pushmanager-service:
+python -u tools/benchmark_servlets.py --output results.json
+
+A temporary SQLite database is seeded with --requests requests spread over
+--pushes pushes, --open-pushes of which are still accepting and carry
+--pickmes pickmes each. Every target is then requested --iterations times in
+a row through an HTTP client, and its throughput and p50/p95/p99 latencies
+(in seconds) are written to the output file as JSON.
+"""
+import os
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+import pushmanager.ui_methods as ui_methods
+import pushmanager.ui_modules as ui_modules
+from pushmanager.core import db
+from pushmanager.core.settings import Settings
+from pushmanager.core.util import get_servlet_urlspec
+from pushmanager.servlets.api import APIServlet
+from pushmanager.servlets.push import PushServlet
+from pushmanager.servlets.pushes import PushesServlet
+from pushmanager.servlets.pushitems import PushItemsServlet
+from pushmanager.servlets.requests import RequestsServlet
+from pushmanager.testing import testdb
+from pushmanager.testing.benchmark import BenchDataMixin
+from pushmanager.testing.benchmark import summarize_latencies
+from pushmanager.testing.benchmark import write_results
+
+
+SERVLETS = (APIServlet, PushServlet, PushesServlet, PushItemsServlet, RequestsServlet)
+
+BENCH_USER = 'benchuser0'
+
+
+def get_targets(dataset):
+    """Returns (name, path) pairs of everything to benchmark."""
+    open_push = dataset['open_pushes'][-1] if dataset['open_pushes'] else 1
+    live_push = dataset['live_pushes'][-1] if dataset['live_pushes'] else 1
+    return [
+        ('api/pushdata', '/api/pushdata?id=%d' % open_push),
+        ('api/pushes', '/api/pushes?rpp=50'),
+        ('api/requestsearch', '/api/requestsearch?user=%s&limit=100' % BENCH_USER),
+        ('api/pushitems', '/api/pushitems?push_id=%d' % live_push),
+        ('page/pushes', '/pushes'),
+        ('page/push', '/push?id=%d' % open_push),
+        ('page/requests', '/requests?user=%s' % BENCH_USER),
+        ('page/pushitems', '/pushitems?push=%d' % live_push),
+    ]
+
+
+def make_application():
+    return tornado.web.Application(
+        [get_servlet_urlspec(servlet) for servlet in SERVLETS],
+        static_path=os.path.join(os.path.dirname(ui_modules.__file__), "static"),
+        template_path=os.path.join(os.path.dirname(ui_modules.__file__), "templates"),
+        login_url="/login",
+        cookie_secret=Settings['cookie_secret'],
+        ui_modules=ui_modules,
+        ui_methods=ui_methods,
+        autoescape=None,
+    )
+
+
+def start_server(application):
+    """Serves application from a background thread, returns its port and a
+    function stopping it."""
+    [sock] = tornado.netutil.bind_sockets(0, address='127.0.0.1')
+    port = sock.getsockname()[1]
+    io_loop = tornado.ioloop.IOLoop.instance()
+    server = tornado.httpserver.HTTPServer(application, io_loop=io_loop)
+    server.add_sockets([sock])
+    thread = threading.Thread(target=io_loop.start)
+    thread.daemon = True
+    thread.start()
+
+    def stop():
+        io_loop.add_callback(server.stop)
+        io_loop.add_callback(io_loop.stop)
+        thread.join()
+    return port, stop
+
+
+def run_target(client, url, cookie, iterations):
+    latencies = []
+    errors = 0
+    start = time.time()
+    for _ in range(iterations):
+        request_start = time.time()
+        try:
+            client.fetch(url, headers={'Cookie': cookie}, follow_redirects=False)
+        except tornado.httpclient.HTTPError:
+            errors += 1
+            continue
+        latencies.append(time.time() - request_start)
+    return summarize_latencies(latencies, time.time() - start, errors)
+
+
+def run_benchmark(requests, pushes, open_pushes, pickmes, iterations, output):
+    db_file = testdb.create_temp_db_file()
+    application = make_application()
+    Settings['db_uri'] = testdb.get_temp_db_uri(db_file)
+    try:
+        db.init_db()
+        print 'Seeding %d requests in %d pushes...' % (requests, pushes)
+        dataset = BenchDataMixin().insert_bench_data(
+            requests=requests,
+            pushes=pushes,
+            open_pushes=open_pushes,
+            pickmes_per_push=pickmes,
+        )
+
+        port, stop_server = start_server(application)
+        # Pages fetch their data from the API of the same server
+        Settings['api_app'] = {'servername': '127.0.0.1', 'port': port}
+        cookie = 'user=%s' % tornado.web.create_signed_value(Settings['cookie_secret'], 'user', BENCH_USER)
+        client = tornado.httpclient.HTTPClient()
+
+        results = {}
+        try:
+            for name, path in get_targets(dataset):
+                url = 'http://127.0.0.1:%d%s' % (port, path)
+                # Warm up caches and connections
+                run_target(client, url, cookie, 1)
+                results[name] = run_target(client, url, cookie, iterations)
+                print '%-20s %8.1f req/s  p50 %.4fs  p95 %.4fs  p99 %.4fs  errors %d' % (
+                    name,
+                    results[name]['throughput'] or 0,
+                    results[name]['p50'] or 0,
+                    results[name]['p95'] or 0,
+                    results[name]['p99'] or 0,
+                    results[name]['errors'],
+                )
+        finally:
+            client.close()
+            stop_server()
+
+        return write_results(
+            output,
+            'servlets',
+            {
+                'requests': requests,
+                'pushes': pushes,
+                'open_pushes': open_pushes,
+                'pickmes': pickmes,
+                'iterations': iterations,
+            },
+            results,
+        )
+    finally:
+        db.finalize_db()
+        os.unlink(db_file)
+
+
+def main():
+    usage = 'usage: %prog [options]'
+    parser = OptionParser(usage)
+    parser.add_option('--requests', type='int', default=100000, help='number of requests to generate')
+    parser.add_option('--pushes', type='int', default=10000, help='number of pushes to generate')
+    parser.add_option('--open-pushes', type='int', default=20, help='number of pushes still accepting pickmes')
+    parser.add_option('--pickmes', type='int', default=50, help='number of pickmes in each open push')
+    parser.add_option('--iterations', type='int', default=50, help='requests made to each target')
+    parser.add_option('--output', default='benchmark-servlets.json', help='file to write the results to')
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error('Unexpected arguments')
+
+    run_benchmark(
+        options.requests,
+        options.pushes,
+        options.open_pushes,
+        options.pickmes,
+        options.iterations,
+        options.output,
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Recomputes the dashboards of all users (push_userdashboard) from their
+requests.
+
+With an appropriate config.yaml running from the root of the pushmanager-service:
+python -u tools/rebuild_dashboards.py
+
+Dashboards are kept up to date by pushmanager itself; this is needed once
+after creating the dashboard table on MySQL (see UPDATING), and after
+changing requests or pushes behind pushmanager's back.
+"""
+import sys
+from optparse import OptionParser
+
+import pushmanager.core.db as db
+
+
+def main():
+    usage = 'usage: %prog'
+    parser = OptionParser(usage)
+    (_, args) = parser.parse_args()
+
+    if len(args) == 0:
+        db.init_db()
+        rebuild_dashboards()
+        db.finalize_db()
+    else:
+        parser.error('Incorrect number of arguments')
+
+
+def rebuild_dashboards():
+    print 'Rebuilding the dashboards of all users'
+    db.execute_transaction_cb(db.dashboard_queries(), check_db_results)
+
+
+def check_db_results(success, db_results):
+    if not success:
+        raise db.DatabaseError()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
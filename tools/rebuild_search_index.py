@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Rebuilds the full-text search index (push_requestsearch) from the title,
+description and comments of all push requests.
+
+With an appropriate config.yaml running from the root of the pushmanager-service:
+python -u tools/rebuild_search_index.py
+
+The index is kept in sync by pushmanager itself; this is needed once after
+creating the index table on MySQL (see UPDATING), and after changing requests
+behind pushmanager's back.
+"""
+import sys
+from optparse import OptionParser
+
+import pushmanager.core.db as db
+
+
+def main():
+    usage = 'usage: %prog'
+    parser = OptionParser(usage)
+    (_, args) = parser.parse_args()
+
+    if len(args) == 0:
+        db.init_db()
+        rebuild_search_index()
+        db.finalize_db()
+    else:
+        parser.error('Incorrect number of arguments')
+
+
+def rebuild_search_index():
+    print 'Rebuilding the search index of push requests'
+    db.execute_transaction_cb(db.search_index_queries(), check_db_results)
+
+
+def check_db_results(success, db_results):
+    if not success:
+        raise db.DatabaseError()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Moves the comments pushmasters appended to push_requests.comments into
+push_requestcomments, one row per comment.
+
+With an appropriate config.yaml running from the root of the pushmanager-service:
+python -u tools/split_request_comments.py
+
+Whatever precedes the first appended comment (the comments of the request's
+author) stays in push_requests.comments. The original time of the comments
+is not known, they are all dated at the request's last modification. Running
+it again is harmless: requests without appended comments are left alone.
+"""
+import re
+import sys
+from optparse import OptionParser
+
+import pushmanager.core.db as db
+
+
+# What CommentRequestServlet used to append to push_requests.comments
+COMMENT_SEPARATOR_RE = re.compile(r'\n\n---\n\nComment from ([^:\n]+):\n\n')
+
+
+def main():
+    usage = 'usage: %prog'
+    parser = OptionParser(usage)
+    (_, args) = parser.parse_args()
+
+    if len(args) == 0:
+        db.init_db()
+        split_request_comments()
+        db.finalize_db()
+    else:
+        parser.error('Incorrect number of arguments')
+
+
+def split_comments(comments):
+    """Splits the comments of a request into the comments of its author and
+    a list of (user, comment) appended by pushmasters, oldest first."""
+    parts = COMMENT_SEPARATOR_RE.split(comments or '')
+    return parts[0], zip(parts[1::2], parts[2::2])
+
+
+def split_request_comments():
+    print 'Moving comments on push requests to push_requestcomments'
+
+    select_query = db.push_requests.select(
+        db.push_requests.c.comments.like('%Comment from %')
+    )
+    db.execute_cb(select_query, split_request_comments_callback)
+
+
+def split_request_comments_callback(success, db_results):
+    check_db_results(success, db_results)
+
+    queries = []
+    moved = 0
+    for request in db_results.fetchall():
+        head, comments = split_comments(request['comments'])
+        if not comments:
+            continue
+        moved += len(comments)
+        for user, comment in comments:
+            queries.append(db.push_requestcomments.insert({
+                'request': request['id'],
+                'user': user,
+                'comment': comment,
+                'created': request['modified'] or 0,
+            }))
+        queries.append(db.push_requests.update().where(
+            db.push_requests.c.id == request['id']
+        ).values({'comments': head}))
+
+    print 'Moved %d comments' % moved
+    db.execute_transaction_cb(queries + db.search_index_queries(), check_db_results)
+
+
+def check_db_results(success, db_results):
+    if not success:
+        raise db.DatabaseError()
+
+
+if __name__ == '__main__':
+    sys.exit(main())